@@ -1,53 +1,99 @@
 import os
 
-def clean_csv(file_content):
+import instrumentation
+
+def iter_csv_blocks(file_content):
     """
-    Extracts only the raw CSV data from a Gemini response file.
-    It looks for a fenced code block starting with a line that begins with "```csv"
-    and ends with a line that starts with "```". Only the lines in between are kept.
-    If no such fenced block is found, it returns an empty string.
+    Yields (info, csv_text) for every fenced code block in a Gemini response
+    whose opening line begins with "```csv". info is whatever follows "```csv"
+    on the opening line (e.g. "id=g3" in packed replies) and csv_text holds the
+    nonempty lines up to the closing line that starts with "```".
     """
-    lines = file_content.splitlines()
-    inside_csv_block = False
+    info = None
     csv_lines = []
-    for line in lines:
+    for line in file_content.splitlines():
         stripped = line.strip()
         # Start capturing when the fence with csv is found.
-        if not inside_csv_block and stripped.lower().startswith("```csv"):
-            inside_csv_block = True
+        if info is None and stripped.lower().startswith("```csv"):
+            info = stripped[len("```csv"):].strip()
             continue  # Skip the opening fence
         # End capturing when closing fence is reached.
-        if inside_csv_block and stripped.startswith("```"):
-            inside_csv_block = False
-            break
-        if inside_csv_block:
+        if info is not None and stripped.startswith("```"):
+            yield info, "\n".join(csv_lines)
+            info = None
+            csv_lines = []
+            continue
+        if info is not None:
             # Only record nonempty lines
             if stripped:
                 csv_lines.append(line)
-    return "\n".join(csv_lines)
+    # An unterminated block runs to the end of the response.
+    if info is not None:
+        yield info, "\n".join(csv_lines)
+
+def clean_csv(file_content):
+    """
+    Extracts only the raw CSV data from a Gemini response file.
+    It looks for a fenced code block starting with a line that begins with "```csv"
+    and ends with a line that starts with "```". Only the lines in between are kept.
+    A response without any fence is taken to be CSV already, as
+    send_csv_to_gemini.extract_csv leaves a reply that was only a fenced
+    block. If there is a fence but no csv block, it returns an empty string.
+    """
+    for _, csv_text in iter_csv_blocks(file_content):
+        return csv_text
+    if "```" not in file_content:
+        return "\n".join(line for line in file_content.splitlines() if line.strip())
+    return ""
 
 def process_csv_files(input_dir, output_dir):
     # Create the output directory if it doesn't exist.
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Process each file in the input directory.
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".csv"):
-            input_file = os.path.join(input_dir, filename)
-            with open(input_file, "r", encoding="utf-8") as f:
-                content = f.read()
-            print(f"Processing file: {input_file}")
+    with instrumentation.span("clean"):
+        # Process each file in the input directory.
+        for filename in os.listdir(input_dir):
+            if filename.endswith(".csv"):
+                input_file = os.path.join(input_dir, filename)
+                with open(input_file, "r", encoding="utf-8") as f:
+                    content = f.read()
+                instrumentation.log(f"Processing file: {input_file}")
+
+                cleaned_csv = clean_csv(content)
+                if not cleaned_csv:
+                    print(f"No CSV block found in {filename}, skipping.")
+                    instrumentation.count("clean_failures")
+                    continue
 
+                output_file = os.path.join(output_dir, filename)
+                with open(output_file, "w", encoding="utf-8") as f:
+                    f.write(cleaned_csv)
+                instrumentation.count("cleaned_groups")
+                instrumentation.log(f"Cleaned CSV saved to: {output_file}")
+
+def clean_store(store):
+    """
+    Store counterpart of process_csv_files: cleans the "enriched" groups of a
+    group_store.GroupStore whose cleaned result is missing or out of date and
+    writes them to the "cleaned" stage. Groups without a CSV block are
+    recorded as failed. Returns the number of groups cleaned.
+    """
+    with instrumentation.span("clean"):
+        cleaned = []
+        for filename, content, digest in store.stale("cleaned", "enriched"):
             cleaned_csv = clean_csv(content)
             if not cleaned_csv:
                 print(f"No CSV block found in {filename}, skipping.")
+                store.put_error("cleaned", filename, "No CSV block found", digest)
+                instrumentation.count("clean_failures")
                 continue
-
-            output_file = os.path.join(output_dir, filename)
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(cleaned_csv)
-            print(f"Cleaned CSV saved to: {output_file}")
+            cleaned.append((filename, cleaned_csv, digest))
+        store.put_many("cleaned", cleaned)
+        store.prune("cleaned", "enriched")
+    instrumentation.count("cleaned_groups", len(cleaned))
+    print(f"{len(cleaned)} cleaned groups saved to: {store.path}")
+    return len(cleaned)
 
 if __name__ == "__main__":
     input_directory = "gemini_output"   # Folder containing the Gemini output CSV files
@@ -1,6 +1,15 @@
+import io
 import os
 import re
+import csv
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import Workbook
+
+import instrumentation
+
+# Rows per worksheet in .xlsx, including the header row.
+EXCEL_MAX_ROWS = 1048576
 
 def extract_source_identifier(filename):
     """
@@ -12,33 +21,190 @@ def extract_source_identifier(filename):
         return match.group(1)
     return os.path.splitext(filename)[0]
 
+def write_combined(dataframes, output_file):
+    """
+    Concatenates the per-group DataFrames and writes them to a single
+    "Combined" sheet. Returns False if there was nothing to write.
+    """
+    if not dataframes:
+        return False
+    with instrumentation.span("combine.write"):
+        combined_df = pd.concat(dataframes, ignore_index=True)
+        # Write the combined dataframe to an Excel file with a single sheet.
+        combined_df.to_excel(output_file, index=False, sheet_name="Combined")
+    instrumentation.count("combined_rows", len(combined_df))
+    return True
+
+def read_source_csv(input_dir, csv_file):
+    """
+    Reads one cleaned CSV file and adds its source identifier column.
+    """
+    # Read CSV with no header (since there is no header row in these files).
+    df = pd.read_csv(os.path.join(input_dir, csv_file), header=None)
+    # Optionally, add a column to indicate the source file (identifier).
+    df['source'] = extract_source_identifier(csv_file)
+    return df
+
 def combine_csv_to_xlsx(input_dir, output_file):
     # List all CSV files in the given input directory.
     csv_files = [f for f in os.listdir(input_dir) if f.endswith('.csv')]
     dataframes = []
     
-    for csv_file in csv_files:
-        file_path = os.path.join(input_dir, csv_file)
-        try:
-            # Read CSV with no header (since there is no header row in these files).
-            df = pd.read_csv(file_path, header=None)
-        except Exception as e:
-            print(f"Error reading {csv_file}: {e}")
-            continue
-        
-        # Optionally, add a column to indicate the source file (identifier).
-        df['source'] = extract_source_identifier(csv_file)
-        dataframes.append(df)
-        print(f"Processed file: {file_path}")
+    with instrumentation.span("combine.read"):
+        for csv_file in csv_files:
+            file_path = os.path.join(input_dir, csv_file)
+            try:
+                df = read_source_csv(input_dir, csv_file)
+            except Exception as e:
+                print(f"Error reading {csv_file}: {e}")
+                continue
+
+            dataframes.append(df)
+            instrumentation.log(f"Processed file: {file_path}")
     
-    if dataframes:
-        combined_df = pd.concat(dataframes, ignore_index=True)
-        # Write the combined dataframe to an Excel file with a single sheet.
-        combined_df.to_excel(output_file, index=False, sheet_name="Combined")
+    if write_combined(dataframes, output_file):
         print(f"Combined Excel file saved to: {output_file}")
     else:
         print("No CSV files found.")
 
+def _first_row_width(file_path):
+    """
+    Number of fields on the first line of a CSV file, which is the number of
+    columns pd.read_csv(header=None) gives it.
+    """
+    with open(file_path, newline="") as f:
+        for row in csv.reader(f):
+            return len(row)
+    return 0
+
+def _read_or_error(input_dir, csv_file):
+    try:
+        return read_source_csv(input_dir, csv_file), None
+    except Exception as e:
+        return None, e
+
+def combine_csv_to_xlsx_streaming(input_dir, output_file, max_workers=None, max_rows=EXCEL_MAX_ROWS):
+    """
+    Constant-memory variant of combine_csv_to_xlsx: CSV files are parsed by a
+    thread pool and their rows appended straight to a write-only workbook, so
+    only the files currently being parsed are held in memory.
+
+    The sheet is "Combined"; when it reaches max_rows (Excel's limit by
+    default) writing continues on "Combined_2", "Combined_3", ... each with
+    its own header row. Every sheet has the columns 0..N-1 followed by
+    source, where N is the widest first line among the input files.
+    """
+    # List all CSV files in the given input directory.
+    csv_files = [f for f in os.listdir(input_dir) if f.endswith('.csv')]
+    if not csv_files:
+        print("No CSV files found.")
+        return
+
+    width = max(_first_row_width(os.path.join(input_dir, f)) for f in csv_files)
+
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    window = 2 * max_workers
+
+    def parsed():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Keep at most `window` files parsed or in progress, in listing order.
+            futures = [executor.submit(_read_or_error, input_dir, f) for f in csv_files[:window]]
+            for index, csv_file in enumerate(csv_files):
+                df, error = futures[index].result()
+                futures[index] = None
+                if index + window < len(csv_files):
+                    futures.append(executor.submit(_read_or_error, input_dir, csv_files[index + window]))
+                yield os.path.join(input_dir, csv_file), df, error
+
+    with instrumentation.span("combine"):
+        _write_streaming(parsed(), width, output_file, max_rows)
+
+def _write_streaming(frames, width, output_file, max_rows=EXCEL_MAX_ROWS):
+    """
+    Appends (label, DataFrame or None, error) items to a write-only workbook
+    with the sheet layout of combine_csv_to_xlsx_streaming.
+    """
+    columns = list(range(width)) + ['source']
+
+    wb = Workbook(write_only=True)
+    ws = None
+    sheet_count = 0
+    rows_in_sheet = max_rows  # Forces the first sheet to be created.
+    written = 0
+
+    for label, df, error in frames:
+        if error is not None:
+            print(f"Error reading {os.path.basename(label)}: {error}")
+            continue
+
+        values = df.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        padding = [None] * (width - (df.shape[1] - 1))
+        for row in values:
+            if rows_in_sheet >= max_rows:
+                sheet_count += 1
+                ws = wb.create_sheet("Combined" if sheet_count == 1 else f"Combined_{sheet_count}")
+                ws.append(columns)
+                rows_in_sheet = 1
+            row = row.tolist()
+            ws.append(row[:-1] + padding + row[-1:])
+            rows_in_sheet += 1
+        written += 1
+        instrumentation.count("combined_rows", len(values))
+        instrumentation.log(f"Processed file: {label}")
+
+    if written:
+        wb.save(output_file)
+        print(f"Combined Excel file saved to: {output_file}")
+    else:
+        print("No CSV files found.")
+
+def _read_stored(source, csv_text):
+    try:
+        df = pd.read_csv(io.StringIO(csv_text), header=None)
+    except Exception as e:
+        return None, e
+    df['source'] = source
+    return df, None
+
+def combine_store_to_xlsx(store, output_file, streaming=False, max_rows=EXCEL_MAX_ROWS):
+    """
+    Store counterpart of combine_csv_to_xlsx: combines the "cleaned" groups
+    of a group_store.GroupStore, in group file name order, with the source
+    identifier stored alongside each group. With streaming=True rows go
+    straight to a write-only workbook as in combine_csv_to_xlsx_streaming.
+    """
+    items = store.items("cleaned")
+    if not streaming:
+        dataframes = []
+        with instrumentation.span("combine.read"):
+            for filename, source, csv_text in items:
+                df, error = _read_stored(source, csv_text)
+                if error is not None:
+                    print(f"Error reading {filename}: {error}")
+                    continue
+                dataframes.append(df)
+        if write_combined(dataframes, output_file):
+            print(f"Combined Excel file saved to: {output_file}")
+        else:
+            print("No CSV files found.")
+        return
+
+    # The store is scanned twice: once for the widest first line, once to write.
+    width = 0
+    for _, _, csv_text in store.items("cleaned"):
+        for row in csv.reader(io.StringIO(csv_text)):
+            width = max(width, len(row))
+            break
+
+    def parsed():
+        for filename, source, csv_text in items:
+            yield (filename, *_read_stored(source, csv_text))
+
+    with instrumentation.span("combine"):
+        _write_streaming(parsed(), width, output_file, max_rows)
+
 if __name__ == "__main__":
     input_directory = "final cleaned"  # Folder containing the cleaned CSV files
     output_xlsx = "combined.xlsx"       # Output Excel file path
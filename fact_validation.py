@@ -0,0 +1,352 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from taxonomy_index import XBRLI_NS, XS_NS, TaxonomyIndex, UnknownConcept, load_taxonomy
+
+# Lexical forms, as full-match patterns.
+DECIMAL_PATTERN = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)"
+INTEGER_PATTERN = r"[+-]?\d+"
+NON_NEGATIVE_PATTERN = r"\+?\d+"
+FLOAT_PATTERN = r"[+-]?(?:(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?|INF)|NaN"
+DATE_PATTERN = r"-?\d{4,}-\d{2}-\d{2}(?:Z|[+-]\d{2}:\d{2})?"
+DATETIME_PATTERN = r"-?\d{4,}-\d{2}-\d{2}(?:T\d{2}:\d{2}:\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?"
+GYEAR_PATTERN = r"-?\d{4,}(?:Z|[+-]\d{2}:\d{2})?"
+BOOLEAN_PATTERN = r"true|false|1|0"
+
+
+def _types(namespace, *names):
+    return {f"{{{namespace}}}{name}" for name in names}
+
+
+# Item type -> (check name, pattern). Numeric checks also require a unit.
+LEXICAL_CHECKS = {}
+for _type in _types(XBRLI_NS, "monetaryItemType", "decimalItemType", "sharesItemType", "pureItemType") | _types(XS_NS, "decimal"):
+    LEXICAL_CHECKS[_type] = ("not-a-number", DECIMAL_PATTERN)
+for _type in _types(XBRLI_NS, "integerItemType", "longItemType", "intItemType", "shortItemType", "byteItemType",
+                    "nonPositiveIntegerItemType", "negativeIntegerItemType") | _types(XS_NS, "integer", "long", "int", "short", "byte", "nonPositiveInteger", "negativeInteger"):
+    LEXICAL_CHECKS[_type] = ("not-a-number", INTEGER_PATTERN)
+for _type in _types(XBRLI_NS, "nonNegativeIntegerItemType", "positiveIntegerItemType", "unsignedLongItemType", "unsignedIntItemType",
+                    "unsignedShortItemType", "unsignedByteItemType") | _types(XS_NS, "nonNegativeInteger", "positiveInteger", "unsignedLong", "unsignedInt", "unsignedShort", "unsignedByte"):
+    LEXICAL_CHECKS[_type] = ("not-a-number", NON_NEGATIVE_PATTERN)
+for _type in _types(XBRLI_NS, "floatItemType", "doubleItemType") | _types(XS_NS, "float", "double"):
+    LEXICAL_CHECKS[_type] = ("not-a-number", FLOAT_PATTERN)
+for _type in _types(XBRLI_NS, "dateItemType") | _types(XS_NS, "date"):
+    LEXICAL_CHECKS[_type] = ("invalid-date", DATE_PATTERN)
+for _type in _types(XBRLI_NS, "dateTimeItemType") | _types(XS_NS, "dateTime"):
+    LEXICAL_CHECKS[_type] = ("invalid-date", DATETIME_PATTERN)
+for _type in _types(XBRLI_NS, "gYearItemType") | _types(XS_NS, "gYear"):
+    LEXICAL_CHECKS[_type] = ("invalid-date", GYEAR_PATTERN)
+for _type in _types(XBRLI_NS, "booleanItemType") | _types(XS_NS, "boolean"):
+    LEXICAL_CHECKS[_type] = ("invalid-boolean", BOOLEAN_PATTERN)
+del _type
+
+# Range facet -> comparison that is true for a value outside the bound.
+RANGE_FACETS = (("minInclusive", np.less), ("maxInclusive", np.greater),
+                ("minExclusive", np.less_equal), ("maxExclusive", np.greater_equal))
+# Decimal lexical form split into significant integer and fraction digits.
+DIGITS_PATTERN = r"^[+-]?0*(\d*)(?:\.(\d*?)0*)?$"
+
+REPORT_COLUMNS = ["row", "ID", "path1", "field", "value", "check", "message"]
+
+
+class FactValidationError(Exception):
+    """
+    Raised in "fail" mode; report holds the rows that failed.
+    """
+
+    def __init__(self, report):
+        super().__init__(f"{len(report)} invalid fact(s)")
+        self.report = report
+
+
+def _text(series):
+    # Same text the writer puts in the instance: str(value).strip().
+    if series.hasnans or series.dtype.kind == "M":
+        text = series.map(str)
+    else:
+        text = series.astype(str)
+    return text.str.strip()
+
+
+def _fullmatch(values, pattern):
+    return values.str.fullmatch(pattern).fillna(False).to_numpy(dtype=bool)
+
+
+class _Checker:
+    """
+    Runs the checks column by column. Rows are grouped by field (and by
+    path1/field pair for the tuple check), so the taxonomy is consulted once
+    per distinct name and every check runs on one vectorised subset.
+    """
+
+    def __init__(self, df, taxonomy, unit_column, fail_fast):
+        self.df = df
+        self.taxonomy = taxonomy
+        self.unit_column = unit_column
+        self.fail_fast = fail_fast
+        self.path1 = _text(df["path1"])
+        self.field = _text(df["field"])
+        self.value = _text(df["value"])
+        self.found = []  # (row positions, check, message)
+
+    def add(self, mask, check, message):
+        positions = np.flatnonzero(mask)
+        if len(positions):
+            self.found.append((positions, check, message))
+        return len(positions)
+
+    def run(self):
+        checks = (self.check_names, self.check_missing, self.check_units, self.check_lexical, self.check_facets)
+        for check in checks:
+            if check() and self.fail_fast:
+                break
+        return self.report()
+
+    def check_names(self):
+        field_codes, fields = pd.factorize(self.field, sort=False)
+        by_field = {}
+        for field in fields:
+            try:
+                by_field[field] = self.taxonomy.concept(field)
+            except UnknownConcept:
+                by_field[field] = None
+        self.concepts = list(by_field.values())
+        self.field_codes = field_codes
+        unknown = np.array([concept is None for concept in self.concepts], dtype=bool)
+        count = self.add(unknown[field_codes], "unknown-concept", "field is not a concept in the taxonomy")
+
+        pair_codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([self.path1, self.field]), sort=False)
+        problems = np.full(len(pairs), "", dtype=object)
+        for i, (path1, field) in enumerate(pairs):
+            if by_field[field] is not None:
+                found = self.taxonomy.check_names([(path1, field)])
+                if found:
+                    problems[i] = found[0]
+        for message in pd.unique(problems[problems != ""]):
+            count += self.add(problems[pair_codes] == message, "tuple", message)
+        return count
+
+    def check_missing(self):
+        # The writer would serialise a missing cell as the text "nan".
+        return self.add(self.df["value"].isna().to_numpy(), "missing-value", "value is missing (NaN)")
+
+    def check_units(self):
+        if self.unit_column is None:
+            return 0
+        numeric = np.array([concept is not None and concept.numeric for concept in self.concepts], dtype=bool)
+        numeric = numeric[self.field_codes]
+        if self.unit_column in self.df.columns:
+            units = self.df[self.unit_column]
+            no_unit = units.isna().to_numpy() | (_text(units) == "").to_numpy()
+        else:
+            no_unit = np.ones(len(self.df), dtype=bool)
+        return self.add(numeric & no_unit, "missing-unit", "numeric concept without a unitRef")
+
+    def _present(self):
+        # Missing values are reported once, by check_missing.
+        return self.df["value"].notna().to_numpy()
+
+    def _by_item_type(self, key):
+        """
+        Row masks per distinct key(concept), skipping unknown concepts.
+        """
+        groups = {}
+        for code, concept in enumerate(self.concepts):
+            if concept is not None:
+                groups.setdefault(key(concept), []).append(code)
+        for value, codes in groups.items():
+            yield value, np.isin(self.field_codes, codes)
+
+    def check_lexical(self):
+        count = 0
+        present = self._present()
+        for item_type, rows in self._by_item_type(lambda concept: concept.item_type):
+            if item_type not in LEXICAL_CHECKS:
+                continue
+            check, pattern = LEXICAL_CHECKS[item_type]
+            rows &= present
+            mask = np.zeros(len(rows), dtype=bool)
+            mask[rows] = ~_fullmatch(self.value[rows], pattern)
+            if check == "invalid-date":
+                # Well-formed but not a calendar date, e.g. 2024-02-30.
+                candidates = np.flatnonzero(rows & ~mask)
+                if len(candidates) and pattern is not GYEAR_PATTERN:
+                    dates = pd.to_datetime(self.value.iloc[candidates].str.slice(0, 10), format="%Y-%m-%d", errors="coerce")
+                    mask[candidates[dates.isna().to_numpy()]] = True
+            count += self.add(mask, check, f"not a valid {item_type.rsplit('}', 1)[-1]} value")
+        return count
+
+    def check_facets(self):
+        count = 0
+        present = self._present()
+        for type_name, rows in self._by_item_type(lambda concept: concept.type):
+            facets = self.taxonomy.facets(type_name)
+            if not facets:
+                continue
+            rows &= present
+            values = self.value[rows]
+            name = type_name.rsplit("}", 1)[-1]
+            if "enumeration" in facets:
+                mask = np.zeros(len(rows), dtype=bool)
+                mask[rows] = ~values.isin(facets["enumeration"]).to_numpy()
+                count += self.add(mask, "enumeration", f"not one of the {name} values")
+            lengths = values.str.len().to_numpy()
+            bounds = [(facets.get("length"), facets.get("length")),
+                      (facets.get("minLength"), facets.get("maxLength"))]
+            for low, high in bounds:
+                if low is None and high is None:
+                    continue
+                bad = np.zeros(len(lengths), dtype=bool)
+                if low is not None:
+                    bad |= lengths < int(low)
+                if high is not None:
+                    bad |= lengths > int(high)
+                mask = np.zeros(len(rows), dtype=bool)
+                mask[rows] = bad
+                count += self.add(mask, "length", f"length outside the {name} limits")
+            count += self._check_numeric_facets(facets, rows, values, name)
+            if "pattern" in facets:
+                try:
+                    re.compile(facets["pattern"])
+                except re.error:
+                    continue  # XSD-only regex syntax; not checked here
+                mask = np.zeros(len(rows), dtype=bool)
+                mask[rows] = ~_fullmatch(values, facets["pattern"])
+                count += self.add(mask, "pattern", f"does not match the {name} pattern")
+        return count
+
+    def _check_numeric_facets(self, facets, rows, values, name):
+        # Values that are not numbers are left to check_lexical.
+        count = 0
+        limits = []
+        for facet, outside in RANGE_FACETS:
+            if facet in facets:
+                try:
+                    limits.append((float(facets[facet]), outside))
+                except ValueError:
+                    pass  # a date or other non-numeric bound; not checked here
+        if limits:
+            numbers = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+            bad = np.zeros(len(numbers), dtype=bool)
+            for limit, outside in limits:
+                bad |= outside(numbers, limit)
+            mask = np.zeros(len(rows), dtype=bool)
+            mask[rows] = bad
+            count += self.add(mask, "range", f"outside the {name} range")
+        if "totalDigits" in facets or "fractionDigits" in facets:
+            parts = values.str.extract(DIGITS_PATTERN)
+            integer_digits = parts[0].str.len().to_numpy(dtype=float)  # NaN where not a decimal
+            fraction_digits = parts[1].str.len().fillna(0).to_numpy(dtype=float)
+            bad = np.zeros(len(parts), dtype=bool)
+            if "totalDigits" in facets:
+                bad |= integer_digits + fraction_digits > int(facets["totalDigits"])
+            if "fractionDigits" in facets:
+                bad |= ~np.isnan(integer_digits) & (fraction_digits > int(facets["fractionDigits"]))
+            mask = np.zeros(len(rows), dtype=bool)
+            mask[rows] = bad
+            count += self.add(mask, "digits", f"too many digits for {name}")
+        return count
+
+    def report(self):
+        if not self.found:
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+        positions = np.concatenate([rows for rows, _, _ in self.found])
+        checks = np.concatenate([np.full(len(rows), check, dtype=object) for rows, check, _ in self.found])
+        messages = np.concatenate([np.full(len(rows), message, dtype=object) for rows, _, message in self.found])
+        ids = _text(self.df["ID"]).to_numpy(dtype=object)[positions] if "ID" in self.df.columns else None
+        report = pd.DataFrame({
+            # Worksheet row number: 1-based, after the header row.
+            "row": positions + 2,
+            "ID": ids,
+            "path1": self.path1.to_numpy(dtype=object)[positions],
+            "field": self.field.to_numpy(dtype=object)[positions],
+            "value": self.df["value"].to_numpy(dtype=object)[positions],
+            "check": checks,
+            "message": messages,
+        })
+        return report.sort_values("row", kind="stable").reset_index(drop=True)
+
+
+def validate_facts(df, taxonomy, unit_column="unit", fail_fast=False):
+    """
+    Checks the path1/field/value rows of a workbook against the concept
+    data types of a taxonomy before they are serialised.
+
+    The checks run in order over whole columns: names (unknown concepts,
+    fields not allowed in their tuple), missing values (NaN cells), units (numeric concepts need a value in
+    unit_column), lexical form of numbers, dates and booleans, and the
+    enumeration, length, pattern, range (min/max inclusive/exclusive) and
+    totalDigits/fractionDigits facets of the concept's type.
+
+    Args:
+        df (DataFrame): Rows with ID, path1, field and value columns, as read
+            from the workbook.
+        taxonomy: TaxonomyIndex, or the path of a local taxonomy package.
+        unit_column (str): Column holding the unitRef of numeric facts; None
+            skips the unit check.
+        fail_fast (bool): Stop after the first check that finds errors.
+
+    Returns:
+        DataFrame: One line per problem (row, ID, path1, field, value, check,
+        message), ordered by worksheet row; empty if every fact is valid.
+    """
+    if not isinstance(taxonomy, TaxonomyIndex):
+        taxonomy = load_taxonomy(taxonomy)
+    missing = [col for col in ("path1", "field", "value") if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return _Checker(df, taxonomy, unit_column, fail_fast).run()
+
+
+def apply_validation(df, taxonomy, mode="fail", quarantine_file=None, unit_column="unit"):
+    """
+    Validates df and acts on the result according to mode.
+
+    Args:
+        mode (str): "fail" raises FactValidationError at the first check that
+            finds errors; "quarantine" drops every row with a problem.
+        quarantine_file (str): In quarantine mode, CSV file that receives the
+            report of the dropped rows.
+
+    Returns:
+        tuple: (rows to serialise, report DataFrame).
+    """
+    if mode not in ("fail", "quarantine"):
+        raise ValueError(f"Unknown validation mode '{mode}'")
+    report = validate_facts(df, taxonomy, unit_column=unit_column, fail_fast=mode == "fail")
+    if report.empty:
+        return df, report
+    if mode == "fail":
+        raise FactValidationError(report)
+    if quarantine_file is not None:
+        report.to_csv(quarantine_file, index=False)
+    keep = np.ones(len(df), dtype=bool)
+    keep[report["row"].to_numpy() - 2] = False
+    return df[keep], report
+
+
+def summarize_report(report, limit=10):
+    """
+    Text summary of a report: counts per check and the first problems.
+    """
+    lines = [f"{len(report)} problem(s) in {report['row'].nunique()} row(s):"]
+    for check, count in report["check"].value_counts(sort=False).items():
+        lines.append(f"  {check}: {count}")
+    for item in report.head(limit).itertuples(index=False):
+        lines.append(f"  row {item.row}: {item.path1} / {item.field} = {item.value!r}: {item.message}")
+    if len(report) > limit:
+        lines.append(f"  ... and {len(report) - limit} more")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    excel_file = "test aanmaak xbrl01.xlsx"  # Workbook to check
+    taxonomy_package = "nt18.zip"            # Local taxonomy package or folder
+    report = validate_facts(pd.read_excel(excel_file), taxonomy_package)
+    if report.empty:
+        print(f"All facts in {excel_file} are valid.")
+    else:
+        print(summarize_report(report))
+        report.to_csv("validation_report.csv", index=False)
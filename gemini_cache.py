@@ -0,0 +1,155 @@
+import time
+import sqlite3
+import hashlib
+import threading
+
+import instrumentation
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of Gemini responses stored in SQLite.
+
+    Entries are keyed by a SHA-256 of the model name, prompt and CSV text, so a
+    group whose CSV did not change is answered from disk on the next run.
+    Entries older than max_age seconds are dropped, and when max_entries or
+    max_bytes is exceeded the least recently used entries are evicted.
+
+    One cache can be shared by the worker threads of a build or of
+    dispatch_csv_files; every use of the connection holds a lock.
+    """
+
+    def __init__(self, path="gemini_cache.sqlite", max_entries=None, max_bytes=None, max_age=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # Reentrant, as put evicts while holding it.
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def key(model, prompt, csv_text):
+        """
+        Returns the hex digest identifying a (model, prompt, CSV text) request.
+        """
+        digest = hashlib.sha256()
+        for part in (model, prompt, csv_text):
+            data = part.encode("utf-8")
+            # Length-prefix each part so ("ab", "c") and ("a", "bc") differ.
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, model, prompt, csv_text):
+        """
+        Returns the cached response for the request, or None on a miss.
+        """
+        with self._lock:
+            key = self.key(model, prompt, csv_text)
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                instrumentation.count("gemini_cache_misses")
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            instrumentation.count("gemini_cache_hits")
+            return row[0]
+
+    def put(self, model, prompt, csv_text, response):
+        """
+        Stores the response for the request and applies the eviction limits.
+        """
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(model, prompt, csv_text), model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+            self.stores += 1
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then least recently used entries until the
+        entry and size limits hold. Returns the number of entries removed.
+        """
+        with self._lock:
+            removed = 0
+            if self.max_age is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+                ).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            if self.max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    victims = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                        if total <= self.max_bytes:
+                            break
+                        victims.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                    removed += len(victims)
+            self._conn.commit()
+            self.evictions += removed
+            return removed
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this session and the current cache size.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
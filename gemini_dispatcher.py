@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import random
+import asyncio
+import urllib.error
+import urllib.request
+
+import instrumentation
+from send_csv_to_gemini import MODEL, PROMPT, genai, build_contents, extract_csv, observe_request, response_text
+
+# HTTP statuses that are worth retrying: rate limiting and server-side errors.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TransportError(Exception):
+    """
+    Raised by a transport when a request fails; status is the HTTP status
+    code (None if the request never got a response) and retry_after the
+    server's Retry-After hint in seconds, if any.
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class GeminiClientTransport:
+    """
+    Sends requests through one shared google-genai client using its async API.
+    """
+
+    def __init__(self, api_key, model=MODEL):
+        if genai is None:
+            raise ImportError("google-genai is required for GeminiClientTransport")
+        self.client = genai.Client(api_key=api_key)
+        self.model = model
+
+    async def generate(self, contents):
+        response = await self.client.aio.models.generate_content(model=self.model, contents=contents)
+        return response_text(response)
+
+
+class RestTransport:
+    """
+    Sends requests to a generateContent REST endpoint with the standard
+    library only. Pointing base_url at a local fake server lets the
+    dispatcher run offline.
+    """
+
+    def __init__(self, base_url, api_key="", model=MODEL, timeout=60):
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _post(self, contents):
+        body = json.dumps({"contents": [{"parts": [{"text": contents}]}]}).encode("utf-8")
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json", "x-goog-api-key": self.api_key},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            raise TransportError(
+                f"HTTP {e.code} from {self.url}",
+                status=e.code,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        except urllib.error.URLError as e:
+            raise TransportError(f"Could not reach {self.url}: {e.reason}")
+
+        candidates = payload.get("candidates") or []
+        if not candidates:
+            raise TransportError("Gemini API error: " + json.dumps(payload))
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "\n".join(part["text"] for part in parts if part.get("text"))
+
+    async def generate(self, contents):
+        return await asyncio.to_thread(self._post, contents)
+
+
+class TokenBucket:
+    """
+    Async token bucket: acquire() returns once a token is available, refilling
+    at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _status_of(error):
+    """
+    Returns the HTTP status of a transport or google-genai error, if any.
+    """
+    for attr in ("status", "code"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """
+    Full-jitter exponential backoff: a random delay up to base_delay * 2**attempt.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def generate_with_retries(transport, contents, bucket=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+    """
+    Calls transport.generate(contents), retrying on 429/5xx errors with
+    jittered exponential backoff. Every attempt takes a token from bucket.
+    Latency and estimated prompt/response tokens go to the instrumentation
+    histograms.
+    """
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await bucket.acquire()
+        start = time.monotonic()
+        try:
+            text = await transport.generate(contents)
+        except Exception as e:
+            observe_request(time.monotonic() - start, contents)
+            if _status_of(e) not in RETRYABLE_STATUSES or attempt >= max_retries:
+                instrumentation.count("gemini_failures")
+                raise
+            instrumentation.count("gemini_retries")
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after:
+                delay = max(delay, retry_after)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        observe_request(time.monotonic() - start, contents, text)
+        return text
+
+
+async def dispatch_csv_files(input_dir, output_dir, transport, max_in_flight=8, requests_per_second=4.0,
+                             max_retries=5, base_delay=1.0, max_delay=30.0, cache=None, filenames=None):
+    """
+    Sends every CSV file in input_dir through transport concurrently and
+    writes each result to output_dir as soon as its request finishes.
+
+    Args:
+        input_dir (str): Folder containing the CSV files to enrich.
+        output_dir (str): Folder where the updated CSV files are saved.
+        transport: Object with an async generate(contents) method returning
+            the model text, e.g. GeminiClientTransport or RestTransport.
+        max_in_flight (int): Maximum number of requests running at once.
+        requests_per_second (float): Token-bucket rate limit for requests,
+            retries included.
+        max_retries (int): Retries per file on 429/5xx errors.
+        cache (ResponseCache): Optional response cache; files found in it
+            are written without a request.
+        filenames (list): Only send these files from input_dir; defaults
+            to every CSV file in it.
+
+    Returns:
+        dict: Maps each file name to None on success or the error message.
+    """
+    # Create the output directory if it doesn't exist.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    def read(filename):
+        with open(os.path.join(input_dir, filename), "r") as f:
+            return f.read()
+
+    def save(filename, csv_text, updated_csv):
+        # Save the extracted CSV to the output directory.
+        output_file = os.path.join(output_dir, filename)
+        with open(output_file, "w") as f:
+            f.write(updated_csv)
+        instrumentation.log(f"Updated CSV saved to: {output_file}")
+
+    if filenames is None:
+        filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".csv"))
+    groups = ((filename, read(filename)) for filename in filenames)
+    return await dispatch_groups(groups, save, transport, max_in_flight, requests_per_second,
+                                 max_retries, base_delay, max_delay, cache)
+
+
+async def dispatch_groups(groups, save, transport, max_in_flight=8, requests_per_second=4.0,
+                          max_retries=5, base_delay=1.0, max_delay=30.0, cache=None):
+    """
+    Core of dispatch_csv_files: sends (name, CSV text) groups through
+    transport concurrently and calls save(name, csv_text, updated_csv) as
+    soon as each request finishes.
+
+    Returns:
+        dict: Maps each name to None on success or the error message.
+    """
+    bucket = TokenBucket(requests_per_second)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    model = getattr(transport, "model", MODEL)
+
+    async def process(filename, csv_text):
+        updated_csv = cache.get(model, PROMPT, csv_text) if cache is not None else None
+        if updated_csv is None:
+            async with in_flight:
+                try:
+                    text = await generate_with_retries(
+                        transport, build_contents(csv_text), bucket, max_retries, base_delay, max_delay
+                    )
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
+                    return filename, str(e)
+            updated_csv = extract_csv(text)
+            if cache is not None:
+                cache.put(model, PROMPT, csv_text, updated_csv)
+        save(filename, csv_text, updated_csv)
+        return filename, None
+
+    with instrumentation.span("enrich"):
+        results = await asyncio.gather(*(process(filename, csv_text) for filename, csv_text in groups))
+    return dict(results)
+
+
+async def dispatch_store(store, transport, **options):
+    """
+    Store counterpart of dispatch_csv_files: enriches the "grouped" groups of
+    a group_store.GroupStore whose enriched result is missing, failed or made
+    from a different CSV text, and writes each result (or its error) to the
+    "enriched" stage. Keyword arguments are passed on to dispatch_groups.
+
+    Returns:
+        dict: Maps each file name sent to None on success or the error message.
+    """
+    stale = store.stale("enriched", "grouped")
+    digests = {filename: digest for filename, _, digest in stale}
+
+    def save(filename, csv_text, updated_csv):
+        store.put("enriched", filename, updated_csv, digests[filename])
+
+    results = await dispatch_groups(((filename, csv_text) for filename, csv_text, _ in stale), save, transport,
+                                    **options)
+    for filename, error in results.items():
+        if error is not None:
+            store.put_error("enriched", filename, error, digests[filename])
+    store.prune("enriched", "grouped")
+    print(f"{len(results)} groups enriched into: {store.path}")
+    return results
+
+
+def process_csv_files_concurrently(input_dir, output_dir, api_key, **kwargs):
+    """
+    Concurrent counterpart of send_csv_to_gemini.process_csv_files using one
+    shared client; keyword arguments are passed on to dispatch_csv_files.
+    """
+    transport = GeminiClientTransport(api_key)
+    return asyncio.run(dispatch_csv_files(input_dir, output_dir, transport, **kwargs))
+
+
+if __name__ == "__main__":
+    input_dir = "grouped_csvs"      # Folder containing the original CSV files
+    output_dir = "gemini_output"     # Folder where updated CSV files will be saved
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+
+    process_csv_files_concurrently(input_dir, output_dir, api_key)
@@ -0,0 +1,223 @@
+import os
+import asyncio
+
+import instrumentation
+from clean_csvs import clean_csv, iter_csv_blocks
+from send_csv_to_gemini import MODEL, PROMPT, build_contents, estimate_tokens
+from gemini_dispatcher import TokenBucket, generate_with_retries
+
+PACKED_PROMPT = (
+    "Add an example value to each line/row of each csv below. "
+    "Every csv is in its own fenced block whose opening line carries its id, e.g. ```csv id=g0. "
+    "Reply with one fenced block per csv, opened with exactly the same line as its input block "
+    "and closed with ```, keeping every row."
+)
+
+
+def _section(index, csv_text):
+    return f"```csv id=g{index}\n{csv_text.strip()}\n```"
+
+
+def _row_count(csv_text):
+    return sum(1 for line in csv_text.splitlines() if line.strip())
+
+
+def pack_groups(groups, token_budget):
+    """
+    Bin-packs (name, csv_text) groups into batches whose packed prompt stays
+    within token_budget estimated tokens, using first-fit decreasing. A group
+    that is larger than the budget on its own gets a batch to itself.
+
+    Returns a list of batches, each a list of (name, csv_text) tuples.
+    """
+    prompt_tokens = estimate_tokens(PACKED_PROMPT)
+    bins = []  # [remaining tokens, groups]
+    # Largest first; ties broken by name so packing is deterministic.
+    sized = sorted(((estimate_tokens(_section(0, text)), name, text) for name, text in groups),
+                   key=lambda item: (-item[0], item[1]))
+    for tokens, name, text in sized:
+        for packed in bins:
+            if packed[0] >= tokens:
+                packed[0] -= tokens
+                packed[1].append((name, text))
+                break
+        else:
+            bins.append([token_budget - prompt_tokens - tokens, [(name, text)]])
+    return [batch for _, batch in bins]
+
+
+def build_packed_contents(batch):
+    """
+    Builds one prompt for a batch of (name, csv_text) groups, fencing each
+    group with its position in the batch as id.
+    """
+    sections = [_section(index, csv_text) for index, (_, csv_text) in enumerate(batch)]
+    return PACKED_PROMPT + "\n\n" + "\n\n".join(sections)
+
+
+def split_packed_response(text, batch):
+    """
+    Splits a reply to build_packed_contents back into per-group CSV text.
+
+    Returns a dict mapping group name to its CSV lines. Groups whose section
+    is missing, repeated, empty or has a different number of rows than the
+    input are left out, so the caller can send them again on their own.
+    """
+    expected = {f"id=g{index}": (name, csv_text) for index, (name, csv_text) in enumerate(batch)}
+    found = {}
+    repeated = set()
+    for info, csv_text in iter_csv_blocks(text):
+        if info in found:
+            repeated.add(info)
+        found[info] = csv_text
+
+    sections = {}
+    for info, (name, csv_text) in expected.items():
+        answer = found.get(info)
+        if info in repeated or not answer or _row_count(answer) != _row_count(csv_text):
+            continue
+        sections[name] = answer
+    return sections
+
+
+async def dispatch_packed_csv_files(input_dir, output_dir, transport, token_budget=4000, max_in_flight=8,
+                                    requests_per_second=4.0, max_retries=5, base_delay=1.0, max_delay=30.0,
+                                    cache=None):
+    """
+    Packing counterpart of gemini_dispatcher.dispatch_csv_files: small CSV
+    files are bin-packed into shared requests of at most token_budget
+    estimated tokens and the reply is split back into one file per group.
+    Groups missing or malformed in a packed reply are resent on their own.
+
+    Every answer, packed or single, is saved and cached as plain CSV text,
+    which clean_csvs.clean_csv passes through unchanged.
+
+    Returns:
+        dict: Maps each file name to None on success or the error message.
+    """
+    # Create the output directory if it doesn't exist.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    def read(filename):
+        with open(os.path.join(input_dir, filename), "r") as f:
+            return f.read()
+
+    def save(filename, csv_text, updated_csv):
+        output_file = os.path.join(output_dir, filename)
+        with open(output_file, "w") as f:
+            f.write(updated_csv)
+        instrumentation.log(f"Updated CSV saved to: {output_file}")
+
+    filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".csv"))
+    return await dispatch_packed_groups(((filename, read(filename)) for filename in filenames), save, transport,
+                                        token_budget, max_in_flight, requests_per_second, max_retries,
+                                        base_delay, max_delay, cache)
+
+
+async def dispatch_packed_groups(groups, save, transport, token_budget=4000, max_in_flight=8,
+                                 requests_per_second=4.0, max_retries=5, base_delay=1.0, max_delay=30.0,
+                                 cache=None):
+    """
+    Core of dispatch_packed_csv_files: packs (name, CSV text) groups into
+    shared requests and calls save(name, csv_text, updated_csv) for each
+    group as soon as its answer is in. updated_csv is the CSV of the answer
+    without fence or prose, however it was sent, so a group is cached
+    under the single-group PROMPT with the same value either way.
+
+    Returns:
+        dict: Maps each name to None on success or the error message.
+    """
+    bucket = TokenBucket(requests_per_second)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    model = getattr(transport, "model", MODEL)
+    results = {}
+
+    def finish(filename, csv_text, updated_csv, store=True):
+        save(filename, csv_text, updated_csv)
+        if cache is not None and store:
+            cache.put(model, PROMPT, csv_text, updated_csv)
+        results[filename] = None
+
+    async def request(contents):
+        async with in_flight:
+            return await generate_with_retries(transport, contents, bucket, max_retries, base_delay, max_delay)
+
+    async def send_single(filename, csv_text):
+        try:
+            text = await request(build_contents(csv_text))
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+            results[filename] = str(e)
+            return
+        updated_csv = clean_csv(text)
+        if not updated_csv:
+            print(f"No CSV block found in the reply for {filename}")
+            results[filename] = "No CSV block found"
+            return
+        finish(filename, csv_text, updated_csv)
+
+    async def send_batch(batch):
+        if len(batch) == 1:
+            await send_single(*batch[0])
+            return
+        try:
+            sections = split_packed_response(await request(build_packed_contents(batch)), batch)
+        except Exception as e:
+            print(f"Error processing packed request of {len(batch)} groups: {e}")
+            sections = {}
+        resend = []
+        for filename, csv_text in batch:
+            if filename in sections:
+                finish(filename, csv_text, sections[filename])
+            else:
+                resend.append((filename, csv_text))
+        if resend:
+            print(f"Resending {len(resend)} of {len(batch)} packed groups individually")
+            await asyncio.gather(*(send_single(filename, csv_text) for filename, csv_text in resend))
+
+    pending = []
+    for filename, csv_text in groups:
+        cached = cache.get(model, PROMPT, csv_text) if cache is not None else None
+        if cached is not None:
+            # Entries written by gemini_dispatcher may still hold the fence.
+            finish(filename, csv_text, clean_csv(cached), store=False)
+        else:
+            pending.append((filename, csv_text))
+
+    with instrumentation.span("enrich"):
+        await asyncio.gather(*(send_batch(batch) for batch in pack_groups(pending, token_budget)))
+    return {filename: results[filename] for filename in sorted(results)}
+
+
+async def dispatch_packed_store(store, transport, **options):
+    """
+    Packing counterpart of gemini_dispatcher.dispatch_store: the stale
+    "grouped" groups of a group_store.GroupStore are sent in packed requests
+    and the answers (or errors) written to its "enriched" stage. Keyword
+    arguments are passed on to dispatch_packed_groups.
+    """
+    stale = store.stale("enriched", "grouped")
+    digests = {filename: digest for filename, _, digest in stale}
+
+    def save(filename, csv_text, updated_csv):
+        store.put("enriched", filename, updated_csv, digests[filename])
+
+    results = await dispatch_packed_groups(((filename, csv_text) for filename, csv_text, _ in stale), save,
+                                           transport, **options)
+    for filename, error in results.items():
+        if error is not None:
+            store.put_error("enriched", filename, error, digests[filename])
+    store.prune("enriched", "grouped")
+    print(f"{len(results)} groups enriched into: {store.path}")
+    return results
+
+
+if __name__ == "__main__":
+    from gemini_dispatcher import GeminiClientTransport
+
+    input_dir = "grouped_csvs"      # Folder containing the original CSV files
+    output_dir = "gemini_output"     # Folder where updated CSV files will be saved
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+
+    asyncio.run(dispatch_packed_csv_files(input_dir, output_dir, GeminiClientTransport(api_key)))
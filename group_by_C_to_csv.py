@@ -1,27 +1,63 @@
 import os
 import pandas as pd
 
+import instrumentation
+from workbook_cache import read_sheet_cached
+
+def read_processed_sheet(input_file):
+    # Read the 'Processed' worksheet without headers and skip the first row.
+    # The parsed sheet is cached in a sidecar until the workbook changes.
+    return read_sheet_cached(input_file, sheet_name='Processed', skiprows=1)
+
+def group_file_name(name):
+    # Sanitize the group name to create a valid file name.
+    safe_name = str(name).strip().replace(" ", "_")
+    return f"group_{safe_name}.csv"
+
+def iter_groups(df):
+    """
+    Yields (name, file name, group) for every group of rows sharing the same
+    value in column C (index 2), in sorted group order.
+    """
+    # Group by column C (index 2)
+    for name, group in df.groupby(2):
+        yield name, group_file_name(name), group
+
 def group_to_csv(input_file, output_dir):
     # Create output directory if it doesn't exist.
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Read the 'Processed' worksheet without headers and skip the first row.
-    df = pd.read_excel(input_file, sheet_name='Processed', header=None, skiprows=1)
+    with instrumentation.span("group.read"):
+        df = read_processed_sheet(input_file)
+    instrumentation.count("grouped_rows", len(df))
 
-    # Group by column C (index 2)
-    groups = df.groupby(2)
+    with instrumentation.span("group.write"):
+        for name, filename, group in iter_groups(df):
+            # Construct output file path.
+            output_file = os.path.join(output_dir, filename)
+            # Write the group to CSV; index and header are omitted.
+            group.to_csv(output_file, index=False, header=False)
+            instrumentation.count("groups")
+            instrumentation.log(f"Group '{name}' written to: {output_file}")
 
-    for name, group in groups:
-        # Sanitize the group name to create a valid file name.
-        safe_name = str(name).strip().replace(" ", "_")
-        # Construct output file path.
-        output_file = os.path.join(output_dir, f"group_{safe_name}.csv")
-        # Write the group to CSV; index and header are omitted.
-        group.to_csv(output_file, index=False, header=False)
-        print(f"Group '{name}' written to: {output_file}")
+def group_to_store(input_file, store):
+    """
+    Store counterpart of group_to_csv: writes every group's CSV text to the
+    "grouped" stage of a group_store.GroupStore, replacing groups that no
+    longer exist. Returns the number of groups.
+    """
+    with instrumentation.span("group.read"):
+        df = read_processed_sheet(input_file)
+    instrumentation.count("grouped_rows", len(df))
+    with instrumentation.span("group.write"):
+        items = ((filename, group.to_csv(index=False, header=False)) for _, filename, group in iter_groups(df))
+        count = store.replace_stage("grouped", items)
+    instrumentation.count("groups", count)
+    print(f"{count} groups written to: {store.path}")
+    return count
 
 if __name__ == "__main__":
     input_excel = "LibE2025dev.xlsx"  # Input file
     output_directory = "grouped_csvs"  # Output directory for CSV files
-    group_to_csv(input_excel, output_directory)
\ No newline at end of file
+    group_to_csv(input_excel, output_directory)
@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+from combine_csv_to_xlsx import extract_source_identifier
+
+# Stages kept in the store, named after the checkpoints of hacktova_pipeline.
+STAGES = ("grouped", "enriched", "cleaned")
+
+
+def text_digest(text):
+    """
+    Hex SHA-256 of a text, used to tell which upstream text a result was made from.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def group_id_of(filename):
+    """
+    Group id for a file name like "group_607317.csv": the sanitized column-C
+    value that group_by_C_to_csv.group_file_name put in it.
+    """
+    stem = os.path.splitext(filename)[0]
+    return stem[len("group_"):] if stem.startswith("group_") else stem
+
+
+class GroupStore:
+    """
+    The per-group intermediate data of the pipeline in one SQLite file,
+    instead of one small CSV file per group in grouped_csvs, gemini_output
+    and cleaned_csv.
+
+    Every row is one group at one stage, keyed by (stage, group_id), and
+    holds the file name the separate scripts would use, the source
+    identifier for the combined sheet, the text, and the digest of the
+    upstream text it was made from. Groups that still need a stage, because
+    they are new, changed or failed last time, are found with one indexed
+    query instead of reading every file again.
+    """
+
+    def __init__(self, path="pipeline_store.sqlite"):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS groups ("
+            " stage TEXT NOT NULL,"
+            " group_id TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " data TEXT,"
+            " digest TEXT,"
+            " input_digest TEXT,"
+            " error TEXT,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (stage, group_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS groups_filename ON groups (stage, filename)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row(stage, filename, data, input_digest=None, error=None):
+        return (
+            stage, group_id_of(filename), filename, extract_source_identifier(filename),
+            data, None if data is None else text_digest(data), input_digest, error, time.time(),
+        )
+
+    def put(self, stage, filename, data, input_digest=None):
+        """
+        Stores the text of one group at a stage, replacing what was there.
+        input_digest is the digest of the upstream text it was made from.
+        """
+        self.put_many(stage, [(filename, data, input_digest)])
+
+    def put_error(self, stage, filename, error, input_digest=None):
+        """
+        Records that a stage failed for a group; the group stays stale.
+        """
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(stage, filename, None, input_digest, str(error)),
+            )
+
+    def put_many(self, stage, items):
+        """
+        Stores (file name, text) or (file name, text, input digest) items in
+        one transaction. Returns the number of groups stored.
+        """
+        rows = [self._row(stage, *item) for item in items]
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def replace_stage(self, stage, items):
+        """
+        Like put_many, but groups of the stage not in items are removed, so
+        the stage holds exactly the given groups. Unchanged groups keep
+        their digest and are not treated as stale downstream.
+        """
+        rows = [self._row(stage, *item) for item in items]
+        with self._conn:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (group_id TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM keep")
+            self._conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((row[1],) for row in rows))
+            self._conn.execute(
+                "DELETE FROM groups WHERE stage = ? AND group_id NOT IN (SELECT group_id FROM keep)", (stage,)
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def get(self, stage, group_id):
+        """
+        Returns the text of a group at a stage, or None if it is missing or failed.
+        """
+        row = self._conn.execute(
+            "SELECT data FROM groups WHERE stage = ? AND group_id = ?", (stage, group_id)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def items(self, stage):
+        """
+        Yields (file name, source, text) for every successful group of a
+        stage, in file name order like the sorted folder listings.
+        """
+        yield from self._conn.execute(
+            "SELECT filename, source, data FROM groups"
+            " WHERE stage = ? AND error IS NULL ORDER BY filename",
+            (stage,),
+        )
+
+    def stale(self, stage, upstream):
+        """
+        Returns (file name, upstream text, upstream digest) for every group of
+        the upstream stage that has no result at stage yet, whose result
+        failed, or whose result was made from a different upstream text.
+        """
+        return self._conn.execute(
+            "SELECT u.filename, u.data, u.digest FROM groups u"
+            " LEFT JOIN groups d ON d.stage = ? AND d.group_id = u.group_id"
+            " WHERE u.stage = ? AND u.error IS NULL"
+            " AND (d.group_id IS NULL OR d.error IS NOT NULL OR d.input_digest IS NOT u.digest)"
+            " ORDER BY u.filename",
+            (stage, upstream),
+        ).fetchall()
+
+    def prune(self, stage, upstream):
+        """
+        Removes the groups of a stage that are no longer in the upstream stage.
+        Returns the number of groups removed.
+        """
+        with self._conn:
+            return self._conn.execute(
+                "DELETE FROM groups WHERE stage = ? AND group_id NOT IN"
+                " (SELECT group_id FROM groups WHERE stage = ?)",
+                (stage, upstream),
+            ).rowcount
+
+    def errors(self, stage):
+        """
+        Maps the file name of every failed group of a stage to its error.
+        """
+        return dict(self._conn.execute(
+            "SELECT filename, error FROM groups WHERE stage = ? AND error IS NOT NULL ORDER BY filename", (stage,)
+        ))
+
+    def status(self):
+        """
+        Returns {stage: {"groups": n, "failed": n}} for every stage in the store.
+        """
+        status = {}
+        for stage, total, failed in self._conn.execute(
+            "SELECT stage, COUNT(*), COUNT(error) FROM groups GROUP BY stage"
+        ):
+            status[stage] = {"groups": total, "failed": failed}
+        return status
+
+    def import_dir(self, stage, directory, encoding=None):
+        """
+        Loads every CSV file of a stage folder (e.g. grouped_csvs) into the
+        store, replacing the stage. Returns the number of groups loaded.
+        """
+        def read(filename):
+            with open(os.path.join(directory, filename), "r", encoding=encoding) as f:
+                return f.read()
+
+        filenames = sorted(f for f in os.listdir(directory) if f.endswith(".csv"))
+        return self.replace_stage(stage, ((filename, read(filename)) for filename in filenames))
+
+    def export_dir(self, stage, directory, encoding=None):
+        """
+        Writes every successful group of a stage as a CSV file, as the
+        separate scripts would. Returns the number of files written.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        count = 0
+        for filename, _, data in self.items(stage):
+            with open(os.path.join(directory, filename), "w", encoding=encoding) as f:
+                f.write(data)
+            count += 1
+        return count
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    store_file = "pipeline_store.sqlite"  # Store written by the pipeline stages
+
+    with GroupStore(store_file) as store:
+        for stage, counts in store.status().items():
+            print(f"{stage}: {counts['groups']} groups, {counts['failed']} failed")
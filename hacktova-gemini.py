@@ -1,72 +1,397 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 from lxml import etree
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-def create_xbrl_from_excel(excel_file, output_file):
+import instrumentation
+from fact_validation import FactValidationError, apply_validation, summarize_report
+from taxonomy_index import TaxonomyIndex, format_problems, load_taxonomy
+from workbook_cache import file_sha256
+from xbrl_contexts import ContextRegistry, has_context_columns
+
+# Define namespaces
+NAMESPACES = {
+    "xbrli": "http://www.xbrl.org/2003/instance",
+    "link": "http://www.xbrl.org/2003/linkbase",
+    "bd-t": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-tuples",
+    "bd-i": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-data",
+    "bd-i-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-data-ext1",
+    "nl-cd": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-common-data",
+    "bd-t-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-tuples-ext1",
+    "iso4217": "http://www.xbrl.org/2003/iso4217",
+    "xlink": "http://www.w3.org/1999/xlink",
+    "sbr": "http://www.nltaxonomie.nl/2011/xbrl/xbrl-syntax-extension",
+    "sbr-dim": "http://www.nltaxonomie.nl/2013/xbrl/sbr-dimensional-concepts",
+    "bd-codes": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-codes",
+    "bd-types": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-types",
+    "bd-abstr": "http://www.nltaxonomie.nl/nt18/bd/20231213/presentation/bd-abstracts",
+    "bd-codes-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-codes-ext1",
+    "bd-types-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-types-ext1",
+    "bd-rpt-erf": "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024",
+    "bd-abstr-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/presentation/bd-abstr-ext1",
+    "bd-lr-pre-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/presentation/bd-linkroles-pre-ext1",
+    "bd-lr-hd-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/validation/bd-linkroles-tables-ext1",
+    "iso3166-enum-sbr": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/iso3166-countrycodes-2022-11-29",
+    "iso4217-enum-sbr": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/iso4217-currencycodes-2023-01-01",
+    "nl-codes": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-codes",
+    "nl-types": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-types",
+    "sbi": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/sbi-businesscodes-2022",
+    "xl": "http://www.xbrl.org/2003/XLink",
+    "dtr-types": "http://www.xbrl.org/dtr/type/2020-01-21",
+    "xbrldt": "http://xbrl.org/2005/xbrldt",
+    "gen": "http://xbrl.org/2008/generic",
+    "label": "http://xbrl.org/2008/label"
+}
+
+SCHEMA_HREF = "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024.xsd"
+
+# Number of path1 tuples serialised per write by the streaming engine.
+STREAM_CHUNK_SIZE = 256
+
+# Fragment manifest kept next to instances written incrementally.
+FRAGMENT_SUFFIX = ".fragments.json"
+# Bump when the manifest layout changes so old manifests are ignored.
+FRAGMENT_VERSION = 1
+
+
+def _create_root(nsmap=NAMESPACES, registry=None):
     """
-    Reads data from an Excel file, transforms it, and writes it to an XBRL file,
-    grouping fields by path1 first, then by ID.
+    Creates the xbrli:xbrl root element with its schemaRef and the ctx1
+    context, or the contexts and units of registry when given.
+    """
+    root = etree.Element(f"{{{NAMESPACES['xbrli']}}}xbrl", nsmap=nsmap)
+
+    # Add schemaRef
+    schema_ref = etree.SubElement(root, f"{{{NAMESPACES['link']}}}schemaRef")
+    schema_ref.set(f"{{{NAMESPACES['xlink']}}}type", "simple")
+    schema_ref.set(f"{{{NAMESPACES['xlink']}}}href", SCHEMA_HREF)
+
+    if registry is not None:
+        registry.append_to(root)
+        return root
+
+    # Create a context element
+    context = etree.SubElement(root, f"{{{NAMESPACES['xbrli']}}}context", id="ctx1")
+    entity = etree.SubElement(context, f"{{{NAMESPACES['xbrli']}}}entity")
+    return root
+
+
+def _qualify(name):
+    """
+    Turns a prefixed name such as "bd-i:Name" into an lxml {uri}local tag.
+    """
+    local_name = name.split(':')[1]
+    return f"{{{NAMESPACES[name.split(':')[0]]}}}{local_name}"
+
+
+def resolve_taxonomy_names(groups, taxonomy):
+    """
+    Checks every path1/field name of the groups against a taxonomy before
+    anything is written: each must be a concept, each path1 a tuple and each
+    field part of its content model.
 
     Args:
-        excel_file (str): Path to the input Excel file.
-        output_file (str): Path to the output XBRL file.
+        groups (list): (path1, fields, values) tuples from group_rows_by_path1.
+        taxonomy: TaxonomyIndex, or the path of a local taxonomy package.
+
+    Returns:
+        tuple: (nsmap, tags) for write_xbrl_stream, with the taxonomy's
+        namespace URIs and every name resolved to its {uri}local tag.
+
+    Raises:
+        ValueError: listing every name the taxonomy does not allow.
     """
+    if not isinstance(taxonomy, TaxonomyIndex):
+        taxonomy = load_taxonomy(taxonomy)
+    pairs = dict.fromkeys((path1, field) for path1, fields, *_ in groups for field in fields)
+    problems = taxonomy.check_names(pairs)
+    if problems:
+        raise ValueError(f"{len(problems)} name(s) not in the taxonomy: " + format_problems(problems))
+    names = dict.fromkeys(name for pair in pairs for name in pair)
+    tags = {name: taxonomy.qualify(name) for name in names}
+    nsmap = taxonomy.nsmap(dict.fromkeys(name.split(":", 1)[0] for name in names), base=NAMESPACES)
+    return nsmap, tags
 
-    # Define namespaces
-    namespaces = {
-        "xbrli": "http://www.xbrl.org/2003/instance",
-        "link": "http://www.xbrl.org/2003/linkbase",
-        "bd-t": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-tuples",
-        "bd-i": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-data",
-        "bd-i-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-data-ext1",
-        "nl-cd": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-common-data",
-        "bd-t-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-tuples-ext1",
-        "iso4217": "http://www.xbrl.org/2003/iso4217",
-        "xlink": "http://www.w3.org/1999/xlink",
-        "sbr": "http://www.nltaxonomie.nl/2011/xbrl/xbrl-syntax-extension",
-        "sbr-dim": "http://www.nltaxonomie.nl/2013/xbrl/sbr-dimensional-concepts",
-        "bd-codes": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-codes",
-        "bd-types": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-types",
-        "bd-abstr": "http://www.nltaxonomie.nl/nt18/bd/20231213/presentation/bd-abstracts",
-        "bd-codes-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-codes-ext1",
-        "bd-types-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-types-ext1",
-        "bd-rpt-erf": "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024",
-        "bd-abstr-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/presentation/bd-abstr-ext1",
-        "bd-lr-pre-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/presentation/bd-linkroles-pre-ext1",
-        "bd-lr-hd-ext1": "http://www.nltaxonomie.nl/nt18/bd/20240221/validation/bd-linkroles-tables-ext1",
-        "iso3166-enum-sbr": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/iso3166-countrycodes-2022-11-29",
-        "iso4217-enum-sbr": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/iso4217-currencycodes-2023-01-01",
-        "nl-codes": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-codes",
-        "nl-types": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-types",
-        "sbi": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/sbi-businesscodes-2022",
-        "xl": "http://www.xbrl.org/2003/XLink",
-        "dtr-types": "http://www.xbrl.org/dtr/type/2020-01-21",
-        "xbrldt": "http://xbrl.org/2005/xbrldt",
-        "gen": "http://xbrl.org/2008/generic",
-        "label": "http://xbrl.org/2008/label"
-    }
 
-    # Create the root element
-    root = etree.Element(f"{{{namespaces['xbrli']}}}xbrl", nsmap=namespaces)
+def validate_rows(df, taxonomy, validation, quarantine_file):
+    """
+    Runs the fact validation stage on the workbook rows before anything is
+    serialised. Returns the rows to write, or None if writing must stop
+    (the problems have been printed).
+    """
+    if taxonomy is None:
+        print("Error: fact validation needs a taxonomy.")
+        return None
+    try:
+        valid, report = apply_validation(df, taxonomy, mode=validation, quarantine_file=quarantine_file)
+    except FactValidationError as e:
+        print(f"Error: {summarize_report(e.report)}")
+        return None
+    if not report.empty:
+        print(f"Quarantined {len(df) - len(valid)} row(s) with invalid facts; report written to: {quarantine_file}")
+    return valid
 
-    # Add schemaRef
-    schema_ref = etree.SubElement(root, f"{{{namespaces['link']}}}schemaRef")
-    schema_ref.set(f"{{{namespaces['xlink']}}}type", "simple")
-    schema_ref.set(f"{{{namespaces['xlink']}}}href", "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024.xsd")
 
-    # Create a context element
-    context = etree.SubElement(root, f"{{{namespaces['xbrli']}}}context", id="ctx1")
-    entity = etree.SubElement(context, f"{{{namespaces['xbrli']}}}entity")
+def _str_strip_column(series):
+    """
+    Column-wise equivalent of str(value).strip() for every cell of a Series.
+    Missing values and datetimes go through str() so they render exactly as
+    they do on a row-by-row walk ('nan', 'NaT', '2024-01-01 00:00:00').
+    """
+    if series.hasnans or series.dtype.kind == "M":
+        text = series.map(str)
+    else:
+        text = series.astype(str)
+    return text.str.strip()
 
-    # Read Excel data using pandas
+
+def group_rows_by_path1(df, registry=None):
+    """
+    Cleans the ID/path1/field/value columns and groups the fields by path1.
+
+    Groups are returned in order of first appearance of their path1 and keep
+    the original row order inside each group, as a list of
+    (path1, fields, values) tuples. With a ContextRegistry the rows'
+    contexts and units are registered and each tuple gets a fourth item:
+    the attribute dicts (contextRef, unitRef, decimals) of its fields.
+    """
+    missing = [col for col in ("ID", "path1", "field", "value") if col not in df.columns]
+    if missing:
+        print(f"Error processing rows: missing column(s) {', '.join(missing)}")
+        return []
+
+    path1 = _str_strip_column(df["path1"]).to_numpy(dtype=object)
+    fields = _str_strip_column(df["field"]).to_numpy(dtype=object)
+    values = _str_strip_column(df["value"]).to_numpy(dtype=object)
+
+    codes, uniques = pd.factorize(path1, sort=False)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(uniques)))))
+    fields = fields[order]
+    values = values[order]
+
+    if registry is not None:
+        attributes = registry.register(df)[order]
+        return [
+            (uniques[i], fields[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]], attributes[bounds[i]:bounds[i + 1]])
+            for i in range(len(uniques))
+        ]
+    return [
+        (uniques[i], fields[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]])
+        for i in range(len(uniques))
+    ]
+
+
+def _build_tuple(parent_root, path1, fields, values, tag_cache, verbose=False, attributes=None):
+    """
+    Appends the element for one path1 tuple, with all its fields, to parent_root.
+    Errors are reported the same way as the tree engine: whatever was built
+    before the failing field is kept. attributes holds each field's attribute
+    dict; without it every field gets contextRef="ctx1".
+    """
     try:
-        df = pd.read_excel(excel_file)
-    except FileNotFoundError:
-        print(f"Error: Excel file '{excel_file}' not found.")
-        return
+        if verbose:
+            print(f"Processing Path1: {path1}")
+        tag = tag_cache.get(path1)
+        if tag is None:
+            tag = tag_cache[path1] = _qualify(path1)
+        parent_element = etree.SubElement(parent_root, tag)
+        for i, (field, value) in enumerate(zip(fields, values)):
+            if verbose:
+                print(f"  Adding Field: {field}, Value: {value}")
+            tag = tag_cache.get(field)
+            if tag is None:
+                tag = tag_cache[field] = _qualify(field)
+            if attributes is None:
+                element = etree.SubElement(parent_element, tag, contextRef="ctx1")
+            else:
+                element = etree.SubElement(parent_element, tag, attributes[i])
+            element.text = value
     except Exception as e:
-        print(f"Error reading Excel file: {e}")
-        return
+        print(f"Error creating elements for Path1 {path1}: {e}")
+
+
+def _skeleton(nsmap, registry=None):
+    """
+    Header (everything before the first tuple) and footer bytes of an instance.
+    """
+    skeleton = etree.tostring(_create_root(nsmap, registry), pretty_print=True, xml_declaration=True, encoding="UTF-8")
+    footer = f"</xbrli:xbrl>\n".encode("UTF-8")
+    return skeleton[:-len(footer)], footer
+
+
+def _serialise_groups(groups, chunk_size, verbose, nsmap, tags):
+    """
+    Yields the serialised bytes of each group from group_rows_by_path1, in
+    order; a group whose element could not be created yields b"".
+
+    Groups are serialised in chunks under a bare root with the instance's
+    nsmap, so indentation and namespace prefixes match a pretty-printed
+    write of the complete tree. Each top-level tuple starts a line with
+    exactly two spaces and a '<' (values have '<' escaped), which is where
+    a chunk is cut into per-group fragments.
+    """
+    _, footer = _skeleton(nsmap)
+    chunk_root = etree.Element(f"{{{NAMESPACES['xbrli']}}}xbrl", nsmap=nsmap)
+    tag_cache = dict(tags or {})
+
+    for start in range(0, len(groups), chunk_size):
+        built = []
+        for path1, fields, values, *attributes in groups[start:start + chunk_size]:
+            count = len(chunk_root)
+            _build_tuple(chunk_root, path1, fields, values, tag_cache, verbose, *attributes)
+            built.append(len(chunk_root) > count)
+        if not len(chunk_root):
+            yield from (b"" for _ in built)
+            continue
+        chunk = etree.tostring(chunk_root, pretty_print=True, encoding="UTF-8")
+        # Drop the root start tag line and the closing tag.
+        body = chunk[chunk.index(b"\n") + 1:-len(footer)]
+        chunk_root.clear()
+        cuts = [0]
+        position = body.find(b"\n  <")
+        while position != -1:
+            if body[position + 4:position + 5] != b"/":
+                cuts.append(position + 1)
+            position = body.find(b"\n  <", position + 1)
+        cuts.append(len(body))
+        fragments = iter(body[cuts[i]:cuts[i + 1]] for i in range(len(cuts) - 1))
+        for has_element in built:
+            yield next(fragments) if has_element else b""
+
+
+def write_xbrl_stream(groups, output_file, chunk_size=STREAM_CHUNK_SIZE, verbose=False, nsmap=NAMESPACES, tags=None,
+                      registry=None):
+    """
+    Writes an XBRL instance for the given (path1, fields, values) groups,
+    serialising the tuples in chunks straight to disk instead of keeping the
+    whole tree in memory.
+
+    The bytes written are identical to a pretty-printed ElementTree.write of
+    the complete tree: the header and footer come from serialising the root
+    skeleton, and each chunk is serialised under a bare root with the same
+    nsmap so indentation and namespace prefixes match.
+
+    nsmap and tags come from resolve_taxonomy_names when writing against a
+    taxonomy; by default names are resolved with NAMESPACES. registry is
+    the ContextRegistry the groups were built with, if any; its contexts
+    and units replace ctx1.
+    """
+    header, footer = _skeleton(nsmap, registry)
+    with open(output_file, "wb") as out:
+        out.write(header)
+        for fragment in _serialise_groups(groups, chunk_size, verbose, nsmap, tags):
+            out.write(fragment)
+        out.write(footer)
+
+
+def _group_fingerprint(path1, fields, values, attributes=None):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(path1.encode("utf-8"))
+    for field, value in zip(fields, values):
+        # Separators that cannot occur in the cleaned cells' framing.
+        digest.update(b"\x1e" + field.encode("utf-8") + b"\x1f" + value.encode("utf-8"))
+    if attributes is not None:
+        for attrib in attributes:
+            digest.update(("\x1d" + "\x1f".join(attrib.values())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_fragments(manifest_file, output_file, header):
+    """
+    Returns {path1: (fingerprint, offset, length)} from the fragment manifest
+    of an existing instance, or None if there is none or it no longer
+    describes the file on disk (other header, or the file was changed).
+    """
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (manifest.get("version") != FRAGMENT_VERSION
+                or manifest["header"] != hashlib.sha256(header).hexdigest()
+                or manifest["size"] != os.path.getsize(output_file)
+                or manifest["sha256"] != file_sha256(output_file)):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return {path1: (fingerprint, offset, length) for path1, fingerprint, offset, length in manifest["groups"]}
+
+
+def write_xbrl_incremental(groups, output_file, chunk_size=STREAM_CHUNK_SIZE, verbose=False, nsmap=NAMESPACES, tags=None,
+                           registry=None):
+    """
+    Writes the same bytes as write_xbrl_stream, but reuses the tuples of the
+    previous run: a manifest next to the output (output_file +
+    FRAGMENT_SUFFIX) records a fingerprint and byte range per path1 group,
+    and only groups whose rows changed are serialised again. Unchanged
+    fragments are copied from the existing instance into a new file that
+    then replaces it. A change in the contexts or units changes the header
+    and rebuilds every group.
+
+    Returns:
+        tuple: (number of groups serialised, number of groups).
+    """
+    header, footer = _skeleton(nsmap, registry)
+    manifest_file = output_file + FRAGMENT_SUFFIX
+    previous = _load_fragments(manifest_file, output_file, header) or {}
+
+    fingerprints = [_group_fingerprint(*group) for group in groups]
+    changed = [i for i, (path1, *_) in enumerate(groups) if previous.get(path1, (None,))[0] != fingerprints[i]]
+    fresh = _serialise_groups([groups[i] for i in changed], chunk_size, verbose, nsmap, tags)
+    changed = set(changed)
+
+    entries = []
+    tmp_file = output_file + ".tmp"
+    source = open(output_file, "rb") if previous else None
+    try:
+        digest = hashlib.sha256()
+        with open(tmp_file, "wb") as out:
+            def write(data):
+                out.write(data)
+                digest.update(data)
+
+            write(header)
+            offset = len(header)
+            for i, (path1, *_) in enumerate(groups):
+                if i in changed:
+                    fragment = next(fresh)
+                else:
+                    _, old_offset, length = previous[path1]
+                    source.seek(old_offset)
+                    fragment = source.read(length)
+                write(fragment)
+                entries.append((path1, fingerprints[i], offset, len(fragment)))
+                offset += len(fragment)
+            write(footer)
+    finally:
+        if source is not None:
+            source.close()
+    os.replace(tmp_file, output_file)
+
+    manifest = {
+        "version": FRAGMENT_VERSION,
+        "header": hashlib.sha256(header).hexdigest(),
+        "size": offset + len(footer),
+        "sha256": digest.hexdigest(),
+        "groups": entries,
+    }
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, manifest_file)
+    return len(changed), len(groups)
+
+
+def _write_xbrl_tree(df, output_file, nsmap=NAMESPACES, verbose=False):
+    """
+    Original engine: walks the rows one by one and builds the whole lxml tree
+    in memory before writing it.
+    """
+    root = _create_root(nsmap)
 
     # Group by path1 first - all elements with the same path1 will go into the same parent
     # regardless of their ID
@@ -89,29 +414,275 @@ def create_xbrl_from_excel(excel_file, output_file):
     # Process each path1 group
     for path1, field_value_pairs in path1_data.items():
         try:
-            print(f"Processing Path1: {path1}") # Debugging
+            if verbose:
+                print(f"Processing Path1: {path1}") # Debugging
             
             # Create one parent element for each path1
             parent_element_name = path1.split(':')[1]
-            parent_element = etree.SubElement(root, f"{{{namespaces[path1.split(':')[0]]}}}{parent_element_name}")
+            parent_element = etree.SubElement(root, f"{{{nsmap[path1.split(':')[0]]}}}{parent_element_name}")
             
             # Add all child elements under this parent
             for field, value in field_value_pairs:
-                print(f"  Adding Field: {field}, Value: {value}") # Debugging
+                if verbose:
+                    print(f"  Adding Field: {field}, Value: {value}") # Debugging
                 element_name = field.split(':')[1]
-                element = etree.SubElement(parent_element, f"{{{namespaces[field.split(':')[0]]}}}{element_name}", contextRef="ctx1")
+                element = etree.SubElement(parent_element, f"{{{nsmap[field.split(':')[0]]}}}{element_name}", contextRef="ctx1")
                 element.text = value
                 
         except Exception as e:
             print(f"Error creating elements for Path1 {path1}: {e}")
 
     # Write the XML tree to a file
+    tree = etree.ElementTree(root)
+    tree.write(output_file, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
+
+def create_xbrl_from_excel(excel_file, output_file, engine="streaming", verbose=False, taxonomy=None,
+                           validation=None, quarantine_file=None, incremental=False):
+    """
+    Reads data from an Excel file, transforms it, and writes it to an XBRL file,
+    grouping fields by path1 first, then by ID.
+
+    Args:
+        excel_file (str): Path to the input Excel file.
+        output_file (str): Path to the output XBRL file.
+        engine (str): "streaming" (default) cleans and groups the columns in
+            one pass and writes the tuples incrementally; "tree" is the
+            original row-by-row engine. Both produce the same bytes.
+        verbose (bool): Print a line for every path1 and field; also on
+            at instrumentation verbose level 2 (HACKTOVA_VERBOSE=2).
+        taxonomy: TaxonomyIndex or local taxonomy package path. When given,
+            names are resolved with it and the file is not written if any
+            path1 or field is not allowed by the taxonomy.
+        validation (str): None, "fail" or "quarantine". Checks the values
+            against the taxonomy's concept types before writing (see
+            fact_validation); "fail" writes nothing if any fact is invalid,
+            "quarantine" leaves the invalid rows out.
+        quarantine_file (str): CSV report of the quarantined rows; defaults
+            to the output file name with ".quarantine.csv" appended.
+        incremental (bool): Streaming engine only. Keep a fragment manifest
+            next to the output and, on later runs, serialise only the path1
+            groups whose rows changed (see write_xbrl_incremental). The file
+            is identical to a full rebuild.
+
+    Workbooks with entity, period, unit, decimals or "dim:" columns (see
+    xbrl_contexts) get one context per distinct entity/period/dimensions
+    combination and one unit per measure instead of ctx1; this needs the
+    streaming engine.
+    """
+
+    verbose = verbose or instrumentation.verbose(2)
+    # Read Excel data using pandas
     try:
-        tree = etree.ElementTree(root)
-        tree.write(output_file, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+        with instrumentation.span("xbrl.read"):
+            df = pd.read_excel(excel_file)
+    except FileNotFoundError:
+        print(f"Error: Excel file '{excel_file}' not found.")
+        return
+    except Exception as e:
+        print(f"Error reading Excel file: {e}")
+        return
+
+    if taxonomy is not None and not isinstance(taxonomy, TaxonomyIndex):
+        taxonomy = load_taxonomy(taxonomy)
+    if validation is not None:
+        with instrumentation.span("xbrl.validate"):
+            df = validate_rows(df, taxonomy, validation, quarantine_file or output_file + ".quarantine.csv")
+        if df is None:
+            return
+    instrumentation.count("xbrl_rows", len(df))
+
+    registry = ContextRegistry() if has_context_columns(df) else None
+    groups = None
+    nsmap, tags = NAMESPACES, None
+    if taxonomy is not None:
+        try:
+            with instrumentation.span("xbrl.group"):
+                groups = group_rows_by_path1(df, registry)
+            nsmap, tags = resolve_taxonomy_names(groups, taxonomy)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+
+    try:
+        if engine not in ("tree", "streaming"):
+            raise ValueError(f"Unknown engine '{engine}'")
+        if engine != "streaming" and (incremental or registry is not None):
+            raise ValueError("incremental mode and context columns need the streaming engine")
+        if engine == "tree":
+            with instrumentation.span("xbrl.write"):
+                _write_xbrl_tree(df, output_file, nsmap, verbose)
+        else:
+            if groups is None:
+                with instrumentation.span("xbrl.group"):
+                    groups = group_rows_by_path1(df, registry)
+            instrumentation.count("xbrl_tuples", len(groups))
+            instrumentation.count("xbrl_facts", sum(len(fields) for _, fields, *_ in groups))
+            if registry is not None:
+                nsmap = registry.extend_nsmap(nsmap, taxonomy)
+            with instrumentation.span("xbrl.write"):
+                if incremental:
+                    rebuilt, total = write_xbrl_incremental(groups, output_file, verbose=verbose, nsmap=nsmap,
+                                                            tags=tags, registry=registry)
+                    print(f"Rebuilt {rebuilt} of {total} path1 tuples.")
+                else:
+                    write_xbrl_stream(groups, output_file, verbose=verbose, nsmap=nsmap, tags=tags,
+                                      registry=registry)
         print(f"XBRL file created successfully: {output_file}")
     except Exception as e:
         print(f"Error writing XBRL file: {e}")
 
+
+def _entity_file_name(entity):
+    """
+    Sanitises an entity ID into a file name such as "entity_123456.xbrl".
+    """
+    safe_name = re.sub(r"[^\w.-]", "_", str(entity).strip().replace(" ", "_"))
+    return f"entity_{safe_name}.xbrl"
+
+
+def _entity_file_names(entities):
+    """
+    File names for the entities, in order. IDs that sanitise to the same name
+    (e.g. "A/B" and "A_B", or IDs differing only in case) get a numbered
+    suffix, so no instance overwrites another.
+    """
+    file_names, used = [], {}
+    for entity in entities:
+        file_name = _entity_file_name(entity)
+        stem, ext = os.path.splitext(file_name)
+        number = 1
+        while file_name.lower() in used:
+            number += 1
+            file_name = f"{stem}_{number}{ext}"
+        if number > 1:
+            print(f"Entity '{entity}' has the same file name as '{used[_entity_file_name(entity).lower()]}'; "
+                  f"writing it to {file_name}")
+        used[file_name.lower()] = entity
+        file_names.append(file_name)
+    return file_names
+
+
+def _write_entity_instance(entity, df, output_file, nsmap=NAMESPACES, tags=None, contexts=False, id_column="ID"):
+    """
+    Worker for create_xbrl_batch: writes the instance for one entity and
+    returns (entity, output_file, error) instead of raising.
+    """
+    try:
+        registry = ContextRegistry(id_column=id_column) if contexts else None
+        write_xbrl_stream(group_rows_by_path1(df, registry), output_file, nsmap=nsmap, tags=tags, registry=registry)
+        return entity, output_file, None
+    except Exception as e:
+        return entity, output_file, f"{type(e).__name__}: {e}"
+
+
+def create_xbrl_batch(excel_file, output_dir, id_column="ID", max_workers=None, taxonomy=None,
+                      validation=None, quarantine_file=None):
+    """
+    Reads an Excel file once and writes one XBRL instance per entity, where
+    the entities are the distinct values of id_column. Instances are built in
+    a process pool.
+
+    Args:
+        excel_file (str): Path to the input Excel file.
+        output_dir (str): Directory for the entity_<ID>.xbrl files; IDs that
+            sanitise to the same file name get a numbered suffix.
+        id_column (str): Column holding the entity/ID the rows are
+            partitioned by; rows without an ID are skipped.
+        max_workers (int): Number of worker processes; None uses the CPU count
+            and 1 builds every instance in this process.
+        taxonomy: TaxonomyIndex or local taxonomy package path; the names of
+            the whole workbook are checked against it before any instance
+            is written.
+        validation (str): None, "fail" or "quarantine", as for
+            create_xbrl_from_excel; applied to the whole workbook.
+        quarantine_file (str): CSV report of the quarantined rows; defaults
+            to quarantine.csv in output_dir.
+
+    Returns:
+        list: (entity, output_file, error) tuples in order of first appearance
+        of the entity in the workbook; error is None on success.
+    """
+    # Create output directory if it doesn't exist.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    try:
+        df = pd.read_excel(excel_file)
+    except FileNotFoundError:
+        print(f"Error: Excel file '{excel_file}' not found.")
+        return []
+    except Exception as e:
+        print(f"Error reading Excel file: {e}")
+        return []
+
+    if id_column not in df.columns:
+        print(f"Error: column '{id_column}' not found in '{excel_file}'.")
+        return []
+
+    if taxonomy is not None and not isinstance(taxonomy, TaxonomyIndex):
+        taxonomy = load_taxonomy(taxonomy)
+    if validation is not None:
+        df = validate_rows(df, taxonomy, validation, quarantine_file or os.path.join(output_dir, "quarantine.csv"))
+        if df is None:
+            return []
+
+    nsmap, tags = NAMESPACES, None
+    if taxonomy is not None:
+        try:
+            nsmap, tags = resolve_taxonomy_names(group_rows_by_path1(df), taxonomy)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return []
+
+    # Each entity gets its own contexts; the namespaces their QNames need
+    # are collected over the whole workbook, once.
+    contexts = has_context_columns(df)
+    if contexts:
+        registry = ContextRegistry(id_column=id_column)
+        try:
+            registry.register(df)
+            nsmap = registry.extend_nsmap(nsmap, taxonomy)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return []
+
+    # Rows without an ID belong to no entity; they are reported and left out.
+    ids = _str_strip_column(df[id_column])
+    no_id = (df[id_column].isna() | (ids == "")).to_numpy()
+    if no_id.any():
+        rows = [str(row + 2) for row in df.index[no_id][:10]]
+        more = f" and {no_id.sum() - 10} more" if no_id.sum() > 10 else ""
+        print(f"Skipping {no_id.sum()} row(s) without an {id_column}: row(s) {', '.join(rows)}{more}")
+        df, ids = df[~no_id], ids[~no_id]
+
+    # Partition the rows by the cleaned entity ID, keeping workbook order.
+    codes, entities = pd.factorize(ids, sort=False)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(entities)))))
+    jobs = [
+        (entity, df.iloc[order[bounds[i]:bounds[i + 1]]], os.path.join(output_dir, file_name))
+        for i, (entity, file_name) in enumerate(zip(entities, _entity_file_names(entities)))
+    ]
+
+    if max_workers == 1:
+        results = [_write_entity_instance(*job, nsmap, tags, contexts, id_column) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_write_entity_instance, *job, nsmap, tags, contexts, id_column) for job in jobs]
+            results = []
+            for (entity, _, output_file), future in zip(jobs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # The worker itself died (e.g. BrokenProcessPool).
+                    results.append((entity, output_file, f"{type(e).__name__}: {e}"))
+
+    failed = [result for result in results if result[2] is not None]
+    for entity, output_file, error in failed:
+        print(f"Error creating XBRL file for entity {entity}: {error}")
+    print(f"Created {len(results) - len(failed)} of {len(results)} XBRL files in: {output_dir}")
+    return results
+
 if __name__ == '__main__':
     create_xbrl_from_excel('test aanmaak xbrl01.xlsx', 'output.xbrl')
\ No newline at end of file
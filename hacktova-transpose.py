@@ -1,97 +1,118 @@
+import re
 import pandas as pd
 from openpyxl import Workbook
 
-def group_processed_sheet(input_file, output_file):
-    width = 1  # Number of columns in the group path (H, I, J)
-
-    # Read the 'Processed' worksheet without headers and skip the first row.
-    df = pd.read_excel(input_file, sheet_name='Processed', header=None, skiprows=1)
-
-    # Pre-clean the grouping columns (H, I, J => indices 7, 8, 9)
-    # Convert non-null values to stripped strings,
-    # and fill nulls with an empty string so that only H is used to check for emptiness.
-    for col in [7, 8, 9]:
-        df[col] = df[col].apply(lambda x: str(x).strip() if pd.notna(x) else "")
-
+import instrumentation
+from workbook_cache import read_sheet_cached
+
+# Characters Excel does not allow in sheet names, and the name length limit.
+INVALID_TITLE_CHARS = re.compile(r"[\\*?:/\[\]]")
+MAX_TITLE_LENGTH = 31
+
+def sheet_title(name, used):
+    """
+    Returns an Excel-safe, unique sheet name for `name`: invalid characters
+    become "_", the name is cut to 31 characters, and a name already in `used`
+    (compared case-insensitively, as Excel does) gets the next free numeric
+    suffix the way openpyxl renames duplicates, still within 31 characters.
+    `used` maps lowercased names to the last suffix handed out and is updated.
+    """
+    title = INVALID_TITLE_CHARS.sub("_", str(name))[:MAX_TITLE_LENGTH] or "Sheet"
+    key = title.lower()
+    if key not in used:
+        used[key] = 0
+        return title
+    count = used[key]
+    while True:
+        count += 1
+        suffix = str(count)
+        candidate = title[:MAX_TITLE_LENGTH - len(suffix)] + suffix
+        if candidate.lower() not in used:
+            break
+    used[key] = count
+    used[candidate.lower()] = 0
+    return candidate
+
+def index_groups(df):
+    """
+    Sorts the rows into their H/I/J groups and works out every sheet up front.
+
+    Returns the sorted DataFrame, the group bounds into it and a list with,
+    per group, (path_H, path_I, path_J, sheet name, subgroup sheet names).
+    Groups with an empty path_H are left out. A group with an empty path_I
+    is a parent; the subgroups of the last parent seen for a path_H are the
+    groups with that path_H and a nonempty path_I.
+    """
     # Group rows by the three path columns (columns H, I, J are indices 7, 8, 9)
-    groups = df.groupby([7, 8, 9], as_index=False)
-
-    # Create a new workbook (remove the automatic sheet)
-    wb = Workbook()
-    default_sheet = wb.active
-    wb.remove(default_sheet)
-
-    # Create a dictionary to track parent groups (path_H with an empty path_I)
-    # Keys in this dictionary are the value of column H.
-    # Each value holds the parent's worksheet, its group, and a list of subgroup sheet names.
-    parent_map = {}
-
-    # Loop through each group to create sheets
-    for keys, group in groups:
-        # keys is a tuple with three path values (columns H, I, J)
-        path_H, path_I, path_J = keys
-        print(path_H, path_I, path_J)
-
+    grouped = df.groupby([7, 8, 9], sort=True)
+    sizes = grouped.size()
+    # Sort the rows by group, then by column K (index 10) within each group.
+    df = df.assign(_group=grouped.ngroup()).sort_values(by=["_group", 10], kind="stable", na_position="last")
+    bounds = [0] + sizes.cumsum().tolist()
+
+    sheets = []
+    used_titles = {}
+    parents = {}
+    for index, (path_H, path_I, path_J) in enumerate(sizes.index):
         # Only create a group if path_H is nonempty (I and J can be empty)
         if not path_H:
             continue
-
-        # Sort the group rows by column D (index 3) in ascending alphabetical order.
-        group = group.sort_values(by=[10])
-
         # Use the first row's value in column C (index 2) as the sheet name.
-        sheet_name = str(group.iloc[0, 2])
-        # Ensure the sheet name is a valid Excel name (max 31 characters).
-        if len(sheet_name) > 31:
-            sheet_name = sheet_name[:31]
-
-        ws = wb.create_sheet(title=sheet_name)
-
-        # Write the group path in first row cells A, B, C.
-        ws['A1'] = path_H
-        ws['B1'] = path_I
-        ws['C1'] = path_J
-
-        # Starting from column D (column index 4), process each row in the group.
-        # For each row, write two consecutive cells:
-        #   first cell (col2): value from column K (index 10)
-        #   second cell (below in row 2): value from column Q (index 16)
-        start_col = 4  # Column D
-        for idx, (_, row) in enumerate(group.iterrows()):
-            offset = idx * width
-            col1 = start_col + offset      # (unused cell if re-enabled for row[3])
-            col2 = col1 + 1                # for column K / Q values.
-            # ws.cell(row=1, column=col1, value=row[3])
-            ws.cell(row=1, column=col2, value=row[10])
-            ws.cell(row=2, column=col2, value=row[16])
-
-        # If this group is a parent (I is empty), store its worksheet and group info.
+        title = sheet_title(df.iloc[bounds[index], 2], used_titles)
+        subgroups = []
+        sheets.append((index, path_H, path_I, path_J, title, subgroups))
         if path_I == "":
-            parent_map[path_H] = {"sheet": ws, "group": group, "subgroups": []}
-        else:
-            # If I is not empty, check whether there's a parent with the same path_H.
-            if path_H in parent_map:
-                parent_map[path_H]["subgroups"].append(sheet_name)
+            parents[path_H] = subgroups
+        elif path_H in parents:
+            parents[path_H].append(title)
+    return df, bounds, sheets
 
-    # After processing all groups, update each parent's worksheet with its subgroups.
-    for parent_val, info in parent_map.items():
-        ws = info["sheet"]
-        group = info["group"]
-        subgroups = info["subgroups"]
-        if subgroups:
-            # Determine the next column following the group's last block.
-            # Each row in the group produced a three-cell block starting in column D.
-            num_blocks = group.shape[0]
-            # Last used column = start_col + (num_blocks-1)*3 + 2 (since each block takes 3 columns)
-            last_used = 4 + (num_blocks - 1) * width + 2 if num_blocks > 0 else width
-            next_col = last_used + 1
-            # Write a comma-separated list of subgroup sheet names prefixed with "Subgroups:".
-            ws.cell(row=1, column=next_col, value="Subgroups: " + ", ".join(subgroups))
+def group_processed_sheet(input_file, output_file, verbose=False):
+    # Read the 'Processed' worksheet without headers and skip the first row.
+    # The parsed sheet is cached in a sidecar until the workbook changes.
+    with instrumentation.span("transpose.read"):
+        df = read_sheet_cached(input_file, sheet_name='Processed', skiprows=1)
+    instrumentation.count("transpose_rows", len(df))
+    # The group path of every sheet is only printed when asked for.
+    verbose = verbose or instrumentation.verbose()
 
-    wb.save(output_file)
+    # Pre-clean the grouping columns (H, I, J => indices 7, 8, 9)
+    # Convert non-null values to stripped strings,
+    # and fill nulls with an empty string so that only H is used to check for emptiness.
+    for col in [7, 8, 9]:
+        df[col] = df[col].map(str).str.strip().where(df[col].notna(), "")
+
+    with instrumentation.span("transpose.index"):
+        df, bounds, sheets = index_groups(df)
+    instrumentation.count("transpose_sheets", len(sheets))
+
+    # Pivot columns K and Q (indices 10, 16) of every group in one go.
+    k_values = df[10].to_numpy(dtype=object)
+    q_values = df[16].to_numpy(dtype=object)
+
+    # Every sheet is written exactly once, so a write-only workbook is enough.
+    wb = Workbook(write_only=True)
+
+    with instrumentation.span("transpose.write"):
+        for index, path_H, path_I, path_J, title, subgroups in sheets:
+            if verbose:
+                print(path_H, path_I, path_J)
+            start, end = bounds[index], bounds[index + 1]
+            ws = wb.create_sheet(title=title)
+
+            # Row 1: the group path in A, B, C, then column K of every row from E on.
+            # Row 2: column Q of every row under its K value.
+            first_row = [path_H, path_I, path_J, None] + k_values[start:end].tolist()
+            if subgroups:
+                # Leave one empty column after the last value, then list the subgroup sheets.
+                first_row += [None, "Subgroups: " + ", ".join(subgroups)]
+            ws.append(first_row)
+            ws.append([None, None, None, None] + q_values[start:end].tolist())
+
+        wb.save(output_file)
     print(f"Created grouped Excel file: {output_file}")
 
 if __name__ == "__main__":
     input_excel = "LibE2025dev.xlsx"      # Input file
     output_excel = "grouped_output_with_values_compact.xlsx"  # Output file
-    group_processed_sheet(input_excel, output_excel)
\ No newline at end of file
+    group_processed_sheet(input_excel, output_excel)
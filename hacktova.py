@@ -1,17 +1,298 @@
+import os
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 
-def create_mfd_from_xbrl(xbrl_file, mfd_file):
+import instrumentation
+from taxonomy_index import TaxonomyIndex, format_problems, load_taxonomy
+
+XBRLI_NS = "http://www.xbrl.org/2003/instance"
+LINK_NS = "http://www.xbrl.org/2003/linkbase"
+MAPFORCE_NS = "http://www.altova.com/mapforce"
+DEFAULT_SCHEMA = "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024.xsd"
+# Fact attributes that get their own attribute entry in the XBRL component.
+FACT_ATTRIBUTES = ("contextRef", "unitRef", "decimals", "precision")
+
+# Layout, in MapForce view coordinates.
+ROW_HEIGHT = 17
+HEADER_HEIGHT = 36
+LAYER_GAP = 120
+COMPONENT_GAP = 4
+CHAR_WIDTH = 7
+MAX_CONSTANT_WIDTH = 300
+
+
+class _FactNode:
+    """
+    One fact or tuple of the input instance. children maps (ns index, local
+    name) to the occurrences in document order; repeated occurrences become
+    clone entries.
+    """
+
+    __slots__ = ("ns", "name", "children", "value", "attributes")
+
+    def __init__(self, ns, name):
+        self.ns = ns
+        self.name = name
+        self.children = {}
+        self.value = None
+        self.attributes = None
+
+
+def _split(tag):
+    if tag.startswith("{"):
+        uri, name = tag[1:].split("}", 1)
+        return uri, name
+    return "", tag
+
+
+def read_instance_facts(xbrl_file):
+    """
+    Reads the facts and tuples of an XBRL instance in one iterparse pass,
+    discarding each element once read.
+
+    Returns:
+        tuple: (schema location or None, list of concept namespace URIs in
+        first-use order, root _FactNode whose children are the top-level
+        facts and tuples)
+    """
+    namespaces = []
+    ns_index = {}
+    root = _FactNode(None, None)
+    stack = []
+    schema = None
+    depth = 0
+    document = None
+
+    for event, elem in ET.iterparse(xbrl_file, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if document is None:
+                document = elem
+            uri, name = _split(elem.tag)
+            if depth == 1 or (stack and stack[-1] is None) or uri in (XBRLI_NS, LINK_NS):
+                # The root, and contexts, units, schemaRef and footnotes with their content.
+                stack.append(None if depth > 1 else root)
+                if uri == LINK_NS and name == "schemaRef":
+                    schema = elem.get("{http://www.w3.org/1999/xlink}href")
+                continue
+            if uri not in ns_index:
+                ns_index[uri] = len(namespaces)
+                namespaces.append(uri)
+            node = _FactNode(ns_index[uri], name)
+            stack[-1].children.setdefault((node.ns, name), []).append(node)
+            stack.append(node)
+        else:
+            depth -= 1
+            node = stack.pop()
+            if node is not None and node is not root and not node.children:
+                node.value = (elem.text or "").strip()
+                node.attributes = [(name, elem.get(name)) for name in FACT_ATTRIBUTES if elem.get(name) is not None]
+            if depth == 1:
+                # Drop the top-level element just read.
+                document.clear()
+    return schema, namespaces, root
+
+
+class _Allocator:
+    """
+    Hands out uids and datapoint keys in call order, so the same instance
+    always gives the same numbering.
+    """
+
+    def __init__(self, first_uid=2, first_key=1):
+        self.uid = first_uid
+        self.key = first_key
+
+    def next_uid(self):
+        self.uid += 1
+        return self.uid - 1
+
+    def next_key(self):
+        self.key += 1
+        return self.key - 1
+
+
+def layered_layout(sizes, edges, origin=(0, 0)):
+    """
+    Layered auto-layout in O(n log n + e): components are placed in columns
+    by longest path from the sources, and each column is ordered by the
+    barycenter of the rows its edges point at and stacked top to bottom
+    without overlap.
+
+    Args:
+        sizes (list): (width, height) per component.
+        edges (list): (source, target, y) with component indexes and the
+            y offset of the connected row within the target component.
+        origin (tuple): Top-left corner of the first column.
+
+    Returns:
+        list: (ltx, lty, rbx, rby) per component.
+    """
+    n = len(sizes)
+    successors = [[] for _ in range(n)]
+    indegree = [0] * n
+    for source, target, _ in edges:
+        successors[source].append(target)
+        indegree[target] += 1
+
+    # Longest-path layering in topological order.
+    layer = [0] * n
+    ready = [i for i in range(n) if indegree[i] == 0]
+    while ready:
+        i = ready.pop()
+        for j in successors[i]:
+            layer[j] = max(layer[j], layer[i] + 1)
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                ready.append(j)
+
+    # Rightmost layers first: a column's y positions depend on the next one.
+    columns = {}
+    for i in range(n):
+        columns.setdefault(layer[i], []).append(i)
+    widths = {number: max(sizes[i][0] for i in members) for number, members in columns.items()}
+    x = {}
+    left = origin[0]
+    for number in sorted(columns):
+        x[number] = left
+        left += widths[number] + LAYER_GAP
+
+    boxes = [None] * n
+    incoming = [[] for _ in range(n)]
+    for source, target, y in edges:
+        incoming[source].append((target, y))
+    for number in sorted(columns, reverse=True):
+        wanted = []
+        for i in columns[number]:
+            rows = [boxes[target][1] + y for target, y in incoming[i] if boxes[target] is not None]
+            centre = sum(rows) / len(rows) if rows else origin[1]
+            wanted.append((centre, i))
+        wanted.sort()
+        bottom = None
+        for centre, i in wanted:
+            top = int(centre - sizes[i][1] / 2)
+            if bottom is not None:
+                top = max(top, bottom + COMPONENT_GAP)
+            top = max(top, origin[1])
+            boxes[i] = (x[number], top, x[number] + sizes[i][0], top + sizes[i][1])
+            bottom = top + sizes[i][1]
+    return boxes
+
+
+_ATTRIBUTE_ESCAPES = str.maketrans({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;",
+})
+
+
+def _attrs(**attributes):
+    return "".join(
+        f' {name}="{value if isinstance(value, int) else value.translate(_ATTRIBUTE_ESCAPES)}"'
+        for name, value in attributes.items() if value is not None
+    )
+
+
+class _MfdWriter:
+    """
+    Writes MapForce-style XML (tab indented) line by line to a file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.depth = 0
+
+    def line(self, text):
+        self.f.write("\t" * self.depth + text + "\n")
+
+    def empty(self, tag, **attributes):
+        self.line(f"<{tag}{_attrs(**attributes)}/>")
+
+    def open(self, tag, **attributes):
+        self.line(f"<{tag}{_attrs(**attributes)}>")
+        self.depth += 1
+
+    def close(self, tag):
+        self.depth -= 1
+        self.line(f"</{tag}>")
+
+
+def check_facts(root, namespaces, taxonomy):
+    """
+    Checks the facts read by read_instance_facts against a TaxonomyIndex:
+    every fact and tuple must be a concept, and every child of a tuple part
+    of its content model.
+
+    Returns:
+        tuple: (concepts, problems) with the Concept per "{uri}local" name
+        seen and one message per problem.
+    """
+    concepts = {}
+    problems = []
+    reported = set()
+
+    def walk(node, parent_name):
+        for (ns, name), occurrences in node.children.items():
+            clark = f"{{{namespaces[ns]}}}{name}"
+            concept = taxonomy.concepts.get(clark)
+            if concept is None:
+                if clark not in reported:
+                    reported.add(clark)
+                    problems.append(f"unknown concept {clark}")
+                continue
+            concepts[clark] = concept
+            if parent_name is not None and clark not in taxonomy.tuples.get(parent_name, ()):
+                if (parent_name, clark) not in reported:
+                    reported.add((parent_name, clark))
+                    problems.append(f"{clark} is not allowed in tuple {parent_name}")
+            for child in occurrences:
+                walk(child, clark)
+
+    walk(root, None)
+    return concepts, problems
+
+
+def _plan_entries(root, alloc):
+    """
+    Allocates the inpkeys of the fact entries in pre-order and returns the
+    flat entry list (depth, node, clone, fact key, [(attribute, value, key)]).
+    """
+    entries = []
+
+    def walk(node, depth):
+        for occurrences in node.children.values():
+            for index, child in enumerate(occurrences):
+                key = alloc.next_key() if child.value is not None else None
+                attributes = [(name, value, alloc.next_key()) for name, value in child.attributes or ()]
+                entries.append((depth, child, index > 0, key, attributes))
+                walk(child, depth + 1)
+
+    walk(root, 0)
+    return entries
+
+
+def create_mfd_from_xbrl(xbrl_file, mfd_file, output_instance="output.xbrl", taxonomy=None):
     """
     Creates an MFD (MapForce Definition) XML file based on an XBRL file structure.
 
+    Every fact of the instance gets an entry in the XBRL target component
+    (repeated facts and tuples as clone entries) fed by a constant with its
+    value; its contextRef, unitRef, decimals and precision attributes are fed
+    by one shared constant per distinct value. uids and keys are allocated
+    in document order and the components are placed with layered_layout.
+    The XML is written as it is generated, without building a tree.
+
     Args:
         xbrl_file (str): Path to the input XBRL file.
         mfd_file (str): Path to the output MFD file.
+        output_instance (str): Output instance the mapping writes.
+        taxonomy: TaxonomyIndex or local taxonomy package path. When given,
+            no MFD is written if a fact is not allowed by the taxonomy, and
+            the constants of numeric concepts are typed decimal; otherwise
+            facts with a unitRef are.
     """
 
     try:
-        tree = ET.parse(xbrl_file)
-        root = tree.getroot()
+        with instrumentation.span("mfd.read"):
+            schema_location, concept_namespaces, root = read_instance_facts(xbrl_file)
     except FileNotFoundError:
         print(f"Error: XBRL file '{xbrl_file}' not found.")
         return
@@ -19,88 +300,175 @@ def create_mfd_from_xbrl(xbrl_file, mfd_file):
         print(f"Error parsing XBRL file '{xbrl_file}': {e}")
         return
 
-    # Define the MFD root element and attributes
-    mapping = ET.Element("mapping", attrib={"xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance", "version": "22"})
-
-    # Add <resources/> element
-    resources = ET.SubElement(mapping, "resources")
-
-    # Create the <component> element
-    component = ET.SubElement(mapping, "component", attrib={"name": "defaultmap", "uid": "1", "editable": "1", "blackbox": "0"})
-    properties = ET.SubElement(component, "properties", attrib={"SelectedLanguage": "builtin"})
-    structure = ET.SubElement(component, "structure")
-    children = ET.SubElement(structure, "children")
-
-    # Create input component (similar to your example MFD)
-    input_component = ET.SubElement(children, "component", attrib={"name": "input", "library": "core", "uid": "6", "kind": "6"})
-    sources = ET.SubElement(input_component, "sources")
-    datapoint = ET.SubElement(sources, "datapoint")
-    targets = ET.SubElement(input_component, "targets")
-    datapoint = ET.SubElement(targets, "datapoint")
-    view = ET.SubElement(input_component, "view", attrib={"ltx": "172", "lty": "46", "rbx": "245", "rby": "82"})
-    data = ET.SubElement(input_component, "data")
-    input_element = ET.SubElement(data, "input", attrib={"datatype": "string"}) # removed preview values for flexibility
-    input_element.text = xbrl_file # set the path to the xbrl file
-    parameter = ET.SubElement(data, "parameter", attrib={"usageKind": "input", "name": "input"})
-
-    #Create the XBRL component
-    xbrl_component = ET.SubElement(children, "component", attrib={"name": "bd-rpt-erf-aangifte-2024", "library": "xbrl", "uid": "7", "kind": "27"})
-    properties_xbrl = ET.SubElement(xbrl_component, "properties", attrib={"XSLTTargetEncoding": "UTF-8", "XSLTDefaultOutput": "1", "XBRLShowAllConcepts": "1", "XBRLShowAllConceptsRaw": "1"})
-    view_xbrl = ET.SubElement(xbrl_component, "view", attrib={"ltx": "1426", "lty": "74", "rbx": "2075", "rby": "1113"})
-    data_xbrl = ET.SubElement(xbrl_component, "data")
-    root_xbrl = ET.SubElement(data_xbrl, "root", attrib={"scrollposition": "8472"})
-    header_xbrl = ET.SubElement(root_xbrl, "header")
-    namespaces_xbrl = ET.SubElement(header_xbrl, "namespaces")
-
-    # Adding some default namespaces
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.xbrl.org/2003/instance"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.altova.com/mapforce"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.xbrl.org/2003/linkbase"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/sbr/20230301/dictionary/nl-common-data"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/2013/xbrl/sbr-dimensional-concepts"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-data-ext1"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/bd/20240221/dictionary/bd-tuples-ext1"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-tuples"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "view"})
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/bd/20240221/presentation/bd-abstr-ext1"})
-    ET.SubElement(namespaces_xbrl, "namespace")
-    ET.SubElement(namespaces_xbrl, "namespace", attrib={"uid": "http://www.nltaxonomie.nl/nt18/bd/20231213/dictionary/bd-data"})
-
-    # Get the schema location from the XBRL file
-    schema_ref = root.find('.//{http://www.xbrl.org/2003/linkbase}schemaRef')
-    if schema_ref is not None:
-        schema_location = schema_ref.get('{http://www.w3.org/1999/xlink}href')
-    else:
-        schema_location = "http://www.nltaxonomie.nl/nt18/bd/20240221/entrypoints/bd-rpt-erf-aangifte-2024.xsd"
+    concepts = None
+    if taxonomy is not None:
+        if not isinstance(taxonomy, TaxonomyIndex):
+            taxonomy = load_taxonomy(taxonomy)
+        concepts, problems = check_facts(root, concept_namespaces, taxonomy)
+        if problems:
+            print(f"Error: {len(problems)} fact name(s) not in the taxonomy: " + format_problems(problems))
+            return
+
+    if schema_location is None:
+        schema_location = DEFAULT_SCHEMA
         print("SchemaRef not found, using default.")
+    component_name = os.path.splitext(os.path.basename(schema_location))[0]
 
-    xbrl_element = ET.SubElement(data_xbrl, "xbrl", attrib={"schema": schema_location, "inputinstance": xbrl_file, "outputinstance": "output.xbrl"})
+    # Namespace list of the XBRL component; entries refer to it by position.
+    namespaces = [XBRLI_NS, MAPFORCE_NS, LINK_NS] + concept_namespaces + ["view", ""]
+    concept_offset = 3
+    view_ns = len(namespaces) - 2
+    attribute_ns = len(namespaces) - 1
 
-    # Create the graph element
-    graph = ET.SubElement(structure, "graph", attrib={"directed": "1"})
-    edges = ET.SubElement(graph, "edges")
-    vertices = ET.SubElement(graph, "vertices")
+    alloc = _Allocator()
+    input_uid = alloc.next_uid()
+    xbrl_uid = alloc.next_uid()
+    entries = _plan_entries(root, alloc)
 
-    # Create a vertex for the input component
-    vertex_input = ET.SubElement(vertices, "vertex", attrib={"vertexkey": "6"})
-    edges_input = ET.SubElement(vertex_input, "edges")
-    #ET.SubElement(edges_input, "edge", attrib={"vertexkey": "13"}) #Connects to the excel part, which is now the xbrl
+    # Constants: one per fact value, one per distinct attribute value.
+    constants = []  # (uid, output key, value, datatype)
+    edges = []  # (constant index, component row, input key)
+    shared = {}
+    # Component rows: FileInstance, document, xbrl and the view entry come first.
+    row = 4
+    for depth, node, clone, key, attributes in entries:
+        if key is not None:
+            if concepts is not None:
+                numeric = concepts[f"{{{concept_namespaces[node.ns]}}}{node.name}"].numeric
+            else:
+                numeric = any(name == "unitRef" for name, _, _ in attributes)
+            datatype = "decimal" if numeric else "string"
+            constants.append((alloc.next_uid(), alloc.next_key(), node.value, datatype))
+            edges.append((len(constants) - 1, row, key))
+        for offset, (name, value, attribute_key) in enumerate(attributes, 1):
+            if (name, value) not in shared:
+                shared[(name, value)] = len(constants)
+                constants.append((alloc.next_uid(), alloc.next_key(), value, "string"))
+            edges.append((shared[(name, value)], row + offset, attribute_key))
+        row += 1 + len(attributes)
 
-    # Create a vertex for the xbrl component
-    vertex_xbrl = ET.SubElement(vertices, "vertex", attrib={"vertexkey": "7"})
-    edges_xbrl = ET.SubElement(vertex_xbrl, "edges")
-    # No edges for now
+    sizes = [(73, 36)]  # the input component
+    sizes += [(min(MAX_CONSTANT_WIDTH, max(70, CHAR_WIDTH * len(value) + 20)), ROW_HEIGHT) for _, _, value, _ in constants]
+    target = len(sizes)
+    sizes.append((649, HEADER_HEIGHT + row * ROW_HEIGHT))
+    layout_edges = [(1 + constant, target, HEADER_HEIGHT + row * ROW_HEIGHT) for constant, row, _ in edges]
+    boxes = layered_layout(sizes, layout_edges, origin=(172, 46))
+    instrumentation.count("mfd_entries", len(entries))
+    instrumentation.count("mfd_constants", len(constants))
 
-    # Write the XML tree to a file
     try:
-        tree = ET.ElementTree(mapping)
-        ET.indent(tree, space="    ", level=0) #for pretty print
-        tree.write(mfd_file, encoding="UTF-8", xml_declaration=True)
+        with instrumentation.span("mfd.write"), open(mfd_file, "w", encoding="UTF-8") as f:
+            w = _MfdWriter(f)
+            w.line('<?xml version="1.0" encoding="UTF-8"?>')
+            w.open("mapping", **{"xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance", "version": "22"})
+            w.empty("resources")
+            w.open("component", name="defaultmap", uid="1", editable="1", blackbox="0")
+            w.empty("properties", SelectedLanguage="builtin")
+            w.open("structure")
+            w.open("children")
+
+            # Input component with the path of the XBRL file.
+            w.open("component", name="input", library="core", uid=input_uid, kind="6")
+            w.open("sources")
+            w.empty("datapoint")
+            w.close("sources")
+            w.open("targets")
+            w.empty("datapoint")
+            w.close("targets")
+            _write_view(w, boxes[0])
+            w.open("data")
+            w.line(f"<input{_attrs(datatype='string')}>{escape(xbrl_file)}</input>")
+            w.empty("parameter", usageKind="input", name="input")
+            w.close("data")
+            w.close("component")
+
+            for index, (uid, key, value, datatype) in enumerate(constants):
+                w.open("component", name="constant", library="core", uid=uid, kind="2")
+                w.open("targets")
+                w.empty("datapoint", pos="0", key=key)
+                w.close("targets")
+                _write_view(w, boxes[1 + index])
+                w.open("data")
+                w.empty("constant", value=value, datatype=datatype)
+                w.close("data")
+                w.close("component")
+
+            # XBRL target component.
+            w.open("component", name=component_name, library="xbrl", uid=xbrl_uid, kind="27")
+            w.empty("properties", XSLTTargetEncoding="UTF-8", XSLTDefaultOutput="1",
+                    XBRLShowAllConcepts="1", XBRLShowAllConceptsRaw="1")
+            _write_view(w, boxes[target])
+            w.open("data")
+            w.open("root", scrollposition="1")
+            w.open("header")
+            w.open("namespaces")
+            for uri in namespaces:
+                w.empty("namespace", uid=uri or None)
+            w.close("namespaces")
+            w.close("header")
+            w.open("entry", name="FileInstance", ns="1", expanded="1")
+            w.open("entry", name="document", ns="1", expanded="1")
+            w.open("entry", name="xbrl", expanded="1")
+            w.open("entry", name="viewallconceptsraw", ns=view_ns, expanded="1")
+            open_depth = 0
+            for index, (depth, node, clone, key, attributes) in enumerate(entries):
+                while open_depth > depth:
+                    w.close("entry")
+                    open_depth -= 1
+                has_children = bool(attributes) or (index + 1 < len(entries) and entries[index + 1][0] > depth)
+                entry_attributes = dict(name=node.name, ns=concept_offset + node.ns, inpkey=key, expanded="1",
+                                        clone="1" if clone else None)
+                if not has_children:
+                    w.empty("entry", **entry_attributes)
+                    continue
+                w.open("entry", **entry_attributes)
+                for name, value, attribute_key in attributes:
+                    w.empty("entry", name=name, ns=attribute_ns, type="attribute", inpkey=attribute_key)
+                if attributes:
+                    w.close("entry")
+                else:
+                    open_depth += 1
+            while open_depth > 0:
+                w.close("entry")
+                open_depth -= 1
+            for _ in range(4):
+                w.close("entry")
+            w.close("root")
+            w.empty("xbrl", schema=schema_location, inputinstance=xbrl_file, outputinstance=output_instance)
+            w.close("data")
+            w.close("component")
+            w.close("children")
+
+            # Connections: one vertex per constant output.
+            by_constant = {}
+            for constant, _, key in edges:
+                by_constant.setdefault(constant, []).append(key)
+            w.open("graph", directed="1")
+            w.empty("edges")
+            w.open("vertices")
+            for index, (uid, key, value, datatype) in enumerate(constants):
+                w.open("vertex", vertexkey=key)
+                w.open("edges")
+                for input_key in by_constant.get(index, ()):
+                    w.empty("edge", vertexkey=input_key)
+                w.close("edges")
+                w.close("vertex")
+            w.close("vertices")
+            w.close("graph")
+            w.close("structure")
+            w.close("component")
+            w.close("mapping")
         print(f"MFD file created successfully: {mfd_file}")
     except Exception as e:
         print(f"Error writing MFD file: {e}")
 
+
+def _write_view(w, box):
+    ltx, lty, rbx, rby = box
+    w.empty("view", ltx=ltx, lty=lty, rbx=rbx, rby=rby)
+
+
 if __name__ == "__main__":
     xbrl_file = "output.xbrl"  # Replace with your XBRL file path
     mfd_file = "output.mfd"  # Replace with your desired MFD file path
-    create_mfd_from_xbrl(xbrl_file, mfd_file)
\ No newline at end of file
+    create_mfd_from_xbrl(xbrl_file, mfd_file)
@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import datetime
+import subprocess
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then left out of the results.
+    resource = None
+
+from openpyxl import Workbook
+
+from gemini_dispatcher import TransportError
+
+# Workload presets: Processed-sheet rows and column-C groups, XBRL workbook
+# rows and path1 tuples, depth of the H/I/J paths and the fake model latency.
+SCALES = {
+    "small": {"rows": 2000, "groups": 40, "xbrl_rows": 5000, "tuples": 200, "path_depth": 3, "latency": 0.05},
+    "medium": {"rows": 20000, "groups": 200, "xbrl_rows": 50000, "tuples": 2000, "path_depth": 3, "latency": 0.05},
+    "large": {"rows": 200000, "groups": 1000, "xbrl_rows": 500000, "tuples": 20000, "path_depth": 3, "latency": 0.05},
+}
+
+# Stages in run order; later stages read what earlier ones wrote to the work folder.
+STAGES = (
+    "group_to_csv",
+    "gemini",
+    "clean_csv",
+    "combine_csv_to_xlsx",
+    "group_processed_sheet",
+    "create_xbrl_from_excel",
+    "create_mfd_from_xbrl",
+)
+
+PROCESSED_WORKBOOK = "processed.xlsx"
+XBRL_WORKBOOK = "xbrl_input.xlsx"
+
+
+def make_processed_workbook(path, rows, groups, path_depth=3, seed=0):
+    """
+    Writes a synthetic workbook with a 'Processed' sheet in the layout the
+    grouping and transpose scripts read: a header row, then columns A..Q
+    with the group id in C, the H/I/J path (up to path_depth levels deep),
+    the label in K and the value in Q.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Processed")
+    ws.append([f"col{i}" for i in range(17)])
+    for i in range(rows):
+        level = rng.randint(1, path_depth)
+        branch = rng.randrange(max(1, groups // 4))
+        levels = [f"Section{branch}", f"Part{rng.randrange(4)}", f"Item{rng.randrange(4)}"][:level]
+        levels += [None] * (3 - len(levels))
+        ws.append(
+            [i, f"Field{i}", 600000 + rng.randrange(groups), f"Description of field {i}", "text", None, "bd-i"]
+            + levels
+            + [f"Label{i}", None, None, None, None, None, f"Value {rng.randrange(10 ** 6)}"]
+        )
+    wb.save(path)
+
+
+def make_xbrl_workbook(path, rows, tuples, entities=1, seed=0):
+    """
+    Writes a synthetic ID/path1/field/value workbook for create_xbrl_from_excel
+    with the given number of rows spread over `tuples` path1 tuples.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(["ID", "path1", "field", "value"])
+    for i in range(rows):
+        tuple_index = i * tuples // rows
+        value = rng.randrange(10 ** 6) if i % 3 else f"Text {i}"
+        ws.append([100000000 + i % entities, f"bd-t:Tuple{tuple_index}", f"bd-i:Field{i % 25}", value])
+    wb.save(path)
+
+
+class FakeGeminiTransport:
+    """
+    Stands in for the Gemini API: waits latency seconds (plus up to jitter)
+    per request and answers with the CSV wrapped in a fenced block, one
+    example value appended per row. Every other reply is only the fenced
+    block and the rest have a line of prose before it, as the real model
+    answers both ways. A failure_rate fraction of requests raise a
+    retryable 503 so the retry path is exercised as well.
+    """
+
+    model = "fake-gemini"
+
+    def __init__(self, latency=0.05, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+
+    async def generate(self, contents):
+        self.requests += 1
+        await asyncio.sleep(self.latency + self._rng.uniform(0, self.jitter))
+        if self._rng.random() < self.failure_rate:
+            raise TransportError("fake 503", status=503)
+        csv_text = contents.split("\n\n", 1)[1]
+        rows = [line + ",example" for line in csv_text.splitlines() if line.strip()]
+        block = "```csv\n" + "\n".join(rows) + "\n```"
+        return block if self.requests % 2 else "Here is the updated CSV:\n" + block
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _count_csv_rows(directory):
+    count = 0
+    for name in os.listdir(directory):
+        if name.endswith(".csv"):
+            with open(os.path.join(directory, name), "rb") as f:
+                count += sum(1 for line in f if line.strip())
+    return count
+
+
+def _stage_runner(stage, params):
+    """
+    Imports what a stage needs and returns a function that runs it in the
+    current folder and returns the number of rows it handled, so module
+    imports are not part of the timing.
+    """
+    from hacktova_build import load_script
+
+    if stage == "group_to_csv":
+        from group_by_C_to_csv import group_to_csv
+
+        def run():
+            group_to_csv(PROCESSED_WORKBOOK, "grouped_csvs")
+            return params["rows"]
+    elif stage == "gemini":
+        from gemini_dispatcher import dispatch_csv_files
+
+        def run():
+            transport = FakeGeminiTransport(params["latency"], params.get("jitter", 0.0),
+                                            params.get("failure_rate", 0.0))
+            results = asyncio.run(dispatch_csv_files(
+                "grouped_csvs", "gemini_output", transport, max_in_flight=params.get("max_in_flight", 8),
+                requests_per_second=params.get("requests_per_second", 1000.0), base_delay=0.01, max_delay=0.1,
+            ))
+            failed = [name for name, error in results.items() if error is not None]
+            if failed:
+                raise RuntimeError(f"{len(failed)} groups failed")
+            return params["rows"]
+    elif stage == "clean_csv":
+        from clean_csvs import process_csv_files
+
+        def run():
+            process_csv_files("gemini_output", "cleaned_csv")
+            return _count_csv_rows("cleaned_csv")
+    elif stage == "combine_csv_to_xlsx":
+        from combine_csv_to_xlsx import combine_csv_to_xlsx
+
+        def run():
+            combine_csv_to_xlsx("cleaned_csv", "combined.xlsx")
+            return _count_csv_rows("cleaned_csv")
+    elif stage == "group_processed_sheet":
+        group_processed_sheet = load_script("hacktova-transpose.py").group_processed_sheet
+
+        def run():
+            group_processed_sheet(PROCESSED_WORKBOOK, "transposed.xlsx")
+            return params["rows"]
+    elif stage == "create_xbrl_from_excel":
+        create_xbrl_from_excel = load_script("hacktova-gemini.py").create_xbrl_from_excel
+
+        def run():
+            if os.path.exists("output.xbrl"):
+                os.remove("output.xbrl")
+            create_xbrl_from_excel(XBRL_WORKBOOK, "output.xbrl")
+            if not os.path.exists("output.xbrl"):
+                raise RuntimeError("no XBRL instance written")
+            return params["xbrl_rows"]
+    elif stage == "create_mfd_from_xbrl":
+        from hacktova import create_mfd_from_xbrl
+
+        def run():
+            create_mfd_from_xbrl("output.xbrl", "output.mfd")
+            return params["xbrl_rows"]
+    else:
+        raise ValueError(f"Unknown stage '{stage}'")
+    return run
+
+
+def _stage_worker(stage, params, work_dir, conn):
+    """
+    Child-process entry point: times one stage with its output silenced and
+    sends back the timing and peak RSS.
+    """
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    baseline = None
+    try:
+        run = _stage_runner(stage, params)
+        baseline = _peak_rss_mb()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            rows = run()
+            seconds = time.perf_counter() - start
+        result = {"seconds": round(seconds, 4), "rows": rows, "rows_per_sec": round(rows / seconds, 1)}
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = _peak_rss_mb()
+    result["baseline_rss_mb"] = baseline
+    conn.send(result)
+    conn.close()
+
+
+def run_stage_isolated(stage, params, work_dir):
+    """
+    Runs one stage in a fresh interpreter so its peak RSS is its own.
+    On-disk caches such as the workbook sidecar are shared between stages,
+    as in a real run.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_stage_worker, args=(stage, params, work_dir, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": f"worker exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(scales=("small",), stages=STAGES, work_dir="bench_work", repeat=1, overrides=None):
+    """
+    Generates the workload for every scale point and times every stage.
+
+    Args:
+        scales (list): Names from SCALES.
+        stages (list): Stages to time, in STAGES order. A stage reads the
+            outputs of the ones before it, so leaving one out only works if
+            its outputs are already in the work folder.
+        work_dir (str): Folder for the generated workbooks and stage outputs;
+            each scale's subfolder is emptied first.
+        repeat (int): Timed runs per stage; later runs see warm caches
+            such as the workbook sidecar.
+        overrides (dict): Values replacing the preset's rows, groups,
+            latency, ... for every scale.
+
+    Returns:
+        dict: Run metadata and, per scale, the parameters and per-stage
+        results (seconds, rows, rows_per_sec, peak_rss_mb).
+    """
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scales": [],
+    }
+    for scale in scales:
+        params = dict(SCALES[scale], **(overrides or {}))
+        scale_dir = os.path.abspath(os.path.join(work_dir, scale))
+        # Start from an empty folder so outputs of an earlier workload do not linger.
+        shutil.rmtree(scale_dir, ignore_errors=True)
+        os.makedirs(scale_dir)
+        print(f"[{scale}] generating workload: {params}")
+        make_processed_workbook(os.path.join(scale_dir, PROCESSED_WORKBOOK), params["rows"], params["groups"],
+                                params["path_depth"])
+        make_xbrl_workbook(os.path.join(scale_dir, XBRL_WORKBOOK), params["xbrl_rows"], params["tuples"])
+
+        entry = {"scale": scale, "params": params, "stages": []}
+        for stage in (name for name in STAGES if name in stages):
+            for run in range(repeat):
+                result = dict(stage=stage, run=run, **run_stage_isolated(stage, params, scale_dir))
+                entry["stages"].append(result)
+                if "error" in result:
+                    print(f"[{scale}] {stage}: {result['error']}")
+                else:
+                    print(f"[{scale}] {stage}: {result['seconds']:.3f}s, {result['rows_per_sec']} rows/s, "
+                          f"peak RSS {result['peak_rss_mb']} MB")
+        results["scales"].append(entry)
+    return results
+
+
+def compare_results(old, new):
+    """
+    Returns (scale, stage, old seconds, new seconds, ratio) for every stage
+    timed in both runs, using the fastest run of each.
+    """
+    def best(results):
+        times = {}
+        for entry in results["scales"]:
+            for result in entry["stages"]:
+                if "seconds" in result:
+                    key = (entry["scale"], result["stage"])
+                    times[key] = min(times.get(key, result["seconds"]), result["seconds"])
+        return times
+
+    old_times, new_times = best(old), best(new)
+    return [
+        (scale, stage, old_times[scale, stage], seconds, seconds / old_times[scale, stage])
+        for (scale, stage), seconds in new_times.items()
+        if (scale, stage) in old_times and old_times[scale, stage]
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every hacktova stage on synthetic workloads.")
+    parser.add_argument("--scale", action="append", choices=sorted(SCALES), help="scale point(s); default small")
+    parser.add_argument("--stage", action="append", choices=STAGES, help="stage(s) to time; default all")
+    parser.add_argument("--work-dir", default="bench_work")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=None, help="fake Gemini latency in seconds")
+    parser.add_argument("--output", default=None, help="results JSON; default bench_<timestamp>.json")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    overrides = {"latency": args.latency} if args.latency is not None else None
+    results = run_benchmarks(args.scale or ["small"], args.stage or STAGES, args.work_dir, args.repeat, overrides)
+    output = args.output or f"bench_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to: {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for scale, stage, old_seconds, new_seconds, ratio in compare_results(previous, results):
+            print(f"[{scale}] {stage}: {old_seconds:.3f}s -> {new_seconds:.3f}s ({ratio:.2f}x)")
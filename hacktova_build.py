@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import threading
+import importlib.util
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import instrumentation
+from workbook_cache import file_sha256
+
+MANIFEST_FILE = ".hacktova_manifest.json"
+
+
+def load_script(filename):
+    """
+    Imports one of the hyphenated hacktova-*.py scripts as a module.
+    """
+    name = os.path.splitext(os.path.basename(filename))[0].replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered first so process pools can pickle the script's functions.
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def hash_path(path):
+    """
+    Content hash of a file, or of a directory as the hashes of its files by
+    name. Returns None if the path does not exist.
+    """
+    if os.path.isfile(path):
+        return file_sha256(path)
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                digest.update(f"{name}\0{file_sha256(file_path)}\n".encode("utf-8"))
+        return digest.hexdigest()
+    return None
+
+
+def _file_hashes(directory):
+    if not os.path.isdir(directory):
+        return {}
+    return {
+        name: file_sha256(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".csv") and os.path.isfile(os.path.join(directory, name))
+    }
+
+
+class Stage:
+    """
+    One node of the build graph.
+
+    A whole stage reads `inputs` and writes `outputs` (files or directories)
+    with build() and is rebuilt when any input, output or its params changed.
+    Its output files are removed before build(), which has to write them anew.
+    A per-file stage maps the CSV files of one input directory to files of
+    the same name in one output directory; build(input_dir, output_dir,
+    filenames) is only given the files whose input changed or whose output
+    is missing or was modified, and returns {filename: error or None}.
+    """
+
+    def __init__(self, name, inputs, outputs, build, deps=(), per_file=False, params=None):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.build = build
+        self.deps = list(deps)
+        self.per_file = per_file
+        self.params = json.dumps(params or {}, sort_keys=True, default=str)
+
+
+class Manifest:
+    """
+    JSON record of the input/output hashes of every stage's last good build.
+    """
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def set(self, name, entry):
+        with self._lock:
+            self.entries[name] = entry
+            tmp_file = self.path + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_file, self.path)
+
+
+def _stale_files(stage, entry):
+    """
+    For a per-file stage: returns (files to build, current input hashes,
+    outputs of removed inputs).
+    """
+    input_dir, output_dir = stage.inputs[0], stage.outputs[0]
+    current = _file_hashes(input_dir)
+    previous = entry["files"] if entry and entry.get("params") == stage.params else {}
+    stale = []
+    for name, input_hash in current.items():
+        record = previous.get(name)
+        if record is None or record["input"] != input_hash:
+            stale.append(name)
+            continue
+        output_file = os.path.join(output_dir, name)
+        if record["output"] is not None and hash_path(output_file) != record["output"]:
+            stale.append(name)
+    removed = [name for name in previous if name not in current]
+    return stale, current, removed
+
+
+def _is_stale(stage, entry):
+    """
+    For a whole stage: returns (stale, current input hashes).
+    """
+    inputs = {path: hash_path(path) for path in stage.inputs}
+    if entry is None or entry.get("params") != stage.params or entry.get("inputs") != inputs:
+        return True, inputs
+    outputs = {path: hash_path(path) for path in stage.outputs}
+    return outputs != entry.get("outputs") or None in outputs.values(), inputs
+
+
+def _run_stage(stage, manifest):
+    """
+    Brings one stage up to date. Returns a short description of what was done.
+    """
+    entry = manifest.get(stage.name)
+    if stage.per_file:
+        input_dir, output_dir = stage.inputs[0], stage.outputs[0]
+        stale, current, removed = _stale_files(stage, entry)
+        for name in removed:
+            output_file = os.path.join(output_dir, name)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+        results = {}
+        if stale:
+            with instrumentation.span(f"build.{stage.name}"):
+                results = stage.build(input_dir, output_dir, stale)
+
+        files = dict(entry["files"]) if entry and entry.get("params") == stage.params else {}
+        for name in removed:
+            files.pop(name, None)
+        failed = []
+        for name in stale:
+            if results.get(name) is None:
+                files[name] = {"input": current[name], "output": hash_path(os.path.join(output_dir, name))}
+            else:
+                files.pop(name, None)
+                failed.append(name)
+        manifest.set(stage.name, {"params": stage.params, "files": files})
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(stale)} files failed: {', '.join(failed[:5])}")
+        if not stale and not removed:
+            return "up to date"
+        return f"{len(stale)} of {len(current)} files rebuilt, {len(removed)} removed"
+
+    stale, inputs = _is_stale(stage, entry)
+    if not stale:
+        return "up to date"
+    # Several scripts print their errors and return, so remove the old
+    # outputs first: a stale file must not pass for a successful build.
+    for path in stage.outputs:
+        if os.path.isfile(path):
+            os.remove(path)
+    with instrumentation.span(f"build.{stage.name}"):
+        stage.build()
+    outputs = {path: hash_path(path) for path in stage.outputs}
+    missing = [path for path, digest in outputs.items() if digest is None]
+    if missing:
+        raise RuntimeError(f"build did not produce {', '.join(missing)}")
+    manifest.set(stage.name, {"params": stage.params, "inputs": inputs, "outputs": outputs})
+    return "rebuilt"
+
+
+def _plan(stages, manifest):
+    """
+    Dry-run: works out which stages would be rebuilt without building.
+    A stage downstream of a stale stage is reported as waiting on it.
+    """
+    plan = {}
+    for stage in _topological_order(stages):
+        entry = manifest.get(stage.name)
+        upstream = [dep for dep in stage.deps if plan[dep] != "up to date"]
+        if upstream:
+            plan[stage.name] = f"stale after {', '.join(upstream)}"
+        elif stage.per_file:
+            stale, current, removed = _stale_files(stage, entry)
+            plan[stage.name] = (f"{len(stale)} of {len(current)} files to rebuild, {len(removed)} to remove"
+                                if stale or removed else "up to date")
+        else:
+            plan[stage.name] = "stale" if _is_stale(stage, entry)[0] else "up to date"
+    return plan
+
+
+def _topological_order(stages):
+    by_name = {stage.name: stage for stage in stages}
+    order, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Cycle in build graph at stage '{stage.name}'")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        order.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return order
+
+
+def run_build(stages, manifest_file=MANIFEST_FILE, dry_run=False, max_workers=None):
+    """
+    Brings every stage up to date, running stages whose dependencies are done
+    in parallel. With dry_run nothing is built and the plan is returned.
+
+    Returns:
+        dict: Maps each stage name to what was (or would be) done, or the
+        error it failed with. Stages downstream of a failure are skipped.
+    """
+    manifest = Manifest(manifest_file)
+    if dry_run:
+        plan = _plan(stages, manifest)
+        for stage in _topological_order(stages):
+            print(f"{stage.name}: {plan[stage.name]}")
+        return plan
+
+    order = _topological_order(stages)
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(order):
+            for stage in order:
+                if stage.name in results or stage.name in running.values():
+                    continue
+                if any(results.get(dep, "").startswith(("failed", "skipped")) for dep in stage.deps):
+                    results[stage.name] = "skipped: upstream failed"
+                    print(f"{stage.name}: {results[stage.name]}")
+                elif all(dep in results for dep in stage.deps):
+                    running[executor.submit(_run_stage, stage, manifest)] = stage.name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = f"failed: {e}"
+                print(f"{name}: {results[name]}")
+    return results
+
+
+def _clean_files(input_dir, output_dir, filenames):
+    from clean_csvs import clean_csv
+
+    os.makedirs(output_dir, exist_ok=True)
+    for filename in filenames:
+        with open(os.path.join(input_dir, filename), "r", encoding="utf-8") as f:
+            cleaned_csv = clean_csv(f.read())
+        output_file = os.path.join(output_dir, filename)
+        if not cleaned_csv:
+            print(f"No CSV block found in {filename}, skipping.")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            continue
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(cleaned_csv)
+    return {filename: None for filename in filenames}
+
+
+def default_stages(workbook="LibE2025dev.xlsx", work_dir=".", transport=None, cache=None, xbrl_workbook=None):
+    """
+    The hacktova pipeline as a build graph:
+    workbook -> grouped CSVs -> enriched -> cleaned -> combined xlsx -> XBRL -> MFD,
+    plus the transposed workbook as an independent branch.
+
+    transport/cache are used by the enrichment stage (see gemini_dispatcher).
+    xbrl_workbook is the ID/path1/field/value workbook the XBRL instance is
+    made from; without it the XBRL and MFD stages are left out.
+    """
+    path = lambda name: os.path.join(work_dir, name)
+    grouped, enriched, cleaned = path("grouped_csvs"), path("gemini_output"), path("cleaned_csv")
+    combined, xbrl, mfd = path("combined.xlsx"), path("output.xbrl"), path("output.mfd")
+    transposed = path("grouped_output_with_values_compact.xlsx")
+
+    def group():
+        from group_by_C_to_csv import group_to_csv
+        # Start from an empty folder so groups that disappeared do not linger.
+        if os.path.isdir(grouped):
+            for name in os.listdir(grouped):
+                if name.endswith(".csv"):
+                    os.remove(os.path.join(grouped, name))
+        group_to_csv(workbook, grouped)
+
+    def enrich(input_dir, output_dir, filenames):
+        from gemini_dispatcher import dispatch_csv_files
+        if transport is None:
+            raise RuntimeError("no Gemini transport configured")
+        return asyncio.run(dispatch_csv_files(input_dir, output_dir, transport, cache=cache, filenames=filenames))
+
+    def combine():
+        from combine_csv_to_xlsx import combine_csv_to_xlsx
+        combine_csv_to_xlsx(cleaned, combined)
+
+    def make_xbrl():
+        load_script("hacktova-gemini.py").create_xbrl_from_excel(xbrl_workbook, xbrl)
+
+    def make_mfd():
+        from hacktova import create_mfd_from_xbrl
+        create_mfd_from_xbrl(xbrl, mfd)
+
+    def transpose():
+        load_script("hacktova-transpose.py").group_processed_sheet(workbook, transposed)
+
+    model = getattr(transport, "model", None)
+    stages = [
+        Stage("group", [workbook], [grouped], group),
+        Stage("enrich", [grouped], [enriched], enrich, deps=["group"], per_file=True, params={"model": model}),
+        Stage("clean", [enriched], [cleaned], _clean_files, deps=["enrich"], per_file=True),
+        Stage("combine", [cleaned], [combined], combine, deps=["clean"]),
+        Stage("transpose", [workbook], [transposed], transpose),
+    ]
+    # The combined workbook is not in the ID/path1/field/value layout, so
+    # there is nothing to fall back on.
+    if xbrl_workbook:
+        stages += [
+            Stage("xbrl", [xbrl_workbook], [xbrl], make_xbrl, deps=["combine"]),
+            Stage("mfd", [xbrl], [mfd], make_mfd, deps=["xbrl"]),
+        ]
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the stale parts of the hacktova pipeline.")
+    parser.add_argument("--workbook", default="LibE2025dev.xlsx")
+    parser.add_argument("--xbrl-workbook", default=None,
+                        help="ID/path1/field/value workbook for the XBRL and MFD stages (skipped without it)")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be rebuilt")
+    parser.add_argument("--jobs", type=int, default=None, help="stages to run in parallel")
+    args = parser.parse_args()
+
+    from gemini_cache import ResponseCache
+    from gemini_dispatcher import GeminiClientTransport
+
+    transport = None if args.dry_run else GeminiClientTransport(os.environ.get("GEMINI_API_KEY", ""))
+    with ResponseCache("gemini_cache.sqlite") as cache:
+        stages = default_stages(args.workbook, transport=transport, cache=cache, xbrl_workbook=args.xbrl_workbook)
+        run_build(stages, dry_run=args.dry_run, max_workers=args.jobs)
@@ -0,0 +1,211 @@
+import io
+import os
+import asyncio
+import pandas as pd
+
+import instrumentation
+from clean_csvs import clean_csv
+from combine_csv_to_xlsx import extract_source_identifier, write_combined
+from gemini_dispatcher import TokenBucket, generate_with_retries
+from group_by_C_to_csv import iter_groups, read_processed_sheet
+from group_store import text_digest
+from send_csv_to_gemini import MODEL, PROMPT, build_contents, extract_csv
+
+# Checkpoint sub-directories, named after the folders the separate scripts use.
+CHECKPOINT_DIRS = {
+    "grouped": "grouped_csvs",
+    "enriched": "gemini_output",
+    "cleaned": "cleaned_csv",
+}
+
+
+def _checkpoint(checkpoint_dir, stage, filename, text, encoding=None):
+    """
+    Writes one intermediate file if checkpointing was requested.
+    """
+    if checkpoint_dir is None:
+        return
+    stage_dir = os.path.join(checkpoint_dir, CHECKPOINT_DIRS[stage])
+    if not os.path.exists(stage_dir):
+        os.makedirs(stage_dir)
+    with open(os.path.join(stage_dir, filename), "w", encoding=encoding) as f:
+        f.write(text)
+
+
+def grouped_csvs(input_file, checkpoint_dir=None, store=None):
+    """
+    Grouping stage: yields (file name, CSV text) per column-C group, exactly
+    as group_by_C_to_csv.group_to_csv would write them. With a
+    group_store.GroupStore, its "grouped" stage is replaced by these groups
+    once all of them have been read.
+    """
+    stored = []
+    for name, filename, group in iter_groups(read_processed_sheet(input_file)):
+        csv_text = group.to_csv(index=False, header=False)
+        _checkpoint(checkpoint_dir, "grouped", filename, csv_text)
+        if store is not None:
+            stored.append((filename, csv_text))
+        yield filename, csv_text
+    if store is not None:
+        store.replace_stage("grouped", stored)
+
+
+async def enriched_csvs(groups, transport, cache=None, max_in_flight=8, requests_per_second=4.0,
+                        max_retries=5, base_delay=1.0, max_delay=30.0, checkpoint_dir=None, store=None):
+    """
+    Enrichment stage: starts a request for each group as soon as it is pulled
+    from groups and yields (file name, updated CSV text) in completion order.
+    Groups whose request fails are reported and yielded with None, and
+    recorded as failed in the store if one is given.
+    """
+    bucket = TokenBucket(requests_per_second)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    model = getattr(transport, "model", MODEL)
+
+    async def enrich(filename, csv_text):
+        updated_csv = cache.get(model, PROMPT, csv_text) if cache is not None else None
+        if updated_csv is None:
+            async with in_flight:
+                try:
+                    text = await generate_with_retries(
+                        transport, build_contents(csv_text), bucket, max_retries, base_delay, max_delay
+                    )
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
+                    if store is not None:
+                        store.put_error("enriched", filename, str(e), text_digest(csv_text))
+                    return filename, None
+            updated_csv = extract_csv(text)
+            if cache is not None:
+                cache.put(model, PROMPT, csv_text, updated_csv)
+        _checkpoint(checkpoint_dir, "enriched", filename, updated_csv)
+        if store is not None:
+            store.put("enriched", filename, updated_csv, text_digest(csv_text))
+        return filename, updated_csv
+
+    pending = set()
+    for filename, csv_text in groups:
+        pending.add(asyncio.create_task(enrich(filename, csv_text)))
+        # Let the new request start, and hand on whatever already finished.
+        await asyncio.sleep(0)
+        if len(pending) >= 2 * max_in_flight:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        else:
+            done = {task for task in pending if task.done()}
+            pending -= done
+        for task in done:
+            yield task.result()
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+
+def cleaned_frame(filename, updated_csv, checkpoint_dir=None, store=None):
+    """
+    Cleaning stage for one group: extracts the CSV with clean_csvs.clean_csv
+    (the fenced block, or the whole text when extract_csv already removed
+    the fence) and parses it like combine_csv_to_xlsx, with the
+    source column added. Returns None if there is nothing usable.
+    """
+    cleaned_csv = clean_csv(updated_csv)
+    if not cleaned_csv:
+        print(f"No CSV block found in {filename}, skipping.")
+        if store is not None:
+            store.put_error("cleaned", filename, "No CSV block found", text_digest(updated_csv))
+        return None
+    _checkpoint(checkpoint_dir, "cleaned", filename, cleaned_csv, encoding="utf-8")
+    if store is not None:
+        store.put("cleaned", filename, cleaned_csv, text_digest(updated_csv))
+    try:
+        # No header row, same as the cleaned CSV files.
+        df = pd.read_csv(io.StringIO(cleaned_csv), header=None)
+    except Exception as e:
+        print(f"Error reading {filename}: {e}")
+        return None
+    df['source'] = extract_source_identifier(filename)
+    return df
+
+
+async def run_pipeline_async(input_file, output_file, transport, cache=None, checkpoint_dir=None, store=None,
+                             **dispatch_options):
+    """
+    Runs grouping, enrichment, cleaning and combining as one streaming pass:
+    every group flows through the stages in memory as soon as its request
+    completes. Intermediate files are only written when checkpoint_dir is
+    given, using the same folder and file names as the separate scripts,
+    or when a group_store.GroupStore is given, as its stages.
+
+    Args:
+        input_file (str): Workbook with the 'Processed' sheet.
+        output_file (str): Combined Excel file to write.
+        transport: Gemini transport, see gemini_dispatcher.
+        cache (ResponseCache): Optional response cache.
+        checkpoint_dir (str): Folder for intermediate files, or None.
+        store (GroupStore): Store for intermediate group data, or None.
+        **dispatch_options: max_in_flight, requests_per_second and retry
+            settings passed on to the enrichment stage.
+
+    Returns:
+        dict: Counts per stage and the file names of failed groups.
+    """
+    with instrumentation.span("pipeline"):
+        frames = {}
+        summary = {"groups": 0, "enriched": 0, "cleaned": 0, "failed": []}
+
+        def counted(groups):
+            for item in groups:
+                summary["groups"] += 1
+                yield item
+
+        groups = counted(grouped_csvs(input_file, checkpoint_dir, store))
+        async for filename, updated_csv in enriched_csvs(groups, transport, cache, checkpoint_dir=checkpoint_dir,
+                                                         store=store, **dispatch_options):
+            if updated_csv is None:
+                summary["failed"].append(filename)
+                continue
+            summary["enriched"] += 1
+            df = cleaned_frame(filename, updated_csv, checkpoint_dir, store)
+            if df is None:
+                summary["failed"].append(filename)
+                continue
+            summary["cleaned"] += 1
+            frames[filename] = df
+
+        if store is not None:
+            # Drop results of groups that are no longer in the workbook.
+            store.prune("enriched", "grouped")
+            store.prune("cleaned", "grouped")
+
+        # Combine in file name order so the output does not depend on completion order.
+        if write_combined([frames[filename] for filename in sorted(frames)], output_file):
+            print(f"Combined Excel file saved to: {output_file}")
+        else:
+            print("No CSV files found.")
+    summary["failed"].sort()
+    instrumentation.count("groups", summary["groups"])
+    instrumentation.count("enriched_groups", summary["enriched"])
+    instrumentation.count("cleaned_groups", summary["cleaned"])
+    instrumentation.count("failed_groups", len(summary["failed"]))
+    return summary
+
+
+def run_pipeline(input_file, output_file, transport, cache=None, checkpoint_dir=None, store=None,
+                 **dispatch_options):
+    """
+    Synchronous wrapper around run_pipeline_async.
+    """
+    return asyncio.run(run_pipeline_async(input_file, output_file, transport, cache, checkpoint_dir, store,
+                                          **dispatch_options))
+
+
+if __name__ == "__main__":
+    from gemini_cache import ResponseCache
+    from gemini_dispatcher import GeminiClientTransport
+
+    input_excel = "LibE2025dev.xlsx"  # Input file
+    output_xlsx = "combined.xlsx"     # Output Excel file path
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+
+    with ResponseCache("gemini_cache.sqlite") as cache:
+        print(run_pipeline(input_excel, output_xlsx, GeminiClientTransport(api_key), cache=cache))
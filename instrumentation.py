@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; memory is then not sampled.
+    resource = None
+
+# Histogram buckets: request latency in seconds and (estimated) tokens.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Environment variables read at import: a metrics file (.prom for the
+# Prometheus textfile format, JSON lines otherwise) and the log level:
+# 1 prints a line per file or group, 2 also one per row or field.
+METRICS_ENV = "HACKTOVA_METRICS"
+VERBOSE_ENV = "HACKTOVA_VERBOSE"
+
+PROMETHEUS_PREFIX = "hacktova_"
+
+
+def _current_rss():
+    """
+    Resident set size of this process in bytes: the current value where
+    /proc is available, otherwise the peak so far. None if unknown.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds, as in Prometheus.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns [(upper bound, count of values <= bound)], ending with ("+Inf", count).
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class JsonLinesSink:
+    """
+    Appends one JSON object per event to a file: every finished span as it
+    ends, then counters, gauges and histograms on flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def event(self, event):
+        self._file.write(json.dumps(event) + "\n")
+
+    def flush(self, metrics):
+        now = time.time()
+        for name, value in sorted(metrics.counters.items()):
+            self.event({"ts": now, "type": "counter", "name": name, "value": value})
+        for name, value in sorted(metrics.gauges.items()):
+            self.event({"ts": now, "type": "gauge", "name": name, "value": value})
+        for name, histogram in sorted(metrics.histograms.items()):
+            self.event({
+                "ts": now, "type": "histogram", "name": name, "sum": histogram.sum, "count": histogram.count,
+                "buckets": [[bound, count] for bound, count in histogram.cumulative()],
+            })
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusTextfileSink:
+    """
+    Writes every metric in the Prometheus text format on flush, for the node
+    exporter's textfile collector. The file is replaced atomically.
+    """
+
+    def __init__(self, path, prefix=PROMETHEUS_PREFIX):
+        self.path = path
+        self.prefix = prefix
+
+    def event(self, event):
+        pass
+
+    def flush(self, metrics):
+        p = self.prefix
+        lines = []
+        for name, value in sorted(metrics.counters.items()):
+            lines += [f"# TYPE {p}{name}_total counter", f"{p}{name}_total {value}"]
+        for name, value in sorted(metrics.gauges.items()):
+            lines += [f"# TYPE {p}{name} gauge", f"{p}{name} {value}"]
+        if metrics.spans:
+            lines += [f"# TYPE {p}span_seconds summary"]
+            for name, (seconds, count) in sorted(metrics.spans.items()):
+                lines += [f'{p}span_seconds_sum{{span="{name}"}} {seconds}',
+                          f'{p}span_seconds_count{{span="{name}"}} {count}']
+        for name, histogram in sorted(metrics.histograms.items()):
+            lines.append(f"# TYPE {p}{name} histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f'{p}{name}_bucket{{le="{bound}"}} {count}')
+            lines += [f"{p}{name}_sum {histogram.sum}", f"{p}{name}_count {histogram.count}"]
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.path)
+
+    def close(self):
+        pass
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start", "peak")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.peak = _current_rss() if self.metrics.sample_interval else None
+        self.metrics._open(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.metrics._close(self, seconds, exc_info[0] is not None)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+    Collects spans, counters, gauges and histograms for one run and hands
+    them to the sinks. A background thread samples the resident set size
+    every sample_interval seconds, so each span records the peak memory
+    seen while it was open and the peak_rss_bytes gauge the overall peak.
+    """
+
+    def __init__(self, sinks, sample_interval=0.1):
+        self.sinks = list(sinks)
+        self.sample_interval = sample_interval
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.spans = {}  # name -> [total seconds, count]
+        self._open_spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stopped = threading.Event()
+        self._sampler = None
+        if sample_interval:
+            self._sampler = threading.Thread(target=self._sample, name="metrics-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            self._record_rss(_current_rss())
+
+    def _record_rss(self, rss):
+        if rss is None:
+            return
+        with self._lock:
+            if rss > self.gauges.get("peak_rss_bytes", 0):
+                self.gauges["peak_rss_bytes"] = rss
+            for span in self._open_spans:
+                if span.peak is None or rss > span.peak:
+                    span.peak = rss
+
+    def _open(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        with self._lock:
+            self._open_spans.append(span)
+
+    def _close(self, span, seconds, failed):
+        stack = self._local.stack
+        stack.remove(span)
+        parent = stack[-1].name if stack else None
+        if self.sample_interval:
+            self._record_rss(_current_rss())
+        with self._lock:
+            self._open_spans.remove(span)
+            total = self.spans.setdefault(span.name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+            event = {"ts": time.time(), "type": "span", "name": span.name, "parent": parent,
+                     "seconds": round(seconds, 6), "peak_rss_bytes": span.peak}
+            if failed:
+                event["failed"] = True
+            for sink in self.sinks:
+                sink.event(event)
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def flush(self):
+        with self._lock:
+            for sink in self.sinks:
+                sink.flush(self)
+
+    def close(self):
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._record_rss(_current_rss())
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+
+# The active collector; None means instrumentation is off and every call
+# below returns right away.
+_metrics = None
+_verbose = 0
+
+
+def configure(sinks=(), sample_interval=0.1, verbose=None):
+    """
+    Turns instrumentation on with the given sinks (JsonLinesSink,
+    PrometheusTextfileSink), replacing any earlier configuration, and sets
+    the log level if verbose is given. Metrics are flushed at exit.
+    """
+    global _metrics
+    if verbose is not None:
+        set_verbose(verbose)
+    if _metrics is not None:
+        _metrics.close()
+    _metrics = Metrics(sinks, sample_interval) if sinks else None
+    return _metrics
+
+
+def shutdown():
+    """
+    Flushes and closes the sinks and turns instrumentation off.
+    """
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+        _metrics = None
+
+
+def sink_for(path):
+    """
+    PrometheusTextfileSink for a .prom file, JsonLinesSink otherwise.
+    """
+    return PrometheusTextfileSink(path) if path.endswith(".prom") else JsonLinesSink(path)
+
+
+def set_verbose(level):
+    global _verbose
+    _verbose = int(level)
+
+
+def verbose(level=1):
+    """
+    True if per-item progress messages of the given level should be shown.
+    """
+    return _verbose >= level
+
+
+def log(message, level=1):
+    """
+    Prints a per-item progress message only at an explicit verbose level.
+    """
+    if _verbose >= level:
+        print(message)
+
+
+def span(name):
+    """
+    Context manager timing a stage or substage, e.g. span("xbrl.write").
+    """
+    if _metrics is None:
+        return _NULL_SPAN
+    return _metrics.span(name)
+
+
+def count(name, value=1):
+    """
+    Adds value to a counter such as "rows" or "gemini_cache_hits".
+    """
+    if _metrics is not None:
+        _metrics.count(name, value)
+
+
+def gauge(name, value):
+    if _metrics is not None:
+        _metrics.gauge(name, value)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """
+    Records one value, e.g. a request latency, in the named histogram.
+    """
+    if _metrics is not None:
+        _metrics.observe(name, value, buckets)
+
+
+def enabled():
+    return _metrics is not None
+
+
+atexit.register(shutdown)
+
+if os.environ.get(VERBOSE_ENV):
+    set_verbose(os.environ[VERBOSE_ENV])
+# Worker processes (e.g. create_xbrl_batch's pool) leave the file to the main process.
+if os.environ.get(METRICS_ENV) and multiprocessing.parent_process() is None:
+    configure([sink_for(os.environ[METRICS_ENV])])
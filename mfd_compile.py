@@ -0,0 +1,535 @@
+import re
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from mfd_graph import load_mfd
+
+# Constant datatypes that MapForce compares as numbers.
+NUMERIC_TYPES = {"decimal", "integer", "int", "long", "short", "byte", "double", "float"}
+# Excel serial day 0; later than 1899-12-31 because of Excel's 1900 leap-year bug.
+EXCEL_EPOCH = "1899-12-30"
+# Entry path prefix shared by every structure entry.
+ENTRY_PREFIX = "FileInstance/document/"
+
+
+class UnsupportedMapping(Exception):
+    """
+    Raised for a target whose value depends on something the transform
+    cannot evaluate, e.g. a function without a DataFrame implementation.
+    """
+
+
+def _to_text(value):
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def _broadcast(value, n):
+    if isinstance(value, pd.Series):
+        return value
+    return pd.Series([value] * n, dtype=object)
+
+
+def _text(value, n):
+    # Converted per distinct value rather than per row.
+    codes, uniques = pd.factorize(_broadcast(value, n))
+    texts = np.array([_to_text(unique) for unique in uniques] + [None], dtype=object)
+    return pd.Series(texts[codes], dtype=object)
+
+
+def _numbers(value, n):
+    return pd.to_numeric(_broadcast(value, n), errors="coerce")
+
+
+def _as_bool(series):
+    return series.fillna(False).astype(bool)
+
+
+def _keys(value, n, numeric):
+    """
+    Normalises values the way equal compares them: as numbers when either
+    side is numeric, as text otherwise. Missing values stay missing.
+    """
+    return _numbers(value, n) if numeric else _text(value, n)
+
+
+def _equal(a, b):
+    return (a == b) & a.notna() & b.notna()
+
+
+def _xlsx_to_date(args, n):
+    series = _broadcast(args[0], n)
+    numbers = pd.to_numeric(series, errors="coerce")
+    dates = pd.to_datetime(numbers, unit="D", origin=EXCEL_EPOCH)
+    others = series.where(numbers.isna() & series.notna())
+    if others.notna().any():
+        dates = dates.fillna(pd.to_datetime(others, errors="coerce", format="mixed"))
+    return dates.dt.strftime("%Y-%m-%d").astype(object).where(dates.notna())
+
+
+def _group_by(args, n):
+    # One value per group: the key on the first row of each distinct key.
+    keys = _text(args[1], n)
+    return keys.where(~keys.duplicated() & keys.notna())
+
+
+def _concat(args, n):
+    parts = [_text(arg, n) for arg in args if arg is not None]
+    result = parts[0]
+    for part in parts[1:]:
+        result = result + part
+    return result
+
+
+def _round_precision(args, n):
+    return _numbers(args[0], n).round(int(_numbers(args[1], 1).iloc[0]))
+
+
+# name -> (implementation(args, n), result is numeric)
+FUNCTIONS = {
+    "lowercase": (lambda args, n: _text(args[0], n).str.lower(), False),
+    "uppercase": (lambda args, n: _text(args[0], n).str.upper(), False),
+    "is-not-null": (lambda args, n: _broadcast(args[0], n).notna(), False),
+    "is-null": (lambda args, n: _broadcast(args[0], n).isna(), False),
+    "set-null": (lambda args, n: pd.Series([None] * n, dtype=object), False),
+    "group-by": (_group_by, False),
+    "xlsx-to-date": (_xlsx_to_date, False),
+    "contains": (lambda args, n: _as_bool(_text(args[0], n).str.contains(_to_text(args[1]), regex=False)), False),
+    "replace": (lambda args, n: _text(args[0], n).str.replace(_to_text(args[1]), _to_text(args[2]), regex=False), False),
+    "concat": (_concat, False),
+    "round-precision": (_round_precision, True),
+    "logical-not": (lambda args, n: ~_as_bool(_broadcast(args[0], n)), False),
+    "logical-and": (lambda args, n: _as_bool(_broadcast(args[0], n)) & _as_bool(_broadcast(args[1], n)), False),
+    "logical-or": (lambda args, n: _as_bool(_broadcast(args[0], n)) | _as_bool(_broadcast(args[1], n)), False),
+}
+
+
+class _Node:
+    numeric = False
+
+    def evaluate(self, ctx):
+        # Every node is evaluated once per transform, however often it is shared.
+        key = id(self)
+        if key not in ctx.memo:
+            ctx.memo[key] = self._evaluate(ctx)
+        return ctx.memo[key]
+
+
+class _Column(_Node):
+    def __init__(self, name):
+        self.name = name
+
+    def _evaluate(self, ctx):
+        return ctx.df[self.name].astype(object).where(ctx.df[self.name].notna())
+
+
+class _Rows(_Node):
+    def _evaluate(self, ctx):
+        return pd.Series(np.arange(ctx.n), dtype=object)
+
+
+class _Constant(_Node):
+    def __init__(self, value, datatype):
+        self.value = value
+        self.numeric = datatype in NUMERIC_TYPES
+
+    def _evaluate(self, ctx):
+        return self.value
+
+
+class _Call(_Node):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.numeric = FUNCTIONS[name][1] if name in FUNCTIONS else False
+
+    def _evaluate(self, ctx):
+        if self.name in ("equal", "not-equal"):
+            a, b = self.args[:2]
+            if a is None or b is None:
+                return pd.Series(False, index=range(ctx.n))
+            numeric = a.numeric or b.numeric
+            result = _equal(ctx.keys(a, numeric), ctx.keys(b, numeric))
+            return result if self.name == "equal" else ~result
+        args = [None if arg is None else arg.evaluate(ctx) for arg in self.args]
+        return FUNCTIONS[self.name][0](args, ctx.n)
+
+
+class _IfElse(_Node):
+    """
+    if-else evaluated like MapForce does: every condition tested on every row.
+    """
+
+    def __init__(self, branches, otherwise):
+        self.branches = branches  # [(condition, value)]
+        self.otherwise = otherwise
+        values = [value for _, value in branches] + ([otherwise] if otherwise is not None else [])
+        self.numeric = all(value is not None and value.numeric for value in values)
+
+    def _evaluate(self, ctx):
+        result = _broadcast(None if self.otherwise is None else self.otherwise.evaluate(ctx), ctx.n)
+        for condition, value in reversed(self.branches):
+            if condition is None or value is None:
+                continue
+            chosen = _as_bool(_broadcast(condition.evaluate(ctx), ctx.n))
+            result = _broadcast(value.evaluate(ctx), ctx.n).where(chosen, result)
+        return result
+
+
+class _Lookup(_Node):
+    """
+    An if-else whose conditions all compare one subject with constants,
+    compiled into a hash lookup: the rows of every subject value are indexed
+    once per transform, so each branch only touches the rows it selects.
+    """
+
+    def __init__(self, subject, numeric, cases, otherwise):
+        self.subject = subject
+        self.key_numeric = numeric
+        self.cases = cases  # [(normalised constant, value)], first match wins
+        self.otherwise = otherwise
+        values = [value for _, value in cases] + ([otherwise] if otherwise is not None else [])
+        self.numeric = all(value is not None and value.numeric for value in values)
+
+    def _evaluate(self, ctx):
+        rows = ctx.row_index(self.subject, self.key_numeric)
+        result = np.full(ctx.n, None, dtype=object)
+        matched = np.zeros(ctx.n, dtype=bool)
+        seen = set()
+        for key, value in self.cases:
+            if key in seen or key not in rows or value is None:
+                continue
+            seen.add(key)
+            positions = rows[key]
+            data = value.evaluate(ctx)
+            result[positions] = data.to_numpy(dtype=object)[positions] if isinstance(data, pd.Series) else data
+            matched[positions] = True
+        if self.otherwise is not None and not matched.all():
+            data = _broadcast(self.otherwise.evaluate(ctx), ctx.n).to_numpy(dtype=object)
+            result[~matched] = data[~matched]
+        return pd.Series(result, dtype=object).where(pd.notna(result))
+
+
+class _Context:
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.n = len(self.df)
+        self.memo = {}
+        self._row_indexes = {}
+        self._keys = {}
+
+    def row_index(self, subject, numeric):
+        """
+        Returns {subject value: row positions}, built once per subject.
+        """
+        key = (id(subject), numeric)
+        if key not in self._row_indexes:
+            values = self.keys(subject, numeric)
+            self._row_indexes[key] = values.groupby(values, sort=False).indices if values.notna().any() else {}
+        return self._row_indexes[key]
+
+    def keys(self, node, numeric):
+        """
+        Returns the node's values normalised for equal, built once per node.
+        """
+        key = (id(node), numeric)
+        if key not in self._keys:
+            self._keys[key] = _keys(node.evaluate(self), self.n, numeric)
+        return self._keys[key]
+
+
+class CompiledMapping:
+    """
+    A MapForce mapping compiled into a DataFrame transform.
+
+    The transform takes the rows of the mapping's Excel source as a
+    DataFrame, one column per source cell (named after the cell's annotation,
+    e.g. "id-nr.", "value", "tuple"), and evaluates every function on whole
+    columns at once. It returns one row per produced target value with the
+    columns key (target datapoint key), target (entry path below
+    FileInstance/document), row (source row, -1 for constants) and value
+    (as text).
+    """
+
+    def __init__(self, targets, columns, skipped, stats):
+        self.targets = targets  # [(key, target, node)]
+        self.columns = columns
+        self.skipped = skipped  # {key: (target, reason)}
+        self.stats = stats
+
+    def __call__(self, df):
+        return self.transform(df)
+
+    def transform(self, df):
+        missing = [column for column in self.columns if column not in df.columns]
+        if missing:
+            raise ValueError(f"Missing input columns: {', '.join(missing)}")
+        ctx = _Context(df)
+        keys, targets, rows, values = [], [], [], []
+        for key, target, node in self.targets:
+            data = node.evaluate(ctx)
+            if isinstance(data, pd.Series):
+                present = np.flatnonzero(data.notna().to_numpy())
+                produced = [_to_text(value) for value in data.to_numpy(dtype=object)[present]]
+            elif data is None:
+                present, produced = [], []
+            else:
+                present, produced = [-1], [_to_text(data)]
+            keys.extend([key] * len(produced))
+            targets.extend([target] * len(produced))
+            rows.extend(int(row) for row in present)
+            values.extend(produced)
+        return pd.DataFrame({"key": keys, "target": targets, "row": rows, "value": values})
+
+
+class _Compiler:
+    def __init__(self, graph, lookups):
+        self.graph = graph
+        self.lookups = lookups
+        self.feeder = dict(zip(graph.edge_dst, graph.edge_src))
+        self.inputs = defaultdict(list)
+        for i, key in enumerate(graph.dp_key):
+            if not graph.dp_output[i] and not graph.dp_label[i]:
+                self.inputs[graph.dp_component[i]].append((graph.dp_pos[i], key))
+        self.nodes = {}
+        self.columns = set()
+        self.stats = Counter()
+
+    def input_node(self, key):
+        source = self.feeder.get(key)
+        return None if source is None else self.output_node(source)
+
+    def output_node(self, key):
+        if key not in self.nodes:
+            self.nodes[key] = self._build(key)
+        return self.nodes[key]
+
+    def _build(self, key):
+        graph = self.graph
+        index = graph.key_index.get(key)
+        if index is None:
+            raise UnsupportedMapping(f"unknown datapoint {key}")
+        component = graph.dp_component[index]
+        name = graph.names[component]
+        label = graph.dp_label[index]
+        if label:
+            return self._structure_node(component, label)
+        if name == "constant":
+            value, datatype = graph.constants[component]
+            return _Constant(value, datatype)
+        args = {pos: self.input_node(dst) for pos, dst in self.inputs[component]}
+        slots = max(graph.input_slots.get(component, 0), max(args, default=-1) + 1)
+        if name == "if-else":
+            return self._if_else(args, slots)
+        if name not in FUNCTIONS and name not in ("equal", "not-equal"):
+            raise UnsupportedMapping(f"function {name} ({graph.describe(graph.uids[component])})")
+        self.stats[name] += 1
+        return _Call(name, [args.get(pos) for pos in range(slots)])
+
+    def _structure_node(self, component, label):
+        graph = self.graph
+        if graph.names[component] != "ExcelIn":
+            raise UnsupportedMapping(f"source {graph.describe(graph.uids[component])}")
+        path = label[len(ENTRY_PREFIX):] if label.startswith(ENTRY_PREFIX) else label
+        if path.endswith("/Row"):
+            return _Rows()
+        match = re.search(r"/Cell(?:\[(.*)\])?$", path)
+        if match is None:
+            raise UnsupportedMapping(f"source entry {label}")
+        name = match.group(1) or "Cell"
+        self.columns.add(name)
+        return _Column(name)
+
+    def _if_else(self, args, slots):
+        # Inputs are condition/value pairs; an odd slot count ends in the else value.
+        pairs = (slots - 1) // 2 if slots % 2 else slots // 2
+        branches = [(args.get(2 * i), args.get(2 * i + 1)) for i in range(pairs)]
+        otherwise = args.get(slots - 1) if slots % 2 else None
+        if self.lookups:
+            lookup = self._as_lookup(branches, otherwise)
+            if lookup is not None:
+                self.stats["lookup"] += 1
+                self.stats["lookup cases"] += len(lookup.cases)
+                return lookup
+        self.stats["if-else"] += 1
+        return _IfElse(branches, otherwise)
+
+    @staticmethod
+    def _as_lookup(branches, otherwise):
+        subject = None
+        cases = []
+        for condition, value in branches:
+            if condition is None:
+                continue
+            if not isinstance(condition, _Call) or condition.name != "equal":
+                return None
+            a, b = condition.args[:2]
+            if isinstance(a, _Constant) and not isinstance(b, _Constant):
+                a, b = b, a
+            if a is None or isinstance(a, _Constant) or not isinstance(b, _Constant):
+                return None
+            if subject is None:
+                subject, numeric = a, b.numeric
+            elif a is not subject or b.numeric != numeric:
+                return None
+            key = pd.to_numeric(b.value, errors="coerce") if numeric else b.value
+            if not pd.isna(key):
+                cases.append((key, value))
+        if subject is None:
+            return None
+        return _Lookup(subject, numeric, cases, otherwise)
+
+
+def _pick_target(graph):
+    # The sink with the most connected inputs, e.g. the XBRL instance.
+    connected = Counter(graph.component_of_key(key) for key in set(graph.edge_dst))
+    sinks = graph.sinks()
+    if not sinks:
+        raise ValueError("The mapping has no target component.")
+    return max(sinks, key=lambda uid: connected[uid])
+
+
+def compile_mfd(mfd, target_uid=None, lookups=True):
+    """
+    Compiles the mapping into a CompiledMapping for one target component
+    (by default the one receiving the most connections).
+
+    With lookups=True, every if-else whose conditions are all
+    equal(subject, constant) on the same subject becomes a hash lookup from
+    subject value to branch; with lookups=False if-else is evaluated
+    condition by condition, which differential_test uses as the reference
+    interpretation. Targets that cannot be compiled are listed in
+    CompiledMapping.skipped rather than failing the whole mapping.
+
+    Args:
+        mfd (str or MfdGraph): Path of the MFD, or an already loaded graph.
+        target_uid (int): uid of the target component, or None.
+        lookups (bool): Compile decision chains into lookups.
+    """
+    graph = load_mfd(mfd) if isinstance(mfd, str) else mfd
+    if target_uid is None:
+        target_uid = _pick_target(graph)
+    compiler = _Compiler(graph, lookups)
+    targets, skipped = [], {}
+    for key, depth, label in graph.datapoints(target_uid, output=False):
+        if key not in compiler.feeder or depth == 0:
+            continue  # Unconnected entries and the output file name.
+        target = label[len(ENTRY_PREFIX):] if label.startswith(ENTRY_PREFIX) else label
+        try:
+            node = compiler.input_node(key)
+        except UnsupportedMapping as e:
+            skipped[key] = (target, str(e))
+            continue
+        if isinstance(node, _Rows):
+            continue  # Iteration context only, no value of its own.
+        targets.append((key, target, node))
+    stats = dict(compiler.stats, targets=len(targets), skipped=len(skipped))
+    return CompiledMapping(targets, sorted(compiler.columns), skipped, stats)
+
+
+def reference_from_xbrl(xbrl_file, view="viewallconceptsraw"):
+    """
+    Reads the facts of an XBRL instance (e.g. produced by MapForce from the
+    same source rows) as a reference for differential_test: one row per fact
+    with target set to the entry path the mapping uses for it.
+    """
+    from lxml import etree
+
+    targets, values = [], []
+    root = etree.parse(xbrl_file).getroot()
+
+    def walk(elem, path):
+        for child in elem:
+            if not isinstance(child.tag, str) or child.tag.startswith("{http://www.xbrl.org/2003/"):
+                continue
+            child_path = f"{path}/{etree.QName(child).localname}"
+            if len(child):
+                walk(child, child_path)
+            elif child.text is not None and child.text.strip():
+                targets.append(child_path)
+                values.append(child.text.strip())
+
+    walk(root, f"xbrl/{view}")
+    return pd.DataFrame({"target": targets, "value": values})
+
+
+def _value_counts(df, by):
+    return {name: Counter(group["value"]) for name, group in df.groupby(by, sort=False)}
+
+
+def _compare(expected, actual):
+    mismatches = []
+    for name in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(name, Counter())
+        got = actual.get(name, Counter())
+        if want != got:
+            mismatches.append({
+                "target": name,
+                "missing": sorted((want - got).elements()),
+                "unexpected": sorted((got - want).elements()),
+            })
+    return mismatches
+
+
+def differential_test(mfd, df, reference=None, target_uid=None):
+    """
+    Differential harness for the compiled transform. Runs it on df next to
+    the plain interpretation (compile_mfd(lookups=False)) and compares the
+    values per target datapoint; if reference outputs are given (a
+    DataFrame or CSV file with target and value columns, e.g. from
+    reference_from_xbrl) the compiled values are also compared with those
+    per target path, as multisets. Constant targets are left out of the
+    reference comparison, since the instance repeats them per fact.
+
+    Returns:
+        dict: Timings, counts and the mismatching targets of both checks.
+    """
+    graph = load_mfd(mfd) if isinstance(mfd, str) else mfd
+    compiled = compile_mfd(graph, target_uid)
+    interpreted = compile_mfd(graph, target_uid, lookups=False)
+
+    start = time.perf_counter()
+    actual = compiled(df)
+    compiled_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = interpreted(df)
+    interpreted_seconds = time.perf_counter() - start
+
+    report = {
+        "rows": len(df),
+        "targets": compiled.stats["targets"],
+        "skipped": compiled.skipped,
+        "values": len(actual),
+        "compiled_seconds": compiled_seconds,
+        "interpreted_seconds": interpreted_seconds,
+        "mismatches": _compare(_value_counts(expected, "key"), _value_counts(actual, "key")),
+    }
+    if reference is not None:
+        if isinstance(reference, str):
+            reference = pd.read_csv(reference, dtype=str, keep_default_na=False)
+        produced = actual[actual["row"] >= 0]
+        report["reference_mismatches"] = _compare(_value_counts(reference, "target"),
+                                                  _value_counts(produced, "target"))
+    return report
+
+
+if __name__ == "__main__":
+    mfd_file = "Schenkbelasting.txt"  # MapForce mapping
+    input_excel = "Schenkbelasting.xlsx"  # Excel source of the mapping
+    compiled = compile_mfd(mfd_file)
+    print(compiled.stats)
+    for key, (target, reason) in compiled.skipped.items():
+        print(f"Skipped {target}: {reason}")
+    rows = pd.read_excel(input_excel, sheet_name="Blad1", dtype=object)
+    report = differential_test(mfd_file, rows)
+    print(f"{report['values']} values from {report['rows']} rows, "
+          f"{len(report['mismatches'])} mismatching targets")
+    compiled(rows).to_csv("compiled_output.csv", index=False)
@@ -0,0 +1,423 @@
+import os
+from array import array
+from collections import defaultdict, deque
+from lxml import etree
+
+# Component libraries whose components are plain functions (constants,
+# comparisons, conditions, string and date helpers) rather than data
+# structures such as the Excel, text or XBRL components.
+FUNCTION_LIBRARIES = {"core", "lang", "db", "xlsx"}
+
+
+def _int(value):
+    return int(value) if value is not None and value.lstrip("-").isdigit() else None
+
+
+class MfdGraph:
+    """
+    Compact, read-only view of a MapForce mapping's component graph.
+
+    Components are numbered 0..n-1 in document order (the defaultmap wrapper
+    itself is left out). Every connectable point is a datapoint identified by
+    its MapForce key: the <datapoint> children of <sources> (inputs) and
+    <targets> (outputs), and the inpkey/outkey attributes of structure
+    entries. Edges run from an output key (<vertex vertexkey>) to an input
+    key (<edge vertexkey>).
+    """
+
+    def __init__(self):
+        # Per component.
+        self.names = []
+        self.libraries = []
+        self.uids = array("i")
+        self.kinds = array("i")
+        self.constants = {}  # component index -> (value, datatype)
+        self.input_slots = {}  # component index -> number of <sources> datapoints, keyless ones included
+        # Per datapoint.
+        self.dp_key = array("i")
+        self.dp_component = array("i")
+        self.dp_output = array("b")
+        self.dp_pos = array("i")  # position in <sources>/<targets>, or entry depth
+        self.dp_label = []  # entry path for structure entries, "" otherwise
+        # Per edge, as datapoint keys.
+        self.edge_src = array("i")
+        self.edge_dst = array("i")
+        # Indexes, built by _finish().
+        self.key_index = {}
+        self.uid_index = {}
+        self._out_ptr = self._out = self._in_ptr = self._in = None
+        self._fan_in = self._fan_out = None
+        self._dp_by_component = None
+
+    def _add_datapoint(self, key, component, output, pos, label=""):
+        self.dp_key.append(key)
+        self.dp_component.append(component)
+        self.dp_output.append(1 if output else 0)
+        self.dp_pos.append(pos)
+        self.dp_label.append(label)
+
+    def _finish(self):
+        """
+        Builds the key/uid indexes and the component-level adjacency arrays
+        (CSR: successors of component c are _out[_out_ptr[c]:_out_ptr[c + 1]]).
+        """
+        self.key_index = {key: index for index, key in enumerate(self.dp_key)}
+        self.uid_index = {uid: index for index, uid in enumerate(self.uids)}
+        n = len(self.uids)
+        self._dp_by_component = [array("i") for _ in range(n)]
+        for index, component in enumerate(self.dp_component):
+            self._dp_by_component[component].append(index)
+        self._fan_in = array("i", bytes(4 * n))
+        self._fan_out = array("i", bytes(4 * n))
+        forward = [set() for _ in range(n)]
+        backward = [set() for _ in range(n)]
+        for src, dst in zip(self.edge_src, self.edge_dst):
+            a = self.component_index_of_key(src)
+            b = self.component_index_of_key(dst)
+            if a is not None:
+                self._fan_out[a] += 1
+            if b is not None:
+                self._fan_in[b] += 1
+            if a is not None and b is not None:
+                forward[a].add(b)
+                backward[b].add(a)
+        self._out_ptr, self._out = self._csr(forward)
+        self._in_ptr, self._in = self._csr(backward)
+
+    @staticmethod
+    def _csr(neighbours):
+        ptr = array("i", [0])
+        flat = array("i")
+        for items in neighbours:
+            flat.extend(sorted(items))
+            ptr.append(len(flat))
+        return ptr, flat
+
+    # Lookups
+
+    def __len__(self):
+        return len(self.uids)
+
+    def component_index_of_key(self, key):
+        index = self.key_index.get(key)
+        return None if index is None else self.dp_component[index]
+
+    def component_of_key(self, key):
+        """
+        Returns the uid of the component owning datapoint `key`, or None.
+        """
+        index = self.component_index_of_key(key)
+        return None if index is None else self.uids[index]
+
+    def describe(self, uid):
+        index = self.uid_index[uid]
+        return f"{self.names[index]}#{uid}"
+
+    def datapoints(self, uid, output=None):
+        """
+        Returns (key, pos, label) for the datapoints of a component, inputs
+        and outputs or only one side if output is True/False.
+        """
+        return [
+            (self.dp_key[i], self.dp_pos[i], self.dp_label[i])
+            for i in self._dp_by_component[self.uid_index[uid]]
+            if output is None or bool(self.dp_output[i]) == output
+        ]
+
+    def successors(self, uid):
+        index = self.uid_index[uid]
+        return [self.uids[c] for c in self._out[self._out_ptr[index]:self._out_ptr[index + 1]]]
+
+    def predecessors(self, uid):
+        index = self.uid_index[uid]
+        return [self.uids[c] for c in self._in[self._in_ptr[index]:self._in_ptr[index + 1]]]
+
+    def fan_in(self, uid):
+        """
+        Number of edges ending on the component's input datapoints.
+        """
+        return self._fan_in[self.uid_index[uid]]
+
+    def fan_out(self, uid):
+        """
+        Number of edges leaving the component's output datapoints.
+        """
+        return self._fan_out[self.uid_index[uid]]
+
+    # Reachability
+
+    def _reach(self, starts, ptr, adjacency):
+        seen = bytearray(len(self.uids))
+        queue = deque(starts)
+        for index in starts:
+            seen[index] = 1
+        while queue:
+            index = queue.popleft()
+            for nxt in adjacency[ptr[index]:ptr[index + 1]]:
+                if not seen[nxt]:
+                    seen[nxt] = 1
+                    queue.append(nxt)
+        return seen
+
+    def downstream(self, uid):
+        """
+        Uids of all components the given component feeds, directly or not.
+        """
+        seen = self._reach([self.uid_index[uid]], self._out_ptr, self._out)
+        seen[self.uid_index[uid]] = 0
+        return {self.uids[i] for i, flag in enumerate(seen) if flag}
+
+    def upstream(self, uid):
+        """
+        Uids of all components that feed the given component, directly or not.
+        """
+        seen = self._reach([self.uid_index[uid]], self._in_ptr, self._in)
+        seen[self.uid_index[uid]] = 0
+        return {self.uids[i] for i, flag in enumerate(seen) if flag}
+
+    def sinks(self):
+        """
+        Uids of the target components: structure components (Excel, text,
+        XBRL, ...) that receive an edge below their file-name entry.
+        """
+        connected = set(self.edge_dst)
+        targets = set()
+        for i, key in enumerate(self.dp_key):
+            if not self.dp_output[i] and self.dp_label[i] and self.dp_pos[i] > 0 and key in connected:
+                targets.add(self.uids[self.dp_component[i]])
+        return sorted(targets)
+
+    def dead_components(self, sinks=None):
+        """
+        Uids of components whose results never reach a target component.
+        """
+        sinks = self.sinks() if sinks is None else sinks
+        live = self._reach([self.uid_index[uid] for uid in sinks], self._in_ptr, self._in)
+        return sorted(self.uids[i] for i, flag in enumerate(live) if not flag)
+
+    def unreachable_components(self):
+        """
+        Uids of function components with inputs none of which receives any
+        data, so they can never produce a value.
+        """
+        has_input = set()
+        connected_input = set()
+        connected = set(self.edge_dst)
+        for i, key in enumerate(self.dp_key):
+            if not self.dp_output[i]:
+                has_input.add(self.dp_component[i])
+                if key in connected:
+                    connected_input.add(self.dp_component[i])
+        sources = [i for i in range(len(self.uids)) if i not in has_input or self.libraries[i] not in FUNCTION_LIBRARIES]
+        fed = self._reach(sources, self._out_ptr, self._out)
+        return sorted(
+            self.uids[i] for i in range(len(self.uids))
+            if self.libraries[i] in FUNCTION_LIBRARIES and i in has_input and (not fed[i] or i not in connected_input)
+        )
+
+    def duplicate_subgraphs(self):
+        """
+        Groups of function components that compute the same thing: same
+        function (or constant value) fed by the same upstream results on the
+        same input positions. Each group is a sorted list of uids; only
+        groups with more than one member are returned.
+        """
+        # Which output (component, position) feeds each input key.
+        feeder = {}
+        for src, dst in zip(self.edge_src, self.edge_dst):
+            index = self.key_index.get(src)
+            if index is not None:
+                feeder[dst] = (self.dp_component[index], self.dp_pos[index])
+        inputs = defaultdict(list)
+        for i, key in enumerate(self.dp_key):
+            if not self.dp_output[i]:
+                inputs[self.dp_component[i]].append((self.dp_pos[i], key))
+
+        signature = {}
+
+        def sign(index, active):
+            if index in signature:
+                return signature[index]
+            if self.libraries[index] not in FUNCTION_LIBRARIES or index in active:
+                # Data structures (and cycles) are only equal to themselves.
+                signature[index] = ("component", self.uids[index])
+                return signature[index]
+            active.add(index)
+            fed_by = tuple(
+                (pos, sign(feeder[key][0], active), feeder[key][1]) if key in feeder else (pos, None, None)
+                for pos, key in sorted(inputs[index])
+            )
+            active.discard(index)
+            signature[index] = (self.names[index], self.libraries[index], self.kinds[index],
+                                self.constants.get(index), fed_by)
+            return signature[index]
+
+        groups = defaultdict(list)
+        for index in range(len(self.uids)):
+            if self.libraries[index] in FUNCTION_LIBRARIES:
+                groups[sign(index, set())].append(self.uids[index])
+        return sorted(sorted(uids) for uids in groups.values() if len(uids) > 1)
+
+    def summary(self):
+        """
+        Counts of components by name plus the number of datapoints and edges.
+        """
+        counts = defaultdict(int)
+        for name in self.names:
+            counts[name] += 1
+        return {
+            "components": dict(sorted(counts.items(), key=lambda item: -item[1])),
+            "datapoints": len(self.dp_key),
+            "edges": len(self.edge_src),
+        }
+
+
+def load_mfd(path):
+    """
+    Loads an MFD (MapForce mapping) into an MfdGraph with a single iterparse
+    pass; parsed elements are discarded as soon as they are read, so memory
+    is bounded by the compact arrays rather than the XML tree.
+    """
+    graph = MfdGraph()
+    component_stack = []  # component indexes; -1 for the defaultmap wrapper
+    entry_stack = []
+    tags = []
+    side = None  # "sources" / "targets" while inside one
+    ordinal = 0
+    vertex = None
+
+    for event, elem in etree.iterparse(path, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            parent = tags[-1] if tags else None
+            tags.append(tag)
+            if tag == "component":
+                if not component_stack:
+                    component_stack.append(-1)  # the defaultmap wrapper
+                    continue
+                graph.names.append(elem.get("name", ""))
+                graph.libraries.append(elem.get("library", ""))
+                graph.uids.append(_int(elem.get("uid")) or 0)
+                graph.kinds.append(_int(elem.get("kind")) or 0)
+                component_stack.append(len(graph.uids) - 1)
+            elif tag in ("sources", "targets") and parent == "component":
+                side = tag
+                ordinal = 0
+            elif tag == "datapoint" and side is not None:
+                key = _int(elem.get("key"))
+                pos = _int(elem.get("pos"))
+                if key is not None:
+                    graph._add_datapoint(key, component_stack[-1], side == "targets", ordinal if pos is None else pos)
+                ordinal += 1
+            elif tag == "entry":
+                entry_stack.append(elem.get("name", ""))
+                annotation = elem.get("annotation")
+                label = "/".join(entry_stack) + (f"[{annotation}]" if annotation else "")
+                depth = len(entry_stack) - 1
+                if elem.get("inpkey") is not None:
+                    graph._add_datapoint(int(elem.get("inpkey")), component_stack[-1], False, depth, label)
+                if elem.get("outkey") is not None:
+                    graph._add_datapoint(int(elem.get("outkey")), component_stack[-1], True, depth, label)
+            elif tag == "constant" and parent == "data" and component_stack and component_stack[-1] >= 0:
+                if graph.names[component_stack[-1]] == "constant":
+                    graph.constants[component_stack[-1]] = (elem.get("value"), elem.get("datatype"))
+            elif tag == "vertex":
+                vertex = _int(elem.get("vertexkey"))
+            elif tag == "edge" and vertex is not None:
+                graph.edge_src.append(vertex)
+                graph.edge_dst.append(int(elem.get("vertexkey")))
+        else:
+            tags.pop()
+            if tag == "component":
+                component_stack.pop()
+            elif tag in ("sources", "targets"):
+                if side == "sources":
+                    graph.input_slots[component_stack[-1]] = ordinal
+                side = None
+            elif tag == "entry":
+                entry_stack.pop()
+            elif tag == "vertex":
+                vertex = None
+            if tag in ("component", "vertex"):
+                # Drop what has been read; keep the parents so the parse can go on.
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    graph._finish()
+    return graph
+
+
+def write_pruned_mfd(input_file, output_file, remove_uids):
+    """
+    Writes a copy of an MFD without the given components, dropping every
+    edge to or from their datapoints and vertices left without edges.
+    Line endings, the XML declaration and the final newline are kept as in
+    the input, so with nothing removed a mapping saved by MapForce (CRLF
+    or LF) comes out byte-identical. Files from other writers may differ
+    in markup lxml normalises, such as "<a />" written as "<a/>".
+    """
+    graph = load_mfd(input_file)
+    remove_uids = set(remove_uids)
+    removed_keys = {
+        graph.dp_key[i] for i in range(len(graph.dp_key))
+        if graph.uids[graph.dp_component[i]] in remove_uids
+    }
+
+    tree = etree.parse(input_file)
+    children = tree.find("component/structure/children")
+    for component in list(children.iterfind("component")):
+        if _int(component.get("uid")) in remove_uids:
+            _remove_keep_layout(component)
+    for vertex in list(tree.iterfind("component/structure/graph/vertices/vertex")):
+        if _int(vertex.get("vertexkey")) in removed_keys:
+            _remove_keep_layout(vertex)
+            continue
+        edges = vertex.find("edges")
+        for edge in list(edges.iterfind("edge")):
+            if _int(edge.get("vertexkey")) in removed_keys:
+                _remove_keep_layout(edge)
+        if len(edges) == 0:
+            _remove_keep_layout(vertex)
+    # The parser turns CRLF into LF, so the input's line ending, declaration
+    # and final newline are taken from the file itself.
+    with open(input_file, "rb") as f:
+        first_line = f.readline()
+        f.seek(-1, os.SEEK_END)
+        final_newline = f.read(1) == b"\n"
+    newline = b"\r\n" if first_line.endswith(b"\r\n") else b"\n"
+    parts = [first_line.rstrip(b"\r\n")] if first_line.lstrip(b"\xef\xbb\xbf").startswith(b"<?xml") else []
+    # Written piecewise so the comment MapForce puts before <mapping> keeps its own line.
+    root = tree.getroot()
+    parts += [etree.tostring(sibling, encoding="UTF-8") for sibling in reversed(list(root.itersiblings(preceding=True)))]
+    parts.append(etree.tostring(root, encoding="UTF-8"))
+    data = b"\n".join(parts) + (b"\n" if final_newline else b"")
+    with open(output_file, "wb") as f:
+        f.write(data.replace(b"\n", newline) if newline != b"\n" else data)
+    return len(remove_uids & set(graph.uids))
+
+
+def _remove_keep_layout(elem):
+    # Give the element's tail to whatever precedes it so indentation stays intact.
+    parent = elem.getparent()
+    previous = elem.getprevious()
+    if previous is not None:
+        previous.tail = elem.tail
+    else:
+        parent.text = elem.tail
+    parent.remove(elem)
+
+
+if __name__ == "__main__":
+    mfd_file = "Schenkbelasting.txt"  # MapForce mapping to analyse
+    graph = load_mfd(mfd_file)
+    print(graph.summary())
+    dead = graph.dead_components()
+    print(f"Dead components: {len(dead)}")
+    print(f"Unreachable components: {len(graph.unreachable_components())}")
+    print(f"Duplicate groups: {len(graph.duplicate_subgraphs())}")
+    if dead:
+        # Next to the input, named after it, e.g. Schenkbelasting.pruned.mfd.
+        pruned_file = os.path.splitext(mfd_file)[0] + ".pruned.mfd"
+        write_pruned_mfd(mfd_file, pruned_file, dead)
+        print(f"Pruned mapping written to: {pruned_file}")
@@ -0,0 +1,410 @@
+import gc
+import os
+import sys
+import pickle
+import zipfile
+from collections import namedtuple
+
+from lxml import etree
+
+XS_NS = "http://www.w3.org/2001/XMLSchema"
+XBRLI_NS = "http://www.xbrl.org/2003/instance"
+XBRLI_ITEM = f"{{{XBRLI_NS}}}item"
+XBRLI_TUPLE = f"{{{XBRLI_NS}}}tuple"
+
+# Suffix of the index file written next to a taxonomy package.
+INDEX_SUFFIX = ".taxindex"
+# Bump when the index layout changes so old index files are rebuilt.
+INDEX_VERSION = 1
+
+# xbrli item types (and the XSD types they derive from) holding numbers.
+NUMERIC_ITEM_TYPES = frozenset(
+    f"{{{XBRLI_NS}}}{name}" for name in (
+        "monetaryItemType", "decimalItemType", "floatItemType", "doubleItemType",
+        "integerItemType", "nonPositiveIntegerItemType", "negativeIntegerItemType",
+        "longItemType", "intItemType", "shortItemType", "byteItemType",
+        "nonNegativeIntegerItemType", "unsignedLongItemType", "unsignedIntItemType",
+        "unsignedShortItemType", "unsignedByteItemType", "positiveIntegerItemType",
+        "sharesItemType", "pureItemType", "fractionItemType",
+    )
+) | frozenset(
+    f"{{{XS_NS}}}{name}" for name in (
+        "decimal", "float", "double", "integer", "nonPositiveInteger", "negativeInteger",
+        "long", "int", "short", "byte", "nonNegativeInteger", "unsignedLong",
+        "unsignedInt", "unsignedShort", "unsignedByte", "positiveInteger",
+    )
+)
+
+# Restriction facets kept per type, for validating values.
+FACETS = ("length", "minLength", "maxLength", "pattern", "totalDigits", "fractionDigits",
+          "minInclusive", "maxInclusive", "minExclusive", "maxExclusive")
+
+
+class Concept(namedtuple("Concept", (
+        "namespace", "name", "id", "type", "item_type", "kind",
+        "period_type", "balance", "abstract", "nillable"))):
+    """
+    A concept declared in the taxonomy. type is the declared type, item_type
+    the xbrli or XSD type it finally derives from, and kind "item", "tuple"
+    or the substitution group head for anything else (e.g. dimensions).
+    """
+
+    __slots__ = ()
+
+    @property
+    def numeric(self):
+        return self.item_type in NUMERIC_ITEM_TYPES
+
+
+# base is the Clark name of the restricted or extended type; facets maps a
+# facet name to its value, and "enumeration" to a tuple of allowed values.
+TypeDef = namedtuple("TypeDef", ("base", "facets"))
+
+
+class UnknownConcept(KeyError):
+    """
+    Raised for a name whose prefix or concept is not in the taxonomy.
+    """
+
+
+class TaxonomyIndex:
+    """
+    Compiled view of a taxonomy package: prefix and concept lookups are
+    plain dict accesses, and tuple content models are frozensets.
+
+    Attributes:
+        prefixes (dict): prefix -> namespace URI, as declared by the schemas.
+        concepts (dict): "{uri}local" -> Concept.
+        types (dict): "{uri}local" -> TypeDef for every named type.
+        tuples (dict): "{uri}local" of a tuple -> frozenset of the "{uri}local"
+            names allowed as its children.
+        ids (dict): concept id (as used in linkbase hrefs) -> "{uri}local".
+    """
+
+    def __init__(self, prefixes, concepts, types, tuples, ids):
+        self.prefixes = prefixes
+        self.concepts = concepts
+        self.types = types
+        self.tuples = tuples
+        self.ids = ids
+
+    def qualify(self, name):
+        """
+        Turns "prefix:local" into "{uri}local"; raises UnknownConcept if the
+        prefix or the concept is not in the taxonomy.
+        """
+        prefix, _, local = name.partition(":")
+        uri = self.prefixes.get(prefix)
+        if uri is None or not local:
+            raise UnknownConcept(f"unknown namespace prefix in '{name}'")
+        clark = f"{{{uri}}}{local}"
+        if clark not in self.concepts:
+            raise UnknownConcept(f"unknown concept '{name}'")
+        return clark
+
+    def concept(self, name):
+        """
+        Returns the Concept for a "prefix:local" or "{uri}local" name.
+        """
+        clark = name if name.startswith("{") else self.qualify(name)
+        try:
+            return self.concepts[clark]
+        except KeyError:
+            raise UnknownConcept(f"unknown concept '{name}'") from None
+
+    def facets(self, type_name):
+        """
+        Facets of a type merged along its derivation chain, nearest first.
+        """
+        merged = {}
+        while type_name in self.types:
+            definition = self.types[type_name]
+            for facet, value in definition.facets.items():
+                merged.setdefault(facet, value)
+            type_name = definition.base
+        return merged
+
+    def check_names(self, pairs):
+        """
+        Checks (parent, child) "prefix:local" pairs, e.g. the distinct
+        path1/field combinations of a workbook: both must be concepts, the
+        parent a tuple and the child part of its content model.
+
+        Returns:
+            list: One message per problem, in the order of the pairs.
+        """
+        problems = []
+        reported = set()
+        for parent, child in pairs:
+            try:
+                parent_name = self.qualify(parent)
+            except UnknownConcept as e:
+                if parent not in reported:
+                    reported.add(parent)
+                    problems.append(e.args[0])
+                continue
+            if parent_name not in self.tuples:
+                if parent not in reported:
+                    reported.add(parent)
+                    problems.append(f"'{parent}' is not a tuple")
+                continue
+            try:
+                child_name = self.qualify(child)
+            except UnknownConcept as e:
+                problems.append(f"{e.args[0]} under '{parent}'")
+                continue
+            if child_name not in self.tuples[parent_name]:
+                problems.append(f"'{child}' is not allowed in tuple '{parent}'")
+        return problems
+
+    def nsmap(self, prefixes, base=None):
+        """
+        Namespace map for an instance using the given prefixes: base (e.g.
+        the writer's defaults) with the taxonomy's URIs for those prefixes.
+        """
+        nsmap = dict(base or {})
+        for prefix in prefixes:
+            if prefix in self.prefixes:
+                nsmap[prefix] = self.prefixes[prefix]
+        return nsmap
+
+
+def format_problems(problems, limit=10):
+    """
+    One-line summary of check_names-style problems, listing at most limit.
+    """
+    text = "; ".join(problems[:limit])
+    if len(problems) > limit:
+        text += f"; ... and {len(problems) - limit} more"
+    return text
+
+
+def _iter_schemas(source):
+    """
+    Yields (name, bytes) for every .xsd in a taxonomy package zip or
+    directory. Only schemas are read: concepts, types and tuple content
+    models are all declared there, and linkbases refer to them by id.
+    """
+    if os.path.isdir(source):
+        for folder, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".xsd"):
+                    path = os.path.join(folder, name)
+                    with open(path, "rb") as f:
+                        yield os.path.relpath(path, source), f.read()
+    else:
+        with zipfile.ZipFile(source) as package:
+            for name in sorted(package.namelist()):
+                if name.lower().endswith(".xsd"):
+                    yield name, package.read(name)
+
+
+def _qname(value, elem):
+    """
+    Resolves a QName attribute value against the element's in-scope prefixes.
+    Results are interned: the same type and group names recur on thousands
+    of concepts, and the index file stores each only once.
+    """
+    if value is None:
+        return None
+    prefix, _, local = value.rpartition(":")
+    uri = elem.nsmap.get(prefix or None)
+    return sys.intern(f"{{{uri}}}{local}" if uri else local)
+
+
+def _interned(value):
+    return None if value is None else sys.intern(value)
+
+
+def _restriction(definition):
+    """
+    (base, facets) of a type definition's restriction or extension, if any.
+    """
+    for derivation in definition.iter(f"{{{XS_NS}}}restriction", f"{{{XS_NS}}}extension"):
+        facets = {}
+        enumeration = []
+        for facet in derivation:
+            if not isinstance(facet.tag, str) or not facet.tag.startswith(f"{{{XS_NS}}}"):
+                continue
+            name = facet.tag.split("}", 1)[1]
+            if name == "enumeration":
+                enumeration.append(facet.get("value"))
+            elif name in FACETS:
+                facets[name] = facet.get("value")
+        if enumeration:
+            facets["enumeration"] = tuple(enumeration)
+        return _qname(derivation.get("base"), derivation), facets
+    return None, {}
+
+
+def _refs(definition):
+    return frozenset(
+        _qname(particle.get("ref"), particle)
+        for particle in definition.iter(f"{{{XS_NS}}}element")
+        if particle.get("ref")
+    )
+
+
+def compile_taxonomy(source):
+    """
+    Reads every schema of a local taxonomy package (zip or directory, no
+    network access) and compiles its prefixes, concepts, named types and
+    tuple content models into a TaxonomyIndex.
+    """
+    prefixes = {}
+    own_prefixes = {}  # prefixes a schema declares for its own targetNamespace
+    declarations = []  # (clark, element, target namespace)
+    types = {}
+    type_refs = {}  # named complex type -> element refs in its content model
+
+    for name, data in _iter_schemas(source):
+        try:
+            schema = etree.fromstring(data)
+        except etree.XMLSyntaxError as e:
+            print(f"Skipping unreadable schema {name}: {e}")
+            continue
+        if schema.tag != f"{{{XS_NS}}}schema":
+            continue
+        target = schema.get("targetNamespace", "")
+        for prefix, uri in schema.nsmap.items():
+            if prefix:
+                prefixes.setdefault(prefix, uri)
+                if uri == target:
+                    own_prefixes[prefix] = uri
+        for child in schema:
+            if child.tag in (f"{{{XS_NS}}}complexType", f"{{{XS_NS}}}simpleType") and child.get("name"):
+                clark = f"{{{target}}}{child.get('name')}"
+                types[clark] = TypeDef(*_restriction(child))
+                if child.tag == f"{{{XS_NS}}}complexType":
+                    type_refs[clark] = _refs(child)
+            elif child.tag == f"{{{XS_NS}}}element" and child.get("name"):
+                declarations.append((f"{{{target}}}{child.get('name')}", child, target))
+    prefixes.update(own_prefixes)
+
+    groups = {clark: _qname(elem.get("substitutionGroup"), elem) for clark, elem, _ in declarations}
+
+    def kind_of(clark):
+        seen = set()
+        head = groups.get(clark)
+        while head in groups and head not in seen:
+            seen.add(head)
+            if head in (XBRLI_ITEM, XBRLI_TUPLE):
+                break
+            head = groups[head]
+        if head == XBRLI_ITEM:
+            return "item"
+        if head == XBRLI_TUPLE:
+            return "tuple"
+        return head
+
+    def item_type_of(type_name):
+        seen = set()
+        while type_name in types and type_name not in seen and not type_name.startswith(f"{{{XBRLI_NS}}}"):
+            seen.add(type_name)
+            type_name = types[type_name].base
+        return type_name
+
+    concepts, tuples, ids = {}, {}, {}
+    for clark, elem, target in declarations:
+        type_name = _qname(elem.get("type"), elem)
+        concept = Concept(
+            namespace=target,
+            name=elem.get("name"),
+            id=elem.get("id"),
+            type=type_name,
+            item_type=item_type_of(type_name),
+            kind=kind_of(clark),
+            period_type=_interned(elem.get(f"{{{XBRLI_NS}}}periodType")),
+            balance=_interned(elem.get(f"{{{XBRLI_NS}}}balance")),
+            abstract=elem.get("abstract") in ("true", "1"),
+            nillable=elem.get("nillable") in ("true", "1"),
+        )
+        concepts[clark] = concept
+        if concept.id:
+            ids[concept.id] = clark
+        if concept.kind == "tuple":
+            tuples[clark] = _refs(elem) | type_refs.get(type_name, frozenset())
+    return TaxonomyIndex(prefixes, concepts, types, tuples, ids)
+
+
+def _source_signature(source):
+    """
+    (name, size, mtime) of the package, or of every schema in a directory;
+    any change makes load_taxonomy compile the package again.
+    """
+    if not os.path.isdir(source):
+        stat = os.stat(source)
+        return [(os.path.basename(source), stat.st_size, stat.st_mtime_ns)]
+    signature = []
+    for folder, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".xsd"):
+                stat = os.stat(os.path.join(folder, name))
+                signature.append((os.path.relpath(os.path.join(folder, name), source), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def save_index(index, index_file, signature=None):
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    payload = {
+        "version": INDEX_VERSION,
+        "signature": signature,
+        "index": (index.prefixes, index.concepts, index.types, index.tuples, index.ids),
+    }
+    with open(tmp_file, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, index_file)
+
+
+def read_index(index_file):
+    """
+    Reads an index file written by save_index, without checking its source.
+    """
+    with open(index_file, "rb") as f:
+        data = f.read()
+    # Unpickling creates tens of thousands of objects and nothing cyclic.
+    gc.disable()
+    try:
+        payload = pickle.loads(data)
+    finally:
+        gc.enable()
+    if payload.get("version") != INDEX_VERSION:
+        raise ValueError(f"Taxonomy index '{index_file}' has an old layout")
+    return TaxonomyIndex(*payload["index"]), payload["signature"]
+
+
+def load_taxonomy(source, index_file=None, rebuild=False):
+    """
+    Returns the TaxonomyIndex of a local taxonomy package, compiling it only
+    when its binary index file is missing or older than the package.
+
+    Args:
+        source (str): Taxonomy package zip, or a directory of schemas and
+            linkbases. Nothing is fetched over the network.
+        index_file (str): Where the compiled index is kept; defaults to the
+            source path with INDEX_SUFFIX appended.
+        rebuild (bool): Compile the package even if the index is current.
+    """
+    if index_file is None:
+        index_file = source.rstrip("/\\") + INDEX_SUFFIX
+    signature = _source_signature(source)
+    if not rebuild and os.path.exists(index_file):
+        try:
+            index, stored = read_index(index_file)
+            if stored == signature:
+                return index
+        except Exception as e:
+            print(f"Ignoring unreadable taxonomy index {index_file}: {e}")
+
+    index = compile_taxonomy(source)
+    save_index(index, index_file, signature)
+    return index
+
+
+if __name__ == "__main__":
+    taxonomy_package = "nt18.zip"  # Replace with your taxonomy package or folder
+    taxonomy = load_taxonomy(taxonomy_package)
+    print(f"Taxonomy index: {len(taxonomy.concepts)} concepts, {len(taxonomy.tuples)} tuples, "
+          f"{len(taxonomy.types)} types, {len(taxonomy.prefixes)} prefixes")
@@ -0,0 +1,148 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
+import pandas as pd
+
+import instrumentation
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Sidecars fall back to pickle without pyarrow.
+    pa = None
+
+CACHE_DIR_NAME = ".workbook_cache"
+# Bump when the sidecar layout changes so old sidecars are ignored.
+CACHE_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sidecar_base(input_file, sheet_name, skiprows, cache_dir):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(input_file)), CACHE_DIR_NAME)
+    name = f"{os.path.basename(input_file)}.{sheet_name}.skip{skiprows}"
+    return os.path.join(cache_dir, name)
+
+
+def _load_meta(meta_file):
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _tmp_name(path):
+    # Unique per process and thread, so concurrent readers of one workbook
+    # (e.g. parallel build stages) never write the same temporary file.
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_meta(meta_file, meta):
+    tmp_file = _tmp_name(meta_file)
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, meta_file)
+
+
+def _source_unchanged(input_file, meta, meta_file):
+    """
+    Checks a sidecar against its source: size and mtime match is enough; if
+    only the mtime moved (e.g. the file was copied or touched) the content
+    hash decides and the recorded mtime is refreshed.
+    """
+    stat = os.stat(input_file)
+    if meta is None or meta.get("version") != CACHE_VERSION or meta["size"] != stat.st_size:
+        return False
+    if meta["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if file_sha256(input_file) != meta["sha256"]:
+        return False
+    meta["mtime_ns"] = stat.st_mtime_ns
+    _write_meta(meta_file, meta)
+    return True
+
+
+def _read_sidecar(base, meta):
+    if meta["format"] == "arrow":
+        # Uncompressed Arrow IPC, so the columns are memory-mapped, not copied.
+        df = feather.read_table(base + ".arrow", memory_map=True).to_pandas()
+    else:
+        with open(base + ".pkl", "rb") as f:
+            df = pickle.load(f)
+    df.columns = meta["columns"]
+    return df
+
+
+def _write_sidecar(base, df):
+    """
+    Writes df as an Arrow IPC sidecar, or as a pickle if pyarrow is missing
+    or cannot represent a column (e.g. mixed text and numbers). Returns the
+    format used.
+    """
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df.set_axis([str(col) for col in df.columns], axis=1), preserve_index=False)
+            tmp_file = _tmp_name(base + ".arrow")
+            feather.write_feather(table, tmp_file, compression="uncompressed")
+            os.replace(tmp_file, base + ".arrow")
+            return "arrow"
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+    tmp_file = _tmp_name(base + ".pkl")
+    with open(tmp_file, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, base + ".pkl")
+    return "pickle"
+
+
+def read_sheet_cached(input_file, sheet_name, skiprows=0, cache_dir=None):
+    """
+    Reads a worksheet with header=None like pd.read_excel, keeping the parsed
+    result in a columnar sidecar so later runs skip the xlsx parse.
+
+    Sidecars live in a .workbook_cache folder next to the workbook (or in
+    cache_dir) and are keyed by the workbook's size, mtime and SHA-256; any
+    change to the source makes the next call parse the workbook again.
+    """
+    base = _sidecar_base(input_file, sheet_name, skiprows, cache_dir)
+    meta_file = base + ".json"
+    meta = _load_meta(meta_file)
+    if _source_unchanged(input_file, meta, meta_file):
+        try:
+            df = _read_sidecar(base, meta)
+            instrumentation.count("workbook_cache_hits")
+            return df
+        except Exception as e:
+            print(f"Ignoring unreadable workbook cache {base}: {e}")
+    instrumentation.count("workbook_cache_misses")
+
+    # Hash before parsing so a change during the parse invalidates the sidecar.
+    stat = os.stat(input_file)
+    sha256 = file_sha256(input_file)
+    df = pd.read_excel(input_file, sheet_name=sheet_name, header=None, skiprows=skiprows)
+
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    if meta is not None and os.path.exists(meta_file):
+        os.remove(meta_file)
+    _write_meta(meta_file, {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "format": _write_sidecar(base, df),
+        "columns": list(df.columns),
+    })
+    return df
@@ -0,0 +1,228 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+XBRLI_NS = "http://www.xbrl.org/2003/instance"
+XBRLDI_NS = "http://xbrl.org/2006/xbrldi"
+ISO4217_NS = "http://www.xbrl.org/2003/iso4217"
+
+# Workbook columns read by the registry. The entity identifier falls back to
+# the ID column; dimension columns are named DIMENSION_PREFIX + dimension
+# QName and hold the member QName.
+ENTITY_COLUMN = "entity"
+SCHEME_COLUMN = "entity_scheme"
+START_COLUMN = "period_start"
+END_COLUMN = "period_end"
+INSTANT_COLUMN = "period_instant"
+UNIT_COLUMN = "unit"
+DECIMALS_COLUMN = "decimals"
+DIMENSION_PREFIX = "dim:"
+CONTEXT_COLUMNS = (ENTITY_COLUMN, SCHEME_COLUMN, START_COLUMN, END_COLUMN, INSTANT_COLUMN, UNIT_COLUMN, DECIMALS_COLUMN)
+
+DEFAULT_SCHEME = "www.belastingdienst.nl/fiscaalnummer"
+# Unit column values that are not currency codes.
+XBRLI_MEASURES = ("pure", "shares")
+
+
+def has_context_columns(df):
+    """
+    True if the workbook has any column the registry reads.
+    """
+    return any(col in CONTEXT_COLUMNS or str(col).startswith(DIMENSION_PREFIX) for col in df.columns)
+
+
+def _cell_text(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return ""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        # Identifiers and decimals read as floats when a column has gaps.
+        return str(int(value))
+    text = str(value).strip()
+    return text[:-9] if text.endswith(" 00:00:00") else text
+
+
+def _column_codes(df, column, default=""):
+    """
+    (codes, texts) for a column: texts[codes[i]] is the canonical text of
+    row i (stripped, dates as YYYY-MM-DD, empty cells as default).
+    Converted per distinct value, so long columns of repeated values are cheap.
+    """
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=np.int64), [default]
+    codes, uniques = pd.factorize(df[column], sort=False)
+    texts = [_cell_text(value) or default for value in uniques] + [default]
+    return np.where(codes < 0, len(uniques), codes), texts
+
+
+def _measure(unit):
+    if ":" in unit:
+        return unit
+    if unit in XBRLI_MEASURES:
+        return f"xbrli:{unit}"
+    return f"iso4217:{unit.upper()}"
+
+
+def _check_periods(df, has_start, has_end, has_instant, limit=10):
+    """
+    Raises ValueError for rows whose period is neither a duration (start
+    and end), an instant nor forever (all empty).
+    """
+    problems = []
+    for mask, message in (
+        (has_start != has_end, f"only one of {START_COLUMN} and {END_COLUMN}"),
+        (has_instant & (has_start | has_end), f"{INSTANT_COLUMN} together with {START_COLUMN}/{END_COLUMN}"),
+    ):
+        if mask.any():
+            # Worksheet row numbers: the index counts from 0 after the header row.
+            rows = [str(row + 2) for row in df.index[mask]]
+            more = f" and {len(rows) - limit} more" if len(rows) > limit else ""
+            problems.append(f"{message} in row(s) {', '.join(rows[:limit])}{more}")
+    if problems:
+        raise ValueError("Invalid period: " + "; ".join(problems))
+
+
+class ContextRegistry:
+    """
+    Interns the contexts and units of an instance. A context is identified
+    by its canonical key (scheme, identifier, start, end, instant, sorted
+    dimension/member pairs) and a unit by its measure; each distinct key
+    gets a compact id (c1, c2, ... and u1, u2, ...) in order of first use,
+    and is emitted exactly once however many facts refer to it.
+    """
+
+    def __init__(self, scheme=DEFAULT_SCHEME, id_column="ID"):
+        self.scheme = scheme
+        self.id_column = id_column
+        self.contexts = {}  # canonical key -> id
+        self.units = {}  # measure -> id
+
+    def _context_id(self, key):
+        context_id = self.contexts.get(key)
+        if context_id is None:
+            context_id = self.contexts[key] = f"c{len(self.contexts) + 1}"
+        return context_id
+
+    def _unit_id(self, measure):
+        unit_id = self.units.get(measure)
+        if unit_id is None:
+            unit_id = self.units[measure] = f"u{len(self.units) + 1}"
+        return unit_id
+
+    def register(self, df):
+        """
+        Registers the contexts and units of the workbook rows.
+
+        Returns:
+            ndarray: Per row, the attribute dict for its facts (contextRef,
+            then unitRef and decimals when set). Rows sharing a context,
+            unit and decimals share one dict.
+
+        Raises:
+            ValueError: naming the rows with only one of period_start and
+            period_end, or with period_instant as well as either of them.
+        """
+        if not len(df):
+            return np.empty(0, dtype=object)
+        columns = [
+            _column_codes(df, SCHEME_COLUMN, self.scheme),
+            _column_codes(df, ENTITY_COLUMN if ENTITY_COLUMN in df.columns else self.id_column),
+            _column_codes(df, START_COLUMN),
+            _column_codes(df, END_COLUMN),
+            _column_codes(df, INSTANT_COLUMN),
+        ]
+        _check_periods(df, *(np.array([bool(text) for text in texts])[column_codes]
+                             for column_codes, texts in columns[2:5]))
+        dimensions = [col for col in df.columns if str(col).startswith(DIMENSION_PREFIX)]
+        dimensions.sort(key=str)
+        columns += [_column_codes(df, col) for col in dimensions]
+        columns += [_column_codes(df, UNIT_COLUMN), _column_codes(df, DECIMALS_COLUMN)]
+
+        # One integer code per distinct row of column codes, refactorised
+        # after every column so the combined key never overflows.
+        codes = np.zeros(len(df), dtype=np.int64)
+        for column_codes, texts in columns:
+            codes = pd.factorize(codes * len(texts) + column_codes, sort=False)[0]
+        _, first = np.unique(codes, return_index=True)
+
+        attributes = []
+        for row in first:
+            key = [texts[column_codes[row]] for column_codes, texts in columns]
+            scheme, identifier, start, end, instant = key[:5]
+            members = tuple(
+                (str(col)[len(DIMENSION_PREFIX):], member)
+                for col, member in zip(dimensions, key[5:-2]) if member
+            )
+            unit, decimals = key[-2:]
+            attrib = {"contextRef": self._context_id((scheme, identifier, start, end, instant, members))}
+            if unit:
+                attrib["unitRef"] = self._unit_id(_measure(unit))
+            if decimals:
+                attrib["decimals"] = decimals
+            attributes.append(attrib)
+        table = np.empty(len(attributes), dtype=object)
+        table[:] = attributes
+        return table[codes]
+
+    def prefixes(self):
+        """
+        Namespace prefixes used by dimension, member and measure QNames.
+        """
+        used = set()
+        for key in self.contexts:
+            for dimension, member in key[5]:
+                used.update(name.split(":", 1)[0] for name in (dimension, member) if ":" in name)
+        used.update(measure.split(":", 1)[0] for measure in self.units)
+        return used
+
+    def extend_nsmap(self, nsmap, taxonomy=None):
+        """
+        Adds the xbrldi namespace (when there are dimensions) and the
+        taxonomy's URIs for the prefixes used in QName values to nsmap.
+
+        Raises:
+            ValueError: if a prefix used in a QName value is not declared.
+        """
+        nsmap = dict(nsmap)
+        if any(key[5] for key in self.contexts):
+            nsmap.setdefault("xbrldi", XBRLDI_NS)
+        nsmap.setdefault("iso4217", ISO4217_NS)
+        unknown = []
+        for prefix in sorted(self.prefixes()):
+            if prefix in nsmap:
+                continue
+            if taxonomy is not None and prefix in taxonomy.prefixes:
+                nsmap[prefix] = taxonomy.prefixes[prefix]
+            else:
+                unknown.append(prefix)
+        if unknown:
+            raise ValueError(f"Undeclared namespace prefix(es) in dimension or unit columns: {', '.join(unknown)}")
+        return nsmap
+
+    def append_to(self, root):
+        """
+        Appends one xbrli:context per context and one xbrli:unit per unit.
+        """
+        xbrli = f"{{{XBRLI_NS}}}"
+        for (scheme, identifier, start, end, instant, members), context_id in self.contexts.items():
+            context = etree.SubElement(root, xbrli + "context", id=context_id)
+            entity = etree.SubElement(context, xbrli + "entity")
+            etree.SubElement(entity, xbrli + "identifier", scheme=scheme).text = identifier
+            period = etree.SubElement(context, xbrli + "period")
+            if instant:
+                etree.SubElement(period, xbrli + "instant").text = instant
+            elif start or end:
+                etree.SubElement(period, xbrli + "startDate").text = start
+                etree.SubElement(period, xbrli + "endDate").text = end
+            else:
+                etree.SubElement(period, xbrli + "forever")
+            if members:
+                scenario = etree.SubElement(context, xbrli + "scenario")
+                for dimension, member in members:
+                    etree.SubElement(scenario, f"{{{XBRLDI_NS}}}explicitMember", dimension=dimension).text = member
+        for measure, unit_id in self.units.items():
+            unit = etree.SubElement(root, xbrli + "unit", id=unit_id)
+            etree.SubElement(unit, xbrli + "measure").text = measure
@@ -0,0 +1,354 @@
+import xml.parsers.expat
+from collections import defaultdict
+
+import pandas as pd
+from lxml import etree
+
+# Bytes fed to the parser per read in streaming mode.
+STREAM_READ_SIZE = 1 << 20
+
+
+def read_updates(path):
+    """
+    Reads an update table (path, target, value columns) from a CSV or Excel
+    file. Values are kept as text; empty cells become empty strings.
+    """
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path, dtype=str)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return df.fillna("")
+
+
+def _split_path(path):
+    if path is None or (isinstance(path, float) and pd.isna(path)):
+        return []
+    if isinstance(path, str):
+        return [part.strip() for part in path.split("/") if part.strip()]
+    return [str(part).strip() for part in path]
+
+
+def _iter_updates(updates):
+    if isinstance(updates, pd.DataFrame):
+        missing = [col for col in ("path", "target", "value") if col not in updates.columns]
+        if missing:
+            raise ValueError(f"Missing columns in the update table: {', '.join(missing)}")
+        updates = zip(updates["path"], updates["target"], updates["value"])
+    for path, target, value in updates:
+        yield _split_path(path), str(target).strip(), "" if value is None else str(value)
+
+
+def _resolve(name, prefixes):
+    """
+    Turns "prefix:local" into "{uri}local" using real namespace URIs; an
+    unprefixed name stays a plain local name and matches in any namespace.
+    Returns None for an unknown prefix.
+    """
+    if ":" not in name:
+        return name
+    prefix, local = name.split(":", 1)
+    uri = prefixes.get(prefix)
+    return None if uri is None else f"{{{uri}}}{local}"
+
+
+def _local(clark):
+    return clark.rsplit("}", 1)[-1]
+
+
+def _compile_updates(updates, prefixes):
+    """
+    Resolves every update to (index, path, target, path names, target name,
+    value); updates with an unknown prefix go straight to the not-found list.
+    """
+    compiled, not_found = [], []
+    for index, (path, target, value) in enumerate(_iter_updates(updates)):
+        names = [_resolve(part, prefixes) for part in path]
+        target_name = _resolve(target, prefixes)
+        if target_name is None or None in names:
+            not_found.append(_not_found(index, "/".join(path), target, "unknown namespace prefix"))
+            continue
+        compiled.append((index, "/".join(path), target, tuple(names), target_name, value))
+    return compiled, not_found
+
+
+def _not_found(index, path, target, reason):
+    return {"index": index, "path": path, "target": target, "reason": reason}
+
+
+def _report(compiled, not_found, applied, output_file):
+    not_found.sort(key=lambda item: item["index"])
+    total = len(compiled) + sum(1 for item in not_found if item["reason"] == "unknown namespace prefix")
+    return {"updates": total, "applied": applied, "not_found": not_found, "output": output_file}
+
+
+class XbrlIndex:
+    """
+    Index over a parsed instance: for every element the first child and the
+    first descendant with a given name, under both its namespace-qualified
+    "{uri}local" name and its plain local name. Built in one walk; every
+    lookup is a dict access.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.first_child = {}
+        self.first_descendant = {}
+        stack = [root]
+        for elem in root.iterdescendants():
+            if not isinstance(elem.tag, str):
+                continue
+            parent = elem.getparent()
+            while stack[-1] is not parent:
+                stack.pop()
+            names = (elem.tag, _local(elem.tag))
+            for name in names:
+                self.first_child.setdefault((parent, name), elem)
+                for ancestor in stack:
+                    self.first_descendant.setdefault((ancestor, name), elem)
+            stack.append(elem)
+
+    def find(self, names, target):
+        """
+        Returns (element, None), or (None, reason) if the path or the target
+        does not exist.
+        """
+        node = self.root
+        for name in names:
+            node = self.first_child.get((node, name))
+            if node is None:
+                return None, f"path component not found: {name}"
+        elem = self.first_descendant.get((node, target))
+        if elem is None:
+            return None, f"target not found: {target}"
+        return elem, None
+
+
+def patch_xbrl(input_file, output_file, updates, namespaces=None, streaming=False):
+    """
+    Applies a table of (path, target, value) updates to an XBRL instance in
+    one pass and writes the result once, replacing one
+    XBRLMapper.MapValueToXBRL call per value.
+
+    Like MapValueToXBRL, path is a list (or "/"-separated string) of element
+    names walked from the root, taking the first matching child at each
+    level, and target is set on the first descendant with that name.
+    "prefix:local" names are matched by namespace URI (the instance's own
+    prefix declarations, then `namespaces`); plain names match any
+    namespace. When several updates hit the same element the last one wins.
+
+    Args:
+        input_file (str): Instance to patch.
+        output_file (str): Where to write the patched instance.
+        updates: DataFrame with path, target and value columns, or an
+            iterable of (path, target, value).
+        namespaces (dict): Extra prefix -> namespace URI mappings.
+        streaming (bool): Patch the bytes while parsing instead of building
+            a tree, for instances too large to hold in memory. Everything
+            outside the patched values is copied unchanged.
+
+    Returns:
+        dict: Counts of updates and applied updates, and the updates whose
+        path or target was not found.
+    """
+    if streaming:
+        return _StreamPatcher(updates, namespaces or {}).run(input_file, output_file)
+
+    tree = etree.parse(input_file)
+    root = tree.getroot()
+    prefixes = dict(namespaces or {})
+    prefixes.update({prefix: uri for prefix, uri in root.nsmap.items() if prefix})
+    compiled, not_found = _compile_updates(updates, prefixes)
+
+    index = XbrlIndex(root)
+    applied = 0
+    for number, path, target, names, target_name, value in compiled:
+        elem, reason = index.find(names, target_name)
+        if elem is None:
+            not_found.append(_not_found(number, path, target, reason))
+            continue
+        for child in list(elem):
+            elem.remove(child)
+        elem.text = value
+        applied += 1
+
+    tree.write(output_file, xml_declaration=True, encoding=tree.docinfo.encoding or "UTF-8")
+    return _report(compiled, not_found, applied, output_file)
+
+
+class _Trie:
+    __slots__ = ("children", "targets", "reached")
+
+    def __init__(self):
+        self.children = {}
+        self.targets = defaultdict(list)  # target name -> [(update index, value)]
+        self.reached = False
+
+
+class _Frame:
+    """
+    An open element in streaming mode: the update paths it ends, the child
+    names already matched, and the targets still looked for below it.
+    """
+
+    __slots__ = ("nodes", "used", "targets")
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.used = set()
+        self.targets = {}
+        for node in nodes:
+            node.reached = True
+            for target, items in node.targets.items():
+                self.targets.setdefault(target, []).extend(items)
+
+
+def _escape_text(value):
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").encode("utf-8")
+
+
+def _start_tag_end(buffer, start):
+    """
+    Offset just past the '>' closing the start tag at buffer[start], and
+    whether the tag is self-closing. Quotes in attribute values are skipped.
+    """
+    quote = None
+    i = start + 1
+    while True:
+        ch = buffer[i]
+        if quote is not None:
+            if ch == quote:
+                quote = None
+        elif ch in (0x22, 0x27):
+            quote = ch
+        elif ch == 0x3E:
+            return i + 1, buffer[i - 1] == 0x2F
+        i += 1
+
+
+class _StreamPatcher:
+    """
+    Streaming mode of patch_xbrl. expat reports the byte offset of every
+    tag, so the input is copied to the output as it is read and only the
+    content of target elements is replaced; memory is bounded by the read
+    size and the largest replaced element. Matching follows the same
+    first-child / first-descendant rules as the tree mode.
+    """
+
+    def __init__(self, updates, namespaces):
+        self.updates = updates
+        self.prefixes = dict(namespaces)
+        self.compiled = None
+        self.not_found = []
+        self.trie = _Trie()
+        self.frames = []  # _Frame per open element; None inside a replaced one
+        self.replacing = None  # (frame depth, self-closing) of the element being replaced
+        self.applied = set()
+        self.buffer = bytearray()
+        self.base = 0  # input offset of buffer[0]
+        self.out = None
+        self.parser = None
+
+    def _emit(self, upto):
+        self.out.write(self.buffer[:upto - self.base])
+        self._skip(upto)
+
+    def _skip(self, upto):
+        del self.buffer[:upto - self.base]
+        self.base = upto
+
+    def _on_namespace(self, prefix, uri):
+        # Declarations on the root element, reported before its start.
+        if prefix and not self.frames:
+            self.prefixes[prefix] = uri
+
+    def _on_start(self, name, attributes):
+        if self.compiled is None:
+            self.compiled, self.not_found = _compile_updates(self.updates, self.prefixes)
+            for number, path, target, names, target_name, value in self.compiled:
+                node = self.trie
+                for part in names:
+                    node = node.children.setdefault(part, _Trie())
+                node.targets[target_name].append((number, value))
+            self.frames.append(_Frame([self.trie]))
+            return
+        if self.replacing is not None:
+            self.frames.append(None)
+            return
+
+        uri, _, local = name.rpartition(" ")
+        keys = (f"{{{uri}}}{local}", local) if uri else (local,)
+        parent = self.frames[-1]
+        nodes = []
+        for node in parent.nodes:
+            for key in keys:
+                child = node.children.get(key)
+                if child is not None and (id(node), key) not in parent.used:
+                    parent.used.add((id(node), key))
+                    nodes.append(child)
+
+        # First descendant with a target's name below the element that ends its path?
+        chosen = []
+        for ancestor in self.frames:
+            if ancestor is not None:
+                for key in keys:
+                    chosen.extend(ancestor.targets.pop(key, ()))
+        self.frames.append(_Frame(nodes))
+        if not chosen:
+            return
+
+        self._emit(self.parser.CurrentByteIndex)
+        end, self_closing = _start_tag_end(self.buffer, 0)
+        value = max(chosen)[1]  # the last update in table order wins
+        self.applied.update(number for number, _ in chosen)
+        if self_closing:
+            tag = bytes(self.buffer[1:end - 2]).split(None, 1)[0]
+            self.out.write(bytes(self.buffer[:end - 2]).rstrip() + b">" + _escape_text(value) + b"</" + tag + b">")
+            self._skip(self.base + end)
+        else:
+            self._emit(self.base + end)
+            self.out.write(_escape_text(value))
+        self.replacing = (len(self.frames) - 1, self_closing)
+
+    def _on_end(self, name):
+        if self.replacing is not None and self.replacing[0] == len(self.frames) - 1:
+            if not self.replacing[1]:
+                # Drop the old content; the end tag is copied with what follows.
+                self._skip(self.parser.CurrentByteIndex)
+            self.replacing = None
+        self.frames.pop()
+
+    def run(self, input_file, output_file):
+        self.parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+        self.parser.StartNamespaceDeclHandler = self._on_namespace
+        self.parser.StartElementHandler = self._on_start
+        self.parser.EndElementHandler = self._on_end
+        with open(input_file, "rb") as f, open(output_file, "wb") as self.out:
+            while True:
+                chunk = f.read(STREAM_READ_SIZE)
+                self.buffer.extend(chunk)
+                self.parser.Parse(chunk, not chunk)
+                if not chunk:
+                    break
+                if self.replacing is None:
+                    # Keep a tag that may be cut off; it could still become a target.
+                    self._emit(self.base + max(self.buffer.rfind(b"<"), 0))
+            self._emit(self.base + len(self.buffer))
+
+        for number, path, target, names, target_name, value in self.compiled or ():
+            if number not in self.applied:
+                node = self.trie
+                for part in names:
+                    node = node.children[part]
+                reason = f"target not found: {target_name}" if node.reached else "path not found"
+                self.not_found.append(_not_found(number, path, target, reason))
+        return _report(self.compiled or [], self.not_found, len(self.applied), output_file)
+
+
+if __name__ == "__main__":
+    input_xbrl = "output.xbrl"      # Instance to patch
+    updates_file = "updates.csv"    # Table with path, target and value columns
+    output_xbrl = "patched.xbrl"    # Patched instance
+    report = patch_xbrl(input_xbrl, output_xbrl, read_updates(updates_file))
+    print(f"Applied {report['applied']} of {report['updates']} updates to: {output_xbrl}")
+    for item in report["not_found"]:
+        print(f"Not found: {item['path']} / {item['target']} ({item['reason']})")